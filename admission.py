@@ -0,0 +1,155 @@
+"""Admission control for commands that wait on a guild's sheets lock.
+
+Commands that read or write the sheets queue up behind each other and behind the
+background wishlist sync. Rather than letting them wait for as long as that takes,
+each guild's Admission keeps track of who is waiting:
+
+- once the queue holds `max_depth` commands, new ones are turned away straight away
+- the same command sent again by the same person while the first is still waiting is
+  dropped, and they're told where the first one is in line
+- anyone still waiting after a moment is told their place in line
+- a command that hasn't started by its deadline is given up on, so nobody comes back
+  to an answer to a question they asked ten minutes ago
+
+Commands only count as waiting until they get the lock. One that has started is left to
+finish, since it may be halfway through writing to the sheets.
+"""
+
+import time
+import asyncio
+import logging
+import contextlib
+
+import metrics
+
+# Most commands a guild can have waiting at once
+DEFAULT_QUEUE_DEPTH = 10
+
+# Seconds a command may wait to start before it's given up on
+DEFAULT_DEADLINE_SECONDS = 60
+
+# Commands allowed a different deadline. `!sync` may have a whole sync cycle ahead of it.
+DEFAULT_DEADLINES = {"sync": 180}
+
+# Seconds of waiting before someone is told their place in line
+QUEUE_NOTICE_SECONDS = 2
+
+
+class QueueFull(Exception):
+    """There were already as many commands waiting as allowed."""
+
+
+class AlreadyQueued(Exception):
+    """The same person already has the same command waiting."""
+
+    def __init__(self, position):
+        super().__init__(f"already queued at position {position}")
+        self.position = position
+
+
+class DeadlineExceeded(Exception):
+    """The command waited for longer than its deadline without starting."""
+
+
+class _Ticket:
+    def __init__(self, key):
+        self.key = key
+        self.queued = time.monotonic()
+
+
+class Admission:
+    """The commands waiting on one guild's sheets lock, in the order they arrived."""
+
+    def __init__(self, lock, guild):
+        self.lock = lock
+        self.guild = guild
+        self.waiting = []
+        # Queue notices being sent, kept so they aren't garbage collected halfway
+        self._notices = set()
+
+    def position(self, key):
+        """Place in line (from 1) of the waiting command with that key, or None."""
+        for i, ticket in enumerate(self.waiting):
+            if ticket.key == key:
+                return i + 1
+        return None
+
+    def _update_depth(self):
+        metrics.set_gauge(
+            "mtgardener_admission_queue_depth", len(self.waiting), guild=self.guild
+        )
+
+    async def _notice(self, ticket, notify):
+        await asyncio.sleep(QUEUE_NOTICE_SECONDS)
+        position = self.position(ticket.key)
+        if position is None:
+            return
+        try:
+            await notify(position)
+        except Exception as e:
+            logging.warning(f"Couldn't tell {ticket.key[0]} their place in line: {e}")
+
+    @contextlib.asynccontextmanager
+    async def admit(
+        self,
+        key,
+        command,
+        exclusive,
+        deadline=DEFAULT_DEADLINE_SECONDS,
+        max_depth=DEFAULT_QUEUE_DEPTH,
+        notify=None,
+    ):
+        """Hold the sheets lock for a command, once it gets through the queue.
+
+        `key` identifies the request, so the same one isn't queued twice. `notify` is
+        awaited with the command's place in line if it has to wait for a while.
+        """
+        if not self.lock.would_wait(exclusive):
+            access = self.lock.exclusive() if exclusive else self.lock.shared()
+            async with access:
+                metrics.inc(
+                    "mtgardener_admissions_total", command=command, outcome="ok"
+                )
+                yield
+            return
+
+        position = self.position(key)
+        if position is not None:
+            metrics.inc(
+                "mtgardener_admissions_total", command=command, outcome="duplicate"
+            )
+            raise AlreadyQueued(position)
+        if len(self.waiting) >= max_depth:
+            metrics.inc("mtgardener_admissions_total", command=command, outcome="full")
+            raise QueueFull()
+
+        ticket = _Ticket(key)
+        self.waiting.append(ticket)
+        self._update_depth()
+        notice = None
+        if notify is not None:
+            notice = asyncio.ensure_future(self._notice(ticket, notify))
+            self._notices.add(notice)
+            notice.add_done_callback(self._notices.discard)
+
+        access = self.lock.exclusive if exclusive else self.lock.shared
+        async with contextlib.AsyncExitStack() as stack:
+            try:
+                await stack.enter_async_context(access(timeout=deadline))
+            except asyncio.TimeoutError:
+                metrics.inc(
+                    "mtgardener_admissions_total", command=command, outcome="expired"
+                )
+                raise DeadlineExceeded() from None
+            finally:
+                if notice is not None:
+                    notice.cancel()
+                self.waiting.remove(ticket)
+                self._update_depth()
+            metrics.inc("mtgardener_admissions_total", command=command, outcome="ok")
+            metrics.observe(
+                "mtgardener_admission_wait_seconds",
+                time.monotonic() - ticket.queued,
+                command=command,
+            )
+            yield
@@ -0,0 +1,87 @@
+"""Writing attendance points back to the roster sheet.
+
+`!att stop` works out how many points each member earned at an event. They go into a
+column of the roster worksheet headed with the event's name and start time, using one read
+of the worksheet to find everyone's row and one batched write. Recording the same event
+again finds its column by that header and writes the whole column over, so a retry never
+counts anyone twice.
+"""
+
+from gspread.utils import (
+    absolute_range_name,
+    column_letter_to_index,
+    fill_gaps,
+    rowcol_to_a1,
+)
+
+# Column of the roster worksheet holding each row's character name
+DEFAULT_NAME_COLUMN = "A"
+
+
+def event_label(event_name, started):
+    """The header of an event's column: its name and when it started, to the minute, so
+    two events of the same name on one day get a column each."""
+    return f"{event_name or 'Event'} {started.format('YYYY-MM-DD HH:mm')}"
+
+
+def event_column(rows, label, points, name_column=DEFAULT_NAME_COLUMN):
+    """Where an event's points go, given every row of the roster worksheet.
+
+    Returns (column number, the column's values from the header down, characters not on
+    the roster). The event's existing column is reused if there is one, otherwise it gets
+    the first column past everything in use. Rows of characters without points are left
+    blank.
+    """
+    header = rows[0] if rows else []
+    if label in header:
+        column = header.index(label) + 1
+    else:
+        column = max(len(header), column_letter_to_index(name_column)) + 1
+
+    name_index = column_letter_to_index(name_column) - 1
+    row_numbers = {}
+    for i, row in enumerate(rows[1:], start=1):
+        name = row[name_index].strip().lower() if name_index < len(row) else ""
+        if name and name not in row_numbers:
+            row_numbers[name] = i
+
+    values = [[label]] + [[""] for _ in rows[1:]]
+    missing = []
+    for character, earned in points.items():
+        i = row_numbers.get(character.strip().lower())
+        if i is None:
+            missing.append(character)
+        else:
+            values[i] = [earned]
+    return column, values, missing
+
+
+async def write_back(ss, sheet_name, label, points, name_column=None):
+    """Record `points` ({main character: points}) for an event on the roster worksheet of
+    the open spreadsheet `ss`.
+
+    Returns (the column's A1 letter, characters not on the roster).
+    """
+    response = await ss.values_get(absolute_range_name(sheet_name))
+    rows = fill_gaps(response.get("values", []))
+    column, values, missing = event_column(
+        rows, label, points, name_column or DEFAULT_NAME_COLUMN
+    )
+
+    first = rowcol_to_a1(1, column)
+    last = rowcol_to_a1(len(values), column)
+    # gspread_asyncio doesn't wrap the spreadsheet-wide batch update, so go through its
+    # client manager the way write_buffer does
+    await ss.agcm._call(
+        ss.ss.values_batch_update,
+        body={
+            "valueInputOption": "RAW",
+            "data": [
+                {
+                    "range": absolute_range_name(sheet_name, f"{first}:{last}"),
+                    "values": values,
+                }
+            ],
+        },
+    )
+    return first.rstrip("0123456789"), missing
@@ -0,0 +1,162 @@
+"""Attendance tracking sessions, several of which can run in a guild at once.
+
+`!att start` opens a session for an event, bound to a set of voice channels: the
+configured event channel group unless others are named. Each session keeps when every
+member entered and left its channels. Voice state updates are handed to the sessions
+watching the channels involved through an index from channel to sessions, so each update
+costs the same however many sessions are running.
+"""
+
+import arrow
+
+# The name of a session started without one
+DEFAULT_NAME = "Event"
+
+# Seconds of attendance worth a point
+SECONDS_PER_POINT = 60 * 60
+
+_NO_SESSIONS = frozenset()
+
+
+class SessionExists(Exception):
+    """A session of that name is already running."""
+
+
+class AttendanceSession:
+    """One event's attendance, in the voice channels it was started for."""
+
+    def __init__(self, name, channels, started=None):
+        self.name = name
+        self.channels = list(channels)
+        self.started = started or arrow.now()
+        # The reply to `!att start`, which `!att stop` replies to in turn
+        self.message = None
+        # str(member) -> when they entered and left the session's channels, alternately
+        self.tracker = {}
+        # str(member) -> member, so the results don't need the guild's member list
+        self.members = {}
+
+    def mark(self, member, when=None):
+        """Note that `member` entered or left the session's channels."""
+        name = str(member)
+        if name not in self.tracker:
+            self.tracker[name] = []
+            self.members[name] = member
+        self.tracker[name].append(when or arrow.now())
+
+    def mark_present(self, when=None):
+        """Mark everyone in the session's channels, as they're entering at the start
+        or leaving at the end."""
+        when = when or arrow.now()
+        for channel in self.channels:
+            for member in channel.members:
+                self.mark(member, when)
+
+    def results(self, ended):
+        """str(member) -> (points, fraction of the session attended)."""
+        duration = (ended - self.started).seconds
+        results = {}
+        for name, timestamps in self.tracker.items():
+            pairs = [
+                (timestamps[i], timestamps[i - 1])
+                for i in range(len(timestamps) - 1, 0, -2)
+            ]
+            total = 0
+            for end, start in pairs:
+                total += (end - start).seconds
+
+            # hacky work-around, if the total time is EXACTLY a half hour increment
+            # add in one second to avoid banker's rounding
+            if total % (SECONDS_PER_POINT // 2) == 0:
+                total += 1
+
+            results[name] = (
+                round(total / SECONDS_PER_POINT),
+                total / duration if duration else 0,
+            )
+        return results
+
+
+class AttendanceSessions:
+    """The attendance sessions running in one guild, and the events tracked last."""
+
+    def __init__(self):
+        # Lowercased name -> session
+        self.sessions = {}
+        # Channel ID -> sessions watching it
+        self.by_channel = {}
+        # Lowercased name -> (column header, {main character: points}), oldest first
+        self.last_events = {}
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def start(self, name, channels):
+        """Start a session watching `channels`. Raises SessionExists if that name is
+        already running."""
+        name = name or DEFAULT_NAME
+        if name.lower() in self.sessions:
+            raise SessionExists(name)
+        session = AttendanceSession(name, channels)
+        self.sessions[name.lower()] = session
+        for channel in session.channels:
+            self.by_channel.setdefault(channel.id, set()).add(session)
+        return session
+
+    def find(self, name=None):
+        """The running session called `name`, or the only one running if no name is
+        given. Raises LookupError, with something to tell the user, if there isn't one.
+        """
+        if name is not None:
+            if name.lower() not in self.sessions:
+                raise LookupError(f"There's no attendance session called {name}.")
+            return self.sessions[name.lower()]
+        if not self.sessions:
+            raise LookupError("There's no attendance session running.")
+        if len(self.sessions) > 1:
+            names = ", ".join(session.name for session in self.sessions.values())
+            raise LookupError(f"Which session? These are running: {names}.")
+        return next(iter(self.sessions.values()))
+
+    def stop(self, name=None):
+        """Stop tracking a session (see `find`) and return it."""
+        session = self.find(name)
+        del self.sessions[session.name.lower()]
+        for channel in session.channels:
+            watching = self.by_channel.get(channel.id)
+            if watching:
+                watching.discard(session)
+                if not watching:
+                    del self.by_channel[channel.id]
+        return session
+
+    def _watching(self, channel):
+        if channel is None:
+            return _NO_SESSIONS
+        return self.by_channel.get(channel.id, _NO_SESSIONS)
+
+    def voice_update(self, member, before, after):
+        """Pass a voice state change on to the sessions watching either channel."""
+        if not self.by_channel:
+            return
+        was_in = self._watching(before)
+        now_in = self._watching(after)
+        if was_in is now_in:
+            return
+        when = arrow.now()
+        # Entered one of a session's channels, or left all of them
+        for session in was_in ^ now_in:
+            session.mark(member, when)
+
+    def record(self, name, event):
+        """Keep an event's points, to be saved again later if need be."""
+        self.last_events.pop(name.lower(), None)
+        self.last_events[name.lower()] = event
+
+    def last_event(self, name=None):
+        """The points of the event tracked under `name`, or the last one tracked."""
+        if name is not None:
+            return self.last_events.get(name.lower())
+        if not self.last_events:
+            return None
+        return next(reversed(self.last_events.values()))
@@ -0,0 +1,568 @@
+"""In-memory stand-ins for Google Sheets, Google Drive and discord.py.
+
+The Sheets fakes mimic the synchronous gspread objects that gspread_asyncio wraps, so the
+bot's real client manager (and everything layered on it) runs unchanged on top of them.
+The Drive fake is a local HTTP server speaking the subset of the Drive v3 API the bot
+uses. Every fake can add latency and inject failures.
+"""
+
+import re
+import json
+import time
+import random
+import asyncio
+import itertools
+from types import SimpleNamespace
+from datetime import datetime, timezone
+
+import discord
+import gspread
+import gspread_asyncio
+from aiohttp import web
+
+from sheets_client import GardenerClientManager
+
+
+def column_index(letters):
+    index = 0
+    for letter in letters.upper():
+        index = index * 26 + (ord(letter) - ord("A") + 1)
+    return index
+
+
+A1_CELL = re.compile(r"^([A-Za-z]*)(\d*)$")
+
+
+def parse_range(range_name):
+    """Split an A1 range into (sheet, first row, first col, last row, last col).
+
+    Rows and columns are 1-based; open-ended bounds (as in "A:D") are None. A quoted
+    sheet name on its own is the whole sheet.
+    """
+    sheet = None
+    if "!" in range_name:
+        sheet, range_name = range_name.rsplit("!", 1)
+        sheet = sheet.strip("'")
+    elif range_name.startswith("'"):
+        return range_name.strip("'"), None, None, None, None
+    start, _, end = range_name.partition(":")
+    end = end or start
+    bounds = []
+    for cell in (start, end):
+        letters, digits = A1_CELL.match(cell).groups()
+        bounds.append(
+            (
+                int(digits) if digits else None,
+                column_index(letters) if letters else None,
+            )
+        )
+    (r1, c1), (r2, c2) = bounds
+    return sheet, r1, c1, r2, c2
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.text = f"Injected failure ({status_code})"
+
+    def json(self):
+        return {
+            "error": {
+                "code": self.status_code,
+                "message": self.text,
+                "status": "INJECTED",
+            }
+        }
+
+
+class FakeBackend:
+    """Shared state for the fake Google APIs: spreadsheets, latency, failures and call counts."""
+
+    def __init__(self, latency=0.0, failure_rate=0.0, failure_status=429, seed=0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.random = random.Random(seed)
+        self.spreadsheets = {}
+        self.calls = {}
+        self.client = FakeClient(self)
+
+    def request(self, name):
+        """Account for one API request. Runs on gspread_asyncio's executor thread."""
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            raise gspread.exceptions.APIError(FakeResponse(self.failure_status))
+
+    def add_spreadsheet(self, key, title, worksheets):
+        ss = FakeSpreadsheet(self, key, title)
+        for ws_title, rows in worksheets.items():
+            ss.add_worksheet(ws_title, rows)
+        self.spreadsheets[key] = ss
+        return ss
+
+
+class FakeAuth:
+    token = "fake-token"
+
+    def refresh(self, request):
+        pass
+
+
+class FakeClient:
+    def __init__(self, backend):
+        self.backend = backend
+        self.auth = FakeAuth()
+
+    def open_by_key(self, key):
+        self.backend.request("open_by_key")
+        if key not in self.backend.spreadsheets:
+            raise gspread.exceptions.SpreadsheetNotFound(key)
+        return self.backend.spreadsheets[key]
+
+
+class FakeSpreadsheet:
+    def __init__(self, backend, key, title):
+        self.backend = backend
+        self.id = key
+        self.title = title
+        self.worksheets_by_title = {}
+        self.url = f"https://docs.google.com/spreadsheets/d/{key}"
+        self.modified_time = "2020-01-01T00:00:00Z"
+
+    def touch(self):
+        """Record a write, as Drive's modifiedTime would."""
+        self.modified_time = datetime.now(timezone.utc).isoformat()
+
+    def add_worksheet(self, title, rows):
+        ws = FakeWorksheet(self, title, len(self.worksheets_by_title), rows)
+        self.worksheets_by_title[title] = ws
+        return ws
+
+    def worksheet(self, title):
+        self.backend.request("worksheet")
+        if title not in self.worksheets_by_title:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return self.worksheets_by_title[title]
+
+    def _value_range(self, range_name):
+        sheet, r1, c1, r2, c2 = parse_range(range_name)
+        values = self.worksheets_by_title[sheet]._read(r1, c1, r2, c2)
+        value_range = {"range": range_name, "majorDimension": "ROWS"}
+        if any(any(cell != "" for cell in row) for row in values):
+            value_range["values"] = values
+        return value_range
+
+    def values_get(self, range, params=None):
+        self.backend.request("values_get")
+        return self._value_range(range)
+
+    def values_batch_get(self, ranges, params=None):
+        self.backend.request("values_batch_get")
+        return {
+            "spreadsheetId": self.id,
+            "valueRanges": [self._value_range(r) for r in ranges],
+        }
+
+    def values_batch_update(self, body=None):
+        self.backend.request("values_batch_update")
+        self.touch()
+        for value_range in body["data"]:
+            sheet, r1, c1, _, _ = parse_range(value_range["range"])
+            self.worksheets_by_title[sheet]._write(r1, c1, value_range["values"])
+        return {"spreadsheetId": self.id, "totalUpdatedRanges": len(body["data"])}
+
+    def values_batch_clear(self, params=None, body=None):
+        self.backend.request("values_batch_clear")
+        self.touch()
+        for range_name in body["ranges"]:
+            sheet, r1, c1, r2, c2 = parse_range(range_name)
+            self.worksheets_by_title[sheet]._clear(r1, c1, r2, c2)
+        return {"spreadsheetId": self.id, "clearedRanges": body["ranges"]}
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, title, index, rows):
+        self.spreadsheet = spreadsheet
+        self.backend = spreadsheet.backend
+        self.title = title
+        self.id = index
+        self.rows = [list(row) for row in rows]
+        self._properties = {"index": index, "title": title, "sheetId": index}
+
+    def _width(self):
+        return max((len(row) for row in self.rows), default=0)
+
+    def _read(self, r1, c1, r2, c2):
+        r1 = r1 or 1
+        c1 = c1 or 1
+        r2 = r2 or len(self.rows)
+        c2 = c2 or self._width()
+        values = []
+        for r in range(r1, min(r2, len(self.rows)) + 1):
+            row = self.rows[r - 1]
+            values.append(
+                [row[c - 1] if c <= len(row) else "" for c in range(c1, c2 + 1)]
+            )
+        # The API omits trailing empty rows
+        while values and not any(values[-1]):
+            values.pop()
+        return values
+
+    def _write(self, r1, c1, values):
+        for dr, row_values in enumerate(values):
+            r = r1 + dr
+            while len(self.rows) < r:
+                self.rows.append([])
+            row = self.rows[r - 1]
+            for dc, value in enumerate(row_values):
+                c = c1 + dc
+                while len(row) < c:
+                    row.append("")
+                row[c - 1] = str(value)
+
+    def _clear(self, r1, c1, r2, c2):
+        r2 = r2 or len(self.rows)
+        for r in range((r1 or 1), min(r2, len(self.rows)) + 1):
+            row = self.rows[r - 1]
+            for c in range((c1 or 1), min(c2 or len(row), len(row)) + 1):
+                row[c - 1] = ""
+
+    def get_values(self, range_name=None, **kwargs):
+        self.backend.request("get_values")
+        if range_name is None:
+            return self._read(None, None, None, None)
+        _, r1, c1, r2, c2 = parse_range(range_name)
+        return self._read(r1, c1, r2, c2)
+
+    def get_all_values(self, **kwargs):
+        self.backend.request("get_all_values")
+        return self._read(None, None, None, None)
+
+    def col_values(self, col, value_render_option=None):
+        self.backend.request("col_values")
+        values = [row[col - 1] if col <= len(row) else "" for row in self.rows]
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def batch_clear(self, ranges):
+        self.backend.request("batch_clear")
+        self.spreadsheet.touch()
+        for range_name in ranges:
+            _, r1, c1, r2, c2 = parse_range(range_name)
+            self._clear(r1, c1, r2, c2)
+
+    def batch_update(self, data, **kwargs):
+        self.backend.request("batch_update")
+        self.spreadsheet.touch()
+        for value_range in data:
+            _, r1, c1, _, _ = parse_range(value_range["range"])
+            self._write(r1, c1, value_range["values"])
+
+    def update_cell(self, row, col, value):
+        self.backend.request("update_cell")
+        self.spreadsheet.touch()
+        self._write(row, col, [[value]])
+
+    def update(self, range_name, values=None, **kwargs):
+        self.backend.request("update")
+        self.spreadsheet.touch()
+        _, r1, c1, _, _ = parse_range(range_name)
+        self._write(r1, c1, values)
+
+
+class FakeClientManager(GardenerClientManager):
+    """The bot's client manager, authorized against a FakeBackend instead of Google."""
+
+    def __init__(self, backend, **kwargs):
+        kwargs.setdefault("gspread_delay", 0)
+        super().__init__(lambda: None, **kwargs)
+        self.backend = backend
+        self._agc = None
+
+    async def _authorize(self):
+        if self._agc is None:
+            self._agc = gspread_asyncio.AsyncioGspreadClient(self, self.backend.client)
+        return self._agc
+
+
+class FakeDrive:
+    """A local HTTP server answering Drive v3 file metadata requests, one at a time or
+    in multipart batches."""
+
+    def __init__(self, backend, latency=0.0, failure_rate=0.0, failure_status=500):
+        self.backend = backend
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.modified_times = {}
+        self.requests = 0
+        # Files looked up in batches
+        self.batched = 0
+        self.runner = None
+        self.url = None
+        self.batch_url = None
+
+    def metadata(self, file_id):
+        """(status, body) of a metadata lookup, failing at the configured rate."""
+        if self.failure_rate and self.backend.random.random() < self.failure_rate:
+            return self.failure_status, {"error": {"code": self.failure_status}}
+        if file_id not in self.backend.spreadsheets:
+            return 404, {"error": {"code": 404}}
+        ss = self.backend.spreadsheets[file_id]
+        return 200, {
+            "id": ss.id,
+            "name": ss.title,
+            "modifiedTime": self.modified_times.get(ss.id, ss.modified_time),
+            "webViewLink": ss.url,
+        }
+
+    async def handle_file(self, request):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        status, body = self.metadata(request.match_info["file_id"])
+        return web.json_response(body, status=status)
+
+    async def handle_batch(self, request):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        boundary = "batch_fake"
+        response = ""
+        reader = await request.multipart()
+        while True:
+            part = await reader.next()
+            if part is None:
+                break
+            content_id = part.headers.get("Content-ID", "").strip("<>")
+            request_line = (await part.text()).strip().split("\r\n")[0]
+            path = request_line.split(" ")[1].split("?")[0]
+            self.batched += 1
+            status, body = self.metadata(path.rsplit("/", 1)[1])
+            response += (
+                f"--{boundary}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                "Content-Type: application/json; charset=UTF-8\r\n\r\n"
+                f"{json.dumps(body)}\r\n"
+            )
+        response += f"--{boundary}--\r\n"
+        return web.Response(
+            text=response,
+            headers={"Content-Type": f"multipart/mixed; boundary={boundary}"},
+        )
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/drive/v3/files/{file_id}", self.handle_file)
+        app.router.add_post("/batch/drive/v3", self.handle_batch)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/drive/v3/files"
+        self.batch_url = f"http://127.0.0.1:{port}/batch/drive/v3"
+        return self
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+
+# ---- discord.py ----
+
+_ids = itertools.count(10_000)
+
+
+class FakeDiscord:
+    """Latency applied to every fake discord API call."""
+
+    latency = 0.0
+
+    @classmethod
+    async def call(cls):
+        if cls.latency:
+            await asyncio.sleep(cls.latency)
+
+
+class FakeRole:
+    def __init__(self, name):
+        self.id = next(_ids)
+        self.name = name
+
+
+class FakeEmoji:
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeReaction:
+    def __init__(self, emoji, users):
+        self.emoji = emoji
+        self._users = list(users)
+        self.count = len(self._users)
+
+    async def users(self):
+        await FakeDiscord.call()
+        for user in self._users:
+            yield user
+
+
+class FakeMessage:
+    def __init__(self, content="", author=None, channel=None, reactions=()):
+        self.id = next(_ids)
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.reactions = list(reactions)
+        self.jump_url = f"https://discord.com/channels/fake/{self.id}"
+        self.replies = []
+
+    async def edit(self, content=None, **kwargs):
+        await FakeDiscord.call()
+        if content is not None:
+            self.content = content
+        return self
+
+    async def reply(self, content=None, **kwargs):
+        await FakeDiscord.call()
+        reply = FakeMessage(content, channel=self.channel)
+        self.replies.append(reply)
+        return reply
+
+    async def add_reaction(self, emoji):
+        await FakeDiscord.call()
+
+    async def create_thread(self, name=None, **kwargs):
+        await FakeDiscord.call()
+        return FakeChannel(name=name)
+
+
+class FakeUser:
+    def __init__(self, name, roles=()):
+        self.id = next(_ids)
+        self.name = name
+        self.roles = list(roles)
+        self.bot = False
+        self.sent = []
+        self.voice = None
+        self.dm_channel = None
+        self.guild = None
+
+    @property
+    def mention(self):
+        return f"<@{self.id}>"
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return f"<FakeUser {self.name}>"
+
+    def __eq__(self, other):
+        return getattr(other, "id", None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    async def create_dm(self):
+        await FakeDiscord.call()
+        self.dm_channel = FakeDMChannel(name=f"dm-{self.name}")
+        return self.dm_channel
+
+    async def send(self, content=None, **kwargs):
+        if self.dm_channel is None:
+            await self.create_dm()
+        await FakeDiscord.call()
+        self.sent.append(content)
+        return FakeMessage(content, author=self)
+
+
+class FakeChannel:
+    def __init__(self, name="channel", id=None, members=(), voice_channels=()):
+        self.id = id if id is not None else next(_ids)
+        self.name = name
+        self.members = list(members)
+        self.voice_channels = list(voice_channels)
+        self.messages = []
+
+    def __repr__(self):
+        return f"<FakeChannel {self.name}>"
+
+    async def send(self, content=None, **kwargs):
+        await FakeDiscord.call()
+        message = FakeMessage(content, channel=self)
+        self.messages.append(message)
+        return message
+
+    async def fetch_message(self, id):
+        await FakeDiscord.call()
+        for message in self.messages:
+            if message.id == id:
+                return message
+        raise LookupError(id)
+
+    async def history(self, limit=100):
+        await FakeDiscord.call()
+        for message in list(reversed(self.messages))[:limit]:
+            yield message
+
+
+class FakeDMChannel(FakeChannel):
+    pass
+
+
+class FakeGuild:
+    def __init__(self, id, members=(), channels=(), roles=()):
+        self.id = id
+        self.members = list(members)
+        self.channels = list(channels)
+        self.roles = list(roles)
+        for member in self.members:
+            member.guild = self
+
+    def get_member(self, user_id):
+        for member in self.members:
+            if member.id == user_id:
+                return member
+        return None
+
+    async def fetch_member(self, user_id):
+        await FakeDiscord.call()
+        member = self.get_member(user_id)
+        if member is None:
+            raise discord.NotFound(
+                SimpleNamespace(status=404, reason="Not Found"), "Unknown Member"
+            )
+        return member
+
+    async def query_members(self, user_ids=None, limit=5, cache=True, **kwargs):
+        await FakeDiscord.call()
+        return [member for member in self.members if member.id in user_ids][:limit]
+
+
+class FakeVoiceState:
+    def __init__(self, channel=None):
+        self.channel = channel
+
+
+class FakeContext:
+    """Enough of commands.Context for invoking command callbacks directly."""
+
+    def __init__(self, author, content, guild=None):
+        self.author = author
+        self.channel = FakeDMChannel(name=f"dm-{author.name}")
+        self.message = FakeMessage(content, author=author, channel=self.channel)
+        self.guild = guild
+        self.command = SimpleNamespace(qualified_name=content.split()[0].lstrip("!"))
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        await FakeDiscord.call()
+        self.sent.append(content)
+        return FakeMessage(content, channel=self.channel)
@@ -0,0 +1,128 @@
+"""Import time of the bot and each of its modules, against a budget.
+
+Every module is imported in a fresh interpreter under `python -X importtime`, so each
+number includes everything that module pulls in. `bot` is the bot's startup path: what
+has to load before it can start logging in to discord. The modules in
+`bot.SHEETS_MODULES` are imported on a thread while it does, so they're listed on their
+own. Anything over budget is flagged, and the exit status is 1 if there was any.
+
+    poetry run python benchmarks/imports.py --budget-ms 500
+"""
+
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+
+# The bot's own modules, other than bot.py itself
+MODULES = (
+    "logs",
+    "metrics",
+    "governor",
+    "loop_watchdog",
+    "sheets",
+    "admission",
+    "registry",
+    "sync_schedule",
+    "sync_plan",
+    "profiles",
+    "members",
+    "loot_mappings",
+    "drive",
+    "sheets_client",
+    "write_buffer",
+    "wishlist_sync",
+    "job_table",
+    "replica",
+    "sync_worker",
+    "attendance",
+    "attendance_sessions",
+)
+
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_times(statement):
+    """(cumulative microseconds, module, depth) of everything imported, in the order
+    `-X importtime` lists them: a module comes right after what it imported."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{statement!r} failed:\n{result.stderr}")
+    times = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            _, cumulative, indent, name = match.groups()
+            times.append((int(cumulative), name, len(indent) // 2))
+    return times
+
+
+def measure(module, statement, repeat):
+    """Fastest of `repeat` runs: milliseconds to import `module` and its heaviest direct
+    imports. What the interpreter loads at startup isn't counted."""
+    best = None
+    for _ in range(repeat):
+        times = import_times(statement)
+        end = next(
+            i
+            for i, (_, name, depth) in enumerate(times)
+            if name == module and not depth
+        )
+        start = max(
+            (i + 1 for i, (_, _, depth) in enumerate(times[:end]) if not depth),
+            default=0,
+        )
+        total = times[end][0]
+        if best is None or total < best[0]:
+            best = (total, times[start:end])
+    total, imported = best
+    heaviest = sorted(
+        (cumulative, name) for cumulative, name, depth in imported if depth == 1
+    )[::-1]
+    return total / 1000, heaviest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report import time per module")
+    parser.add_argument("--budget-ms", type=float, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=3)
+    args = parser.parse_args()
+
+    statements = [("bot", "import bot")] + [
+        (module, f"import {module}") for module in MODULES
+    ]
+
+    header = f"{'module':<16}{'ms':>8}  {'heaviest imports (ms)'}"
+    print(header)
+    print("-" * 72)
+    over = []
+    for module, statement in statements:
+        total, heaviest = measure(module, statement, args.repeat)
+        flag = "!" if total > args.budget_ms else " "
+        if flag == "!":
+            over.append(module)
+        top = ", ".join(
+            f"{name} {cumulative / 1000:.0f}"
+            for cumulative, name in heaviest[: args.top]
+        )
+        print(f"{module:<16}{total:>8.1f}{flag} {top}")
+
+    print()
+    if over:
+        print(f"Over the {args.budget_ms:.0f} ms budget: {', '.join(over)}")
+        sys.exit(1)
+    print(f"Everything imports within {args.budget_ms:.0f} ms.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Resident memory of the member cache, full versus lean.
+
+Builds a guild the way discord.py does from the gateway, with every member loaded (as
+chunking would at startup) and some of them in voice channels, under each
+`member_cache` mode. It then measures what stays allocated. In lean mode the LRU of
+looked-up members is filled to capacity too, so the numbers are the worst case.
+Nothing talks to discord.
+
+    poetry run python benchmarks/memory.py --members 1000 10000 50000
+"""
+
+import os
+import sys
+import gc
+import argparse
+import tracemalloc
+
+import discord
+from discord.state import ConnectionState
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import members  # noqa: E402
+
+GUILD_ID = 1
+VOICE_CHANNEL_ID = 2
+FIRST_USER_ID = 10**17
+
+
+def member_data(i):
+    return {
+        "user": {
+            "id": str(FIRST_USER_ID + i),
+            "username": f"member{i}",
+            "discriminator": "0",
+            "avatar": None,
+            "global_name": f"Member {i}",
+        },
+        "roles": [str(GUILD_ID)],
+        "joined_at": "2020-01-01T00:00:00+00:00",
+        "deaf": False,
+        "mute": False,
+        "nick": None,
+        "flags": 0,
+    }
+
+
+def guild_data(count, in_voice):
+    return {
+        "id": str(GUILD_ID),
+        "name": "Mother Tree",
+        "member_count": count,
+        "roles": [
+            {
+                "id": str(GUILD_ID),
+                "name": "@everyone",
+                "permissions": "0",
+                "position": 0,
+                "color": 0,
+                "hoist": False,
+                "managed": False,
+                "mentionable": False,
+            }
+        ],
+        "channels": [
+            {
+                "id": str(VOICE_CHANNEL_ID),
+                "type": 2,
+                "name": "Event",
+                "position": 0,
+                "permission_overwrites": [],
+                "bitrate": 64000,
+                "user_limit": 0,
+            }
+        ],
+        "voice_states": [
+            {
+                "user_id": str(FIRST_USER_ID + i),
+                "channel_id": str(VOICE_CHANNEL_ID),
+                "session_id": str(i),
+                "deaf": False,
+                "mute": False,
+                "self_deaf": False,
+                "self_mute": False,
+                "suppress": False,
+                "request_to_speak_timestamp": None,
+            }
+            for i in range(min(in_voice, count))
+        ],
+        "members": [member_data(i) for i in range(count)],
+    }
+
+
+def measure(mode, count, in_voice, lru_size):
+    """Bytes left allocated by a guild of `count` members, and how many are cached."""
+    intents = discord.Intents.default()
+    intents.members = True
+    options = members.client_options(mode)
+    flags = options.get(
+        "member_cache_flags", discord.MemberCacheFlags.from_intents(intents)
+    )
+    data = guild_data(count, in_voice)
+
+    gc.collect()
+    tracemalloc.start()
+    state = ConnectionState(
+        dispatch=lambda *args: None,
+        handlers={},
+        hooks={},
+        http=None,
+        intents=intents,
+        member_cache_flags=flags,
+    )
+    guild = discord.Guild(data=data, state=state)
+    cache = members.MemberCache(lru_size)
+    if mode == "lean":
+        for i in range(min(lru_size, count)):
+            member = discord.Member(data=member_data(i), guild=guild, state=state)
+            cache._remember(guild, member.id, member)
+    del data
+    gc.collect()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return allocated, len(guild.members) + len(cache.entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure member cache memory")
+    parser.add_argument("--members", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--in-voice", type=int, default=40)
+    parser.add_argument("--lru-size", type=int, default=members.DEFAULT_SIZE)
+    args = parser.parse_args()
+
+    header = f"{'mode':<6}{'members':>9}{'cached':>9}{'memory (MB)':>13}"
+    print(header)
+    print("-" * len(header))
+    for count in args.members:
+        for mode in ("full", "lean"):
+            allocated, cached = measure(mode, count, args.in_voice, args.lru_size)
+            print(f"{mode:<6}{count:>9}{cached:>9}{allocated / 1e6:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
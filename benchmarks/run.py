@@ -0,0 +1,578 @@
+"""Offline benchmarks for MT Gardener.
+
+Runs the bot's wishlist sync, `!job`, `!alertjobs`, `!dyna` and attendance paths against
+the in-memory fakes in `fakes.py`, at several roster sizes, and reports wall time, CPU
+time and the number of Sheets/Drive API calls each one cost. Nothing talks to discord or
+Google. A scenario that goes over its CPU budget (see CPU_BUDGETS) fails the run.
+
+    poetry run python benchmarks/run.py --members 50 100 250 500 --sheets-latency 0.05
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import contextlib
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import drive  # noqa: E402
+import loot_mappings  # noqa: E402
+from fakes import (  # noqa: E402
+    FakeBackend,
+    FakeChannel,
+    FakeClientManager,
+    FakeContext,
+    FakeDiscord,
+    FakeDrive,
+    FakeEmoji,
+    FakeGuild,
+    FakeMessage,
+    FakeReaction,
+    FakeRole,
+    FakeUser,
+    FakeVoiceState,
+    parse_range,
+)
+
+SERVER_ID = 1
+FEEDBACK_CHANNEL_ID = 2
+FUTURE_OUTLOOK_ID = 3
+ALERT_CHANNEL_ID = 4
+EVENT_CHANNEL_GROUP_ID = 6
+PARTY_COMP_CHANNEL_ID = 7
+PROBOT_ID = 8
+
+# Scenario -> CPU seconds it may take per member. Generous, but far below what a
+# quadratic slip (like comparing every buffered write with every other) costs at 500.
+CPU_BUDGETS = {"sync_wishlists": 0.02}
+
+JOBS = ["WAR", "MNK", "WHM", "BLM", "RDM", "THF", "PLD", "DRK", "BRD", "COR", "SAM"]
+
+
+def write_config(workdir, log_path=None):
+    """Write a throwaway bot configuration into `workdir`, returning its path."""
+    config = {
+        "bot_token": "offline",
+        "server_id": SERVER_ID,
+        "feedback_channel_id": FEEDBACK_CHANNEL_ID,
+        "future_outlook_id": FUTURE_OUTLOOK_ID,
+        "alert_channel_id": ALERT_CHANNEL_ID,
+        # Replaced with the fake alert message's ID once the world is built
+        "alert_message_id": 0,
+        "event_channel_group_id": EVENT_CHANNEL_GROUP_ID,
+        "party_comp_channel_id": PARTY_COMP_CHANNEL_ID,
+        "roster_sheet_name": "Roster",
+        "party_sheet_name": "Party",
+        "dynamis_wishlist_sheet_name": "Dynamis Wishlists",
+        "google_service_account_creds": os.path.join(workdir, "creds.json"),
+        "google_sheets_url": "https://docs.google.com/spreadsheets/d/main/edit",
+        "job_sheets_url": "https://docs.google.com/spreadsheets/d/jobs/edit",
+        "council_sheets_url": "https://docs.google.com/spreadsheets/d/council/edit",
+        "probot_id": PROBOT_ID,
+        "logging_path": log_path or os.path.join(workdir, "bot.log"),
+        "replica_path": os.path.join(workdir, "replica.sqlite3"),
+    }
+    config_path = os.path.join(workdir, "config.yml")
+    with open(config_path, "w") as f:
+        yaml.safe_dump(config, f)
+    return config_path
+
+
+def load_bot(workdir, log_path=None):
+    """Import bot.py and set it up with a throwaway configuration."""
+    import bot
+
+    bot.setup(["--config", write_config(workdir, log_path)])
+
+    # Keep the log in the file, out of the report
+    bot.log_listener.handlers = tuple(
+        handler
+        for handler in bot.log_listener.handlers
+        if type(handler) is not logging.StreamHandler
+    )
+    return bot
+
+
+class World:
+    """A guild, its members and the council/job/wishlist spreadsheets, all fake."""
+
+    def __init__(self, bot_module, members, args):
+        self.bot_module = bot_module
+        self.rng = random.Random(args.seed)
+        self.backend = FakeBackend(
+            latency=args.sheets_latency,
+            failure_rate=args.failure_rate,
+            failure_status=args.failure_status,
+            seed=args.seed,
+        )
+        self.drive = FakeDrive(
+            self.backend, latency=args.drive_latency, failure_rate=args.failure_rate
+        )
+        FakeDiscord.latency = args.discord_latency
+
+        self.council_role = FakeRole("Elder Tree Treants (Council)")
+        self.hiatus_role = FakeRole("Hiatus")
+        self.members = []
+        for i in range(members):
+            roles = [self.hiatus_role] if self.rng.random() < 0.1 else []
+            self.members.append(FakeUser(f"member{i}", roles=roles))
+        self.council = FakeUser("council", roles=[self.council_role])
+
+        self.build_sheets()
+        self.build_channels()
+
+    def character(self, i, alt=False):
+        return f"{'Alt' if alt else 'Main'}{i}"
+
+    def build_sheets(self):
+        synced_at = "2023-01-01T00:00:00+00:00"
+        submissions = [["Main", "Alt", "Updated", "Discord", "Wishlist", "Inactive"]]
+        names = [["Character"]]
+        for i, member in enumerate(self.members):
+            has_alt = i % 2 == 0
+            submissions.append(
+                [
+                    self.character(i),
+                    self.character(i, alt=True) if has_alt else "",
+                    synced_at,
+                    str(member),
+                    f"https://docs.google.com/spreadsheets/d/wishlist{i}/edit",
+                    "FALSE",
+                ]
+            )
+            names.append([self.character(i)])
+            if has_alt:
+                names.append([self.character(i, alt=True)])
+
+        dynamis = [list(row) for row in names]
+        for row in dynamis[1:]:
+            row.extend(
+                self.rng.choice(JOBS + [""])
+                + ("" if self.rng.random() < 0.5 else " acc")
+                for _ in range(62)
+            )
+
+        self.backend.add_spreadsheet(
+            "council",
+            "Council",
+            {
+                "Wishlist Submissions": submissions,
+                "Dynamis Wishlists": dynamis,
+                "Sky Requests": [list(row) for row in names],
+                "Sea Requests": [list(row) for row in names],
+                "Limbus Requests": [list(row) for row in names],
+            },
+        )
+
+        party = [["Note", "Character", "Job"]]
+        assigned = self.rng.sample(range(len(self.members)), min(36, len(self.members)))
+        for slot in range(42):
+            if slot % 7 == 0:
+                party.append([f"Party {slot // 7 + 1}", "", ""])
+            elif assigned:
+                party.append(
+                    ["", self.character(assigned.pop()), self.rng.choice(JOBS)]
+                )
+            else:
+                party.append(["", "", ""])
+        self.backend.add_spreadsheet("jobs", "Jobs", {"Party": party})
+
+        roster = [["Character", "Job", "Event 2023-01-01"]]
+        for i in range(len(self.members)):
+            roster.append([self.character(i), self.rng.choice(JOBS), "1"])
+        self.backend.add_spreadsheet("main", "Tracker", {"Roster": roster})
+
+        wishlist_ranges = [
+            *[
+                r
+                for mapping in loot_mappings.DYNAMIS_MAIN + loot_mappings.DYNAMIS_ALT
+                for r in mapping
+            ],
+            *loot_mappings.SKY_MAIN,
+            *loot_mappings.SKY_ALT,
+            *loot_mappings.SEA_MAIN,
+            *loot_mappings.SEA_ALT,
+            *loot_mappings.LIMBUS_MAIN,
+            *loot_mappings.LIMBUS_ALT,
+        ]
+        for i, member in enumerate(self.members):
+            ss = self.backend.add_spreadsheet(
+                f"wishlist{i}",
+                f"{self.character(i)}'s Wishlist",
+                {
+                    "INSTRUCTIONS": [
+                        [],
+                        [
+                            "",
+                            "",
+                            "",
+                            self.character(i),
+                            "",
+                            self.character(i, alt=True) if i % 2 == 0 else "",
+                        ],
+                    ],
+                    "DYNAMIS": [],
+                    "SKY": [],
+                    "SEA": [],
+                },
+            )
+            for range_name in wishlist_ranges:
+                if self.rng.random() < 0.6:
+                    sheet, cell = range_name.split("!")
+                    ws = ss.worksheets_by_title[sheet]
+                    _, r, c, _, _ = parse_range(cell)
+                    ws._write(r, c, [[self.rng.choice(JOBS)]])
+
+    def build_channels(self):
+        subscribers = [m for m in self.members if self.rng.random() < 0.6]
+        self.alert_message = FakeMessage(
+            "React with 📣 for job alerts",
+            reactions=[FakeReaction("📣", subscribers)],
+        )
+        self.alert_channel = FakeChannel("alerts", id=ALERT_CHANNEL_ID)
+        self.alert_channel.messages.append(self.alert_message)
+
+        probot = FakeUser("ProBot")
+        probot.id = PROBOT_ID
+        outlook = FakeMessage(
+            "Next week's outlook",
+            author=probot,
+            reactions=[
+                FakeReaction(
+                    FakeEmoji("verifygreen"),
+                    [m for m in self.members if self.rng.random() < 0.5],
+                ),
+                FakeReaction(
+                    FakeEmoji("verifypink"),
+                    [m for m in self.members if self.rng.random() < 0.1],
+                ),
+            ],
+        )
+        self.outlook_channel = FakeChannel("outlook", id=FUTURE_OUTLOOK_ID)
+        self.outlook_channel.messages.append(outlook)
+
+        self.voice_channels = [FakeChannel(f"voice{i}") for i in range(3)]
+        self.event_group = FakeChannel(
+            "events", id=EVENT_CHANNEL_GROUP_ID, voice_channels=self.voice_channels
+        )
+        self.party_channel = FakeChannel("party-comp", id=PARTY_COMP_CHANNEL_ID)
+        self.feedback_channel = FakeChannel("feedback", id=FEEDBACK_CHANNEL_ID)
+        self.channels = [
+            self.alert_channel,
+            self.outlook_channel,
+            self.event_group,
+            self.party_channel,
+            self.feedback_channel,
+            *self.voice_channels,
+        ]
+        self.guild = FakeGuild(
+            SERVER_ID,
+            members=self.members + [self.council],
+            channels=self.channels,
+            roles=[self.council_role, self.hiatus_role],
+        )
+
+    def mark_stale(self, fraction):
+        """Make a fraction of the wishlists look edited since their last sync."""
+        for i in range(len(self.members)):
+            if self.rng.random() < fraction:
+                self.drive.modified_times[f"wishlist{i}"] = "2024-01-01T00:00:00Z"
+
+    async def install(self, args):
+        """Point the bot module at this world."""
+        bot_module = self.bot_module
+        bot = bot_module.bot
+        await bot_module.load_sheets_modules()
+        await self.drive.start()
+        drive.DRIVE_FILES_URL = self.drive.url
+        drive.DRIVE_BATCH_URL = self.drive.batch_url
+        profile = bot_module.PROFILES[0]
+        profile.alert_message_id = self.alert_message.id
+
+        bot.governor = bot_module.governor.SheetsGovernor(
+            read_per_minute=args.reads_per_minute,
+            write_per_minute=args.writes_per_minute,
+            drive_per_minute=args.drive_per_minute,
+        )
+        bot.agcm = FakeClientManager(
+            self.backend,
+            governor=bot.governor,
+            loop=asyncio.get_running_loop(),
+        )
+        bot.replica = None
+        if not args.no_replica:
+            # A fresh copy per world, since every world's sheets look alike to Drive
+            bot.replica = bot_module.Replica(
+                bot.agcm,
+                bot_module.REPLICA_PATH.replace(
+                    ".sqlite3", f"-{len(self.members)}.sqlite3"
+                ),
+            )
+            bot.replica.track(
+                profile.council_sheets_url,
+                ["Wishlist Submissions", profile.dynamis_wishlist_sheet_name],
+            )
+            bot.replica.track(profile.job_sheets_url, [profile.party_sheet_name])
+        profile.job_table = bot_module.JobTable(
+            bot.agcm,
+            profile.council_sheets_url,
+            profile.job_sheets_url,
+            profile.party_sheet_name,
+            replica=bot.replica,
+        )
+        bot.get_guild = lambda id: self.guild if id == SERVER_ID else None
+        channels = {channel.id: channel for channel in self.channels}
+        bot.get_channel = lambda id: channels.get(id)
+        bot.get_all_channels = lambda: iter(self.channels)
+        problems = await profile.registry.resolve(bot)
+        if problems:
+            raise RuntimeError(f"The world doesn't match the config: {problems}")
+        profile.registered_dynamis_zone = None
+        profile.attendance = bot_module.attendance_sessions.AttendanceSessions()
+        # Command callbacks are called directly below, bypassing the bot's invoke
+        bot_module.profiles.current_profile.set(profile)
+
+
+def api_calls(bot_module):
+    registry = bot_module.metrics.REGISTRY
+    sheets = sum(count for _, count in registry.series("mtgardener_sheets_calls_total"))
+    drive = sum(count for _, count in registry.series("mtgardener_drive_calls_total"))
+    return sheets, drive
+
+
+async def measure(bot_module, name, members, coro_fn, results):
+    sheets_before, drive_before = api_calls(bot_module)
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        await coro_fn()
+    wall = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    sheets_after, drive_after = api_calls(bot_module)
+    results.append(
+        {
+            "scenario": name,
+            "members": members,
+            "wall_seconds": round(wall, 3),
+            "cpu_seconds": round(cpu, 3),
+            "sheets_calls": sheets_after - sheets_before,
+            "drive_calls": drive_after - drive_before,
+        }
+    )
+    if name in CPU_BUDGETS and cpu > CPU_BUDGETS[name] * members:
+        raise RuntimeError(
+            f"{name} took {cpu:.1f}s of CPU for {members} members, over its budget of "
+            f"{CPU_BUDGETS[name] * members:.1f}s"
+        )
+
+
+async def run_scale(bot_module, members, args, results):
+    world = World(bot_module, members, args)
+    await world.install(args)
+    bot = bot_module.bot
+    profile = bot_module.PROFILES[0]
+    commands = {command.name: command for command in bot.commands}
+
+    try:
+
+        async def sync_apply():
+            agc = await bot.agcm.authorize()
+            council_ss = await agc.open_by_url(profile.council_sheets_url)
+            wishlist_ss = await agc.open_by_url(
+                "https://docs.google.com/spreadsheets/d/wishlist0/edit"
+            )
+            await bot_module.wishlist_sync.sync_apply(wishlist_ss, council_ss)
+
+        async def sync_cycle():
+            world.mark_stale(args.stale_fraction)
+            # As its own task, like the real loop, so its priority and log context stay put
+            await asyncio.create_task(bot_module.sync_wishlists(profile))
+
+        async def sync_next_cycle():
+            # The following run, which only checks the wishlists the schedule says are due
+            await asyncio.create_task(bot_module.sync_wishlists(profile))
+
+        async def replica_refresh():
+            if bot.replica:
+                await bot.replica.refresh()
+
+        async def job():
+            ctx = FakeContext(world.members[0], "!job")
+            await commands["job"].callback(ctx)
+
+        async def job_burst():
+            burst = world.members[: min(len(world.members), args.burst)]
+            await asyncio.gather(
+                *[commands["job"].callback(FakeContext(m, "!job")) for m in burst]
+            )
+
+        async def alertjobs():
+            await commands["alertjobs"].callback(
+                FakeContext(world.council, "!alertjobs")
+            )
+
+        scheduled = bot_module.ScheduledAlert(
+            FakeContext(world.council, "!alertjobs at 8pm"), time.time(), lead=0
+        )
+
+        async def alert_stage():
+            for member in world.members:
+                member.dm_channel = None
+            await scheduled.stage()
+
+        async def alert_fire():
+            await scheduled.fire()
+
+        async def alert_late_edit():
+            # The job sheet is edited after the alerts were staged, as happens in the
+            # run-up to an event. What goes out must include the edit.
+            ctx = FakeContext(world.council, "!alertjobs test at 8pm")
+            late = bot_module.ScheduledAlert(ctx, time.time(), lead=0, test=True)
+            await late.stage()
+            party = world.backend.spreadsheets["jobs"]
+            slot = party.worksheets_by_title[profile.party_sheet_name].rows[2]
+            slot[2] = "GEO"
+            party.touch()
+            await late.refresh()
+            await late.fire()
+            if "GEO" not in late.comp_msg:
+                raise RuntimeError(
+                    "Scheduled alerts went out without a job sheet edit made after staging"
+                )
+
+        async def dyna():
+            await commands["dyna"].callback(
+                FakeContext(world.council, "!dyna zone bubu")
+            )
+            for content in ("!dyna war", "!dyna thf acc", "!dyna cor -1"):
+                await commands["dyna"].callback(FakeContext(world.council, content))
+
+        async def track_event(name, hours):
+            att = commands["att"].callback
+            present = world.members[: len(world.members) // 2]
+            for i, member in enumerate(present):
+                world.voice_channels[i % 3].members.append(member)
+            await att(FakeContext(world.council, f"!att start {name}"), "start", name)
+            # Pretend the event has been running for a few hours
+            session = profile.attendance.find(name)
+            session.started = session.started.shift(hours=-hours)
+            for i, member in enumerate(world.members):
+                channel = world.voice_channels[i % 3]
+                await bot_module.on_voice_state_update(
+                    member, FakeVoiceState(None), FakeVoiceState(channel)
+                )
+                await bot_module.on_voice_state_update(
+                    member, FakeVoiceState(channel), FakeVoiceState(None)
+                )
+            await att(FakeContext(world.council, "!att stop"), "stop")
+            for channel in world.voice_channels:
+                channel.members.clear()
+
+        async def attendance():
+            await track_event("Dyna", hours=3)
+
+        async def attendance_repeat():
+            # A second run of the same event on the same day gets a column of its own
+            roster = world.backend.spreadsheets["main"].worksheets_by_title["Roster"]
+            before = list(roster.rows[0])
+            await track_event("Dyna", hours=1)
+            added = roster.rows[0][len(before) :]
+            if len(added) != 1 or added[0] in before:
+                raise RuntimeError(
+                    f"A second Dyna today didn't get its own column: {roster.rows[0]}"
+                )
+
+        scenarios = [
+            ("sync_apply", sync_apply),
+            ("sync_wishlists", sync_cycle),
+            ("sync_wishlists 2nd", sync_next_cycle),
+            ("replica_refresh", replica_refresh),
+            ("!job", job),
+            (f"!job x{min(members, args.burst)}", job_burst),
+            ("!alertjobs", alertjobs),
+            ("alert_stage", alert_stage),
+            ("alert_fire", alert_fire),
+            ("alert_late_edit", alert_late_edit),
+            ("!dyna", dyna),
+            ("attendance", attendance),
+            ("attendance again", attendance_repeat),
+        ]
+        for name, coro_fn in scenarios:
+            if args.only and name.lstrip("!").split(" ")[0] not in args.only:
+                continue
+            await measure(bot_module, name, members, coro_fn, results)
+    finally:
+        await world.drive.stop()
+
+
+def print_report(results):
+    header = (
+        f"{'scenario':<18}{'members':>8}{'wall (s)':>10}{'cpu (s)':>9}"
+        f"{'sheets':>8}{'drive':>7}"
+    )
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        print(
+            f"{result['scenario']:<18}{result['members']:>8}{result['wall_seconds']:>10.3f}"
+            f"{result['cpu_seconds']:>9.3f}{result['sheets_calls']:>8}"
+            f"{result['drive_calls']:>7}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run MT Gardener's offline benchmarks")
+    parser.add_argument("--members", type=int, nargs="+", default=[50, 100, 250, 500])
+    parser.add_argument(
+        "--only",
+        nargs="+",
+        help="Scenarios to run (sync_apply, sync_wishlists, replica_refresh, job, alertjobs, alert_stage, alert_fire, alert_late_edit, dyna, attendance)",
+    )
+    parser.add_argument("--sheets-latency", type=float, default=0.0)
+    parser.add_argument("--drive-latency", type=float, default=0.0)
+    parser.add_argument("--discord-latency", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--failure-status", type=int, default=429)
+    parser.add_argument("--stale-fraction", type=float, default=0.1)
+    parser.add_argument("--burst", type=int, default=25)
+    parser.add_argument("--reads-per-minute", type=int, default=1_000_000)
+    parser.add_argument("--writes-per-minute", type=int, default=1_000_000)
+    parser.add_argument("--drive-per-minute", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--no-replica",
+        action="store_true",
+        help="Read Google Sheets directly instead of through the local replica",
+    )
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument("--log", help="Keep the bot's log in this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        bot_module = load_bot(workdir, args.log)
+
+        async def run_all():
+            results = []
+            for members in args.members:
+                await run_scale(bot_module, members, args, results)
+            return results
+
+        results = asyncio.run(run_all())
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,76 @@
+import time
+
+IMPORT_STARTED = time.perf_counter()
+
 import discord
 from discord.ext import commands, tasks
 
 import traceback
+import typing
+import functools
+import importlib
 import re
-import subprocess
 import argparse
 import yaml
+import atexit
 import logging
 import arrow
 from datetime import datetime
-import parsedatetime
-import time
 
 import asyncio
-import gspread_asyncio
 
-from google.oauth2.service_account import Credentials
+import logs
+
+import metrics
+import governor
+from loop_watchdog import LoopWatchdog
+import profiles
+import members
+import profiling
+import admission
+import attendance_sessions
+import sync_plan
+from sheets import SheetsUnavailable
+
+# Everything built on Google's client libraries, which take longer to import than the rest
+# of the bot put together and aren't needed until it has logged in. `main` imports them on
+# a thread while discord connects, and `load_sheets_modules` binds the names below.
+SHEETS_MODULES = (
+    "sheets_client",
+    "write_buffer",
+    "wishlist_sync",
+    "job_table",
+    "replica",
+    "sync_worker",
+    "attendance",
+)
+GardenerClientManager = None
+service_account_credentials = None
+JobTable = None
+Replica = None
+SyncWorker = None
+SyncWorkerError = None
+wishlist_sync = None
+write_buffer = None
+attendance = None
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
 
 
-# Parse the command line arguments
 parser = argparse.ArgumentParser(description="Run MT Gardener")
 parser.add_argument(
     "--config", type=str, required=True, help="The path to the configuration yaml file."
 )
-args = parser.parse_args()
 
-
-# Load the configuration file
+# Set by `setup`, from the command line and the configuration file it names. Until then
+# the module has done nothing but define things, so it can be imported anywhere.
+args = None
 config = {}
-with open(args.config, "r") as f:
-    config = yaml.safe_load(f)
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler(
-            config["logging_path"] if "logging_path" in config else "bot.log"
-        ),
-        logging.StreamHandler(),
-    ],
-)
-
-logging.info("Loading configuration...")
+log_listener = None
+BOT_TOKEN = None
+# Guild IDs, channel IDs and sheet URLs, per guild the bot serves
+PROFILES = []
+PROFILES_BY_GUILD = {}
 
 
 def get_config_param_or_die(config, param):
@@ -57,21 +85,6 @@ def get_config_param_or_die(config, param):
     return config[param]
 
 
-BOT_TOKEN = get_config_param_or_die(config, "bot_token")
-MT_SERVER_ID = get_config_param_or_die(config, "server_id")
-FEEDBACK_CHANNEL_ID = get_config_param_or_die(config, "feedback_channel_id")
-FUTURE_OUTLOOK_ID = get_config_param_or_die(config, "future_outlook_id")
-ALERT_CHANNEL_ID = get_config_param_or_die(config, "alert_channel_id")
-ALERT_MESSAGE_ID = get_config_param_or_die(config, "alert_message_id")
-EVENT_VOICE_CHANNEL_GROUP_ID = get_config_param_or_die(config, "event_channel_group_id")
-
-ROSTER_SHEET_NAME = get_config_param_or_die(config, "roster_sheet_name")
-PARTY_SHEET_NAME = get_config_param_or_die(config, "party_sheet_name")
-DYNAMIS_WISHLIST_SHEET_NAME = get_config_param_or_die(
-    config, "dynamis_wishlist_sheet_name"
-)
-PARTY_COMP_CHANNEL_ID = get_config_param_or_die(config, "party_comp_channel_id")
-
 intents = discord.Intents.default()
 intents.messages = True
 intents.message_content = True
@@ -79,38 +92,237 @@ intents.members = True
 intents.reactions = True
 
 
+def import_sheets_modules():
+    """Import the Sheets modules, returning how long it took. Meant to run on a thread."""
+    start = time.perf_counter()
+    for name in SHEETS_MODULES:
+        importlib.import_module(name)
+    return time.perf_counter() - start
+
+
+async def load_sheets_modules(pending=None):
+    """Bind the Sheets modules, once `pending` (or a fresh import) has loaded them."""
+    global GardenerClientManager, service_account_credentials, JobTable, Replica
+    global SyncWorker, SyncWorkerError, wishlist_sync, write_buffer, attendance
+    if pending is None:
+        pending = asyncio.get_running_loop().run_in_executor(
+            None, import_sheets_modules
+        )
+    seconds = await pending
+    logging.info(f"Loaded the Google Sheets modules in {seconds:.2f}s.")
+    metrics.set_gauge("mtgardener_import_seconds", seconds, stage="sheets")
+
+    from sheets_client import GardenerClientManager, service_account_credentials
+    from job_table import JobTable
+    from replica import Replica
+    from sync_worker import SyncWorker, SyncWorkerError
+    import wishlist_sync
+    import write_buffer
+    import attendance
+
+
+def sync_worker_settings():
+    """The sync worker's guilds and request budgets."""
+    return {
+        "guilds": [
+            {
+                "name": profile.name,
+                "council_url": profile.council_sheets_url,
+                "interval": profile.sync_minutes * 60,
+                "boost": profile.sync_boost_minutes * 60,
+            }
+            for profile in PROFILES
+        ],
+        "read_per_minute": SHEETS_READS_PER_MINUTE * SYNC_WORKER_SHARE,
+        "write_per_minute": SHEETS_WRITES_PER_MINUTE * SYNC_WORKER_SHARE,
+        "drive_per_minute": DRIVE_REQUESTS_PER_MINUTE * SYNC_WORKER_SHARE,
+    }
+
+
+def track_replica_sheets():
+    """Have the replica copy the worksheets every guild's read commands use."""
+    bot.replica.tracked = {}
+    for profile in PROFILES:
+        bot.replica.track(
+            profile.council_sheets_url,
+            [
+                "Wishlist Submissions",
+                profile.dynamis_wishlist_sheet_name,
+                "Sky Requests",
+                "Sea Requests",
+                "Limbus Requests",
+            ],
+        )
+        bot.replica.track(profile.job_sheets_url, [profile.party_sheet_name])
+
+
+def new_job_table(guild_profile):
+    return JobTable(
+        bot.agcm,
+        guild_profile.council_sheets_url,
+        guild_profile.job_sheets_url,
+        guild_profile.party_sheet_name,
+        replica=bot.replica,
+    )
+
+
 def get_creds():
     """Function to be called by the AsyncioGspreadClientManager to renew credentials when they expire"""
-    creds = Credentials.from_service_account_file(GOOGLE_CREDS_JSON)
-    scoped = creds.with_scopes(
-        [
-            "https://spreadsheets.google.com/feeds",
-            "https://www.googleapis.com/auth/spreadsheets",
-            "https://www.googleapis.com/auth/drive",
-        ]
-    )
-    return scoped
+    return service_account_credentials(GOOGLE_CREDS_JSON)
 
 
 class MTBot(commands.Bot):
     def __init__(self, *args, **kwargs):
         super(MTBot, self).__init__(*args, **kwargs)
+        self.sheets_import = None
+        # Set up the Sheets side while the gateway connects, see setup_hook
+        self.sheets_ready = None
         self.agcm = None
-        self.registered_dynamis_zone = None
-        self.att_tracker = None
-        self.att_tracking_start = None
-        self.att_tracking_message = None
+        self.governor = None
+        self.watchdog = None
+        self.sync_worker = None
+        self.replica = None
+        self.replica_loop = None
+        # The last few commits, read once: the running code can't change without a restart
+        self.changelog = None
+        self.member_cache = members.MemberCache(MEMBER_CACHE_SIZE)
+        self.ready_once = False
+        # Configured IDs that didn't resolve when the bot first connected
+        self.startup_problems = []
 
     async def setup_hook(self):
-        """Orchestrate other async code to be on the same loop at startup"""
-        self.agcm = gspread_asyncio.AsyncioGspreadClientManager(
-            get_creds, loop=self.loop
+        """Orchestrate other async code to be on the same loop at startup.
+
+        discord.py runs this inside `login`, before connecting to the gateway, so the
+        Sheets side is set up on a task of its own rather than awaited here. Commands wait
+        for it in `invoke`.
+        """
+        self.watchdog = LoopWatchdog(threshold=LOOP_STALL_THRESHOLD)
+        self.watchdog.start()
+        self.sheets_ready = asyncio.create_task(self.setup_sheets())
+
+    async def setup_sheets(self):
+        try:
+            await self._setup_sheets()
+        except Exception:
+            logging.critical(
+                f"Couldn't set up Google Sheets access:\n{traceback.format_exc()}"
+            )
+            self.startup_problems.append("Google Sheets access couldn't be set up")
+            await self.close()
+
+    async def _setup_sheets(self):
+        await load_sheets_modules(self.sheets_import)
+        # The sync worker has budgets of its own, carved out of the ones in the config
+        self.governor = governor.SheetsGovernor(
+            read_per_minute=SHEETS_READS_PER_MINUTE * (1 - SYNC_WORKER_SHARE),
+            write_per_minute=SHEETS_WRITES_PER_MINUTE * (1 - SYNC_WORKER_SHARE),
+            drive_per_minute=DRIVE_REQUESTS_PER_MINUTE * (1 - SYNC_WORKER_SHARE),
+        )
+        self.agcm = GardenerClientManager(
+            get_creds, governor=self.governor, loop=self.loop
         )
-        sync_wishlists.start()
+        if REPLICA_PATH:
+            self.replica = Replica(self.agcm, REPLICA_PATH)
+            track_replica_sheets()
+            start_replica_loop()
+        for profile in PROFILES:
+            profile.job_table = new_job_table(profile)
+        if METRICS_PORT:
+            await metrics.start_http_server(METRICS_HOST, METRICS_PORT)
+            logging.info(
+                f"Serving metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics"
+            )
+        if SYNC_WORKER == "process":
+            self.sync_worker = SyncWorker(
+                dict(
+                    sync_worker_settings(),
+                    creds_path=GOOGLE_CREDS_JSON,
+                    log_path=SYNC_WORKER_LOGGING_PATH,
+                    log_level=logging.getLevelName(logging.getLogger().level),
+                ),
+                on_cycle=record_sync_cycle,
+            )
+            await self.sync_worker.start()
+        else:
+            for profile in PROFILES:
+                start_sync_loop(profile)
+
+    async def close(self):
+        setting_up = self.sheets_ready and not self.sheets_ready.done()
+        if setting_up and self.sheets_ready is not asyncio.current_task():
+            self.sheets_ready.cancel()
+        if self.sync_worker:
+            await self.sync_worker.stop()
+        for profile in PROFILES:
+            if profile.sync_loop:
+                profile.sync_loop.cancel()
+        # Don't lose council writes a sync cycle had buffered but not yet sent
+        if write_buffer:
+            await write_buffer.flush_all()
+        await super(MTBot, self).close()
+
+    async def invoke(self, ctx):
+        start = time.perf_counter()
+        command = ctx.command.qualified_name if ctx.command else None
+        try:
+            if self.sheets_ready:
+                # Only waits in the moments after connecting. Shielded, so a command
+                # given up on doesn't cancel the setup.
+                await asyncio.shield(self.sheets_ready)
+            with logs.log_context(command, str(ctx.message.id)), profiles.use(
+                await profile_for(ctx)
+            ):
+                session = profiling.session_for(command) if profiling.sessions else None
+                if session:
+                    async with session.capture(f"!{command}"):
+                        await super(MTBot, self).invoke(ctx)
+                else:
+                    await super(MTBot, self).invoke(ctx)
+        finally:
+            if ctx.command:
+                status = "error" if ctx.command_failed else "ok"
+                metrics.observe(
+                    "mtgardener_command_seconds",
+                    time.perf_counter() - start,
+                    command=ctx.command.qualified_name,
+                )
+                metrics.inc(
+                    "mtgardener_commands_total",
+                    command=ctx.command.qualified_name,
+                    status=status,
+                )
+
+
+# Built by `setup`, once the config says how to cache members. Commands and listeners
+# are collected below until then.
+bot = None
+COMMANDS = []
+LISTENERS = []
+
 
+def command(*args, **kwargs):
+    """Like `Bot.command`, for the bot `setup` builds."""
 
-bot = MTBot(command_prefix="!", case_insensitive=True, intents=intents)
-bot.description = """MT Gardener is Mother Tree's little personal assistant bot.
+    def decorator(func):
+        cmd = commands.command(*args, **kwargs)(func)
+        COMMANDS.append(cmd)
+        return cmd
+
+    return decorator
+
+
+def listen(name=None):
+    """Like `Bot.listen`, for the bot `setup` builds."""
+
+    def decorator(func):
+        LISTENERS.append((func, name or func.__name__))
+        return func
+
+    return decorator
+
+
+DESCRIPTION = """MT Gardener is Mother Tree's little personal assistant bot.
 
 It does little things to make life a little easier (hopefully) on the folks who wish to use it.
 To use it, send the bot a DM with a command, like `!changelog` or `!help`.
@@ -124,34 +336,251 @@ SUGGESTION_TEMPLATE = """
 """
 SUGGESTION_LENGTH_MINIMUM = 20
 
-logging.info("Loading Google Sheets integration...")
-GOOGLE_CREDS_JSON = config["google_service_account_creds"]
+GOOGLE_CREDS_JSON = None
+
+# How long before a scheduled `!alertjobs` the prepared alerts are brought up to date
+ALERT_REFRESH_SECONDS = 60
+
+# Settings that are only read at startup, which `!reload` can't change
+RESTART_SETTINGS = (
+    "bot_token",
+    "google_service_account_creds",
+    "logging_path",
+    "member_cache",
+    "member_cache_size",
+    "metrics_port",
+    "metrics_host",
+    "sync_worker",
+    "sync_worker_quota_share",
+    "sync_worker_logging_path",
+    "replica_path",
+)
+
+
+def configure_startup(config):
+    """Take on the settings only read at startup, apart from those `setup` reads itself.
+    Raises ValueError if the member cache setting won't do."""
+    global MEMBER_CACHE, MEMBER_CACHE_SIZE, MEMBER_CACHE_OPTIONS, METRICS_PORT, METRICS_HOST
+    global SYNC_WORKER, SYNC_WORKER_QUOTA_SHARE, SYNC_WORKER_LOGGING_PATH
+    global SYNC_WORKER_SHARE, REPLICA_PATH
+
+    # Keep every guild member in memory (full), or only those in voice channels (lean)
+    MEMBER_CACHE = config["member_cache"] if "member_cache" in config else "full"
+    MEMBER_CACHE_SIZE = (
+        config["member_cache_size"]
+        if "member_cache_size" in config
+        else members.DEFAULT_SIZE
+    )
+    MEMBER_CACHE_OPTIONS = members.client_options(MEMBER_CACHE)
+
+    # Optional local Prometheus endpoint
+    METRICS_PORT = config["metrics_port"] if "metrics_port" in config else None
+    METRICS_HOST = config["metrics_host"] if "metrics_host" in config else "127.0.0.1"
+
+    # "inline" runs the wishlist sync on the bot's event loop, "process" in a separate
+    # worker
+    SYNC_WORKER = config["sync_worker"] if "sync_worker" in config else "inline"
+    # Fraction of the request budgets given to the worker process
+    SYNC_WORKER_QUOTA_SHARE = (
+        config["sync_worker_quota_share"]
+        if "sync_worker_quota_share" in config
+        else 0.5
+    )
+    SYNC_WORKER_LOGGING_PATH = (
+        config["sync_worker_logging_path"]
+        if "sync_worker_logging_path" in config
+        else "sync_worker.log"
+    )
+    # The share of the request budgets the worker has, out of the ones in the config
+    SYNC_WORKER_SHARE = SYNC_WORKER_QUOTA_SHARE if SYNC_WORKER == "process" else 0
+
+    # Where the local copy of the council and job sheets is kept (None to read Sheets
+    # directly)
+    REPLICA_PATH = (
+        config["replica_path"] if "replica_path" in config else "replica.sqlite3"
+    )
+
+
+def configure(config):
+    """Take on the settings below, which `!reload` can change while the bot runs."""
+    global LOOP_STALL_THRESHOLD, SHEETS_READS_PER_MINUTE, SHEETS_WRITES_PER_MINUTE
+    global DRIVE_REQUESTS_PER_MINUTE, ALERT_LEAD_MINUTES
+    global REPLICA_REFRESH_MINUTES, REPLICA_STALE_SECONDS, PROFILING_PATH
+    global COMMAND_QUEUE_DEPTH, COMMAND_DEADLINE_SECONDS, COMMAND_DEADLINES
+
+    # Log the event loop's stack when it's been blocked for longer than this many seconds
+    LOOP_STALL_THRESHOLD = (
+        config["loop_stall_threshold"] if "loop_stall_threshold" in config else 0.5
+    )
 
-GOOGLE_SHEETS_URL = config["google_sheets_url"]
-JOB_SHEETS_URL = config["job_sheets_url"]
-COUNCIL_SHEETS_URL = config["council_sheets_url"]
+    # Request budgets shared by every Sheets/Drive call the bot makes
+    SHEETS_READS_PER_MINUTE = (
+        config["sheets_reads_per_minute"] if "sheets_reads_per_minute" in config else 60
+    )
+    SHEETS_WRITES_PER_MINUTE = (
+        config["sheets_writes_per_minute"]
+        if "sheets_writes_per_minute" in config
+        else 60
+    )
+    DRIVE_REQUESTS_PER_MINUTE = (
+        config["drive_requests_per_minute"]
+        if "drive_requests_per_minute" in config
+        else 600
+    )
 
-PROBOT_ID = int(config["probot_id"])
+    # How long before a scheduled `!alertjobs` its alerts are prepared
+    ALERT_LEAD_MINUTES = (
+        config["alert_lead_minutes"] if "alert_lead_minutes" in config else 30
+    )
 
+    REPLICA_REFRESH_MINUTES = (
+        config["replica_refresh_minutes"] if "replica_refresh_minutes" in config else 5
+    )
+    # Replies answered from a copy that hasn't been confirmed current for this long
+    # say so
+    REPLICA_STALE_SECONDS = REPLICA_REFRESH_MINUTES * 60 * 2
 
-def shared_max_concurrency():
-    """Modified implementation of MaxConcurrency so that it's a shared lock."""
-    con_instance = commands.MaxConcurrency(
-        1, per=commands.BucketType.default, wait=True
+    # Where `!profile` writes its results
+    PROFILING_PATH = (
+        config["profiling_path"] if "profiling_path" in config else "profiling"
     )
 
+    # How many sheets commands a guild can have waiting, and for how many seconds each
+    # may wait to start before it's given up on
+    COMMAND_QUEUE_DEPTH = (
+        config["command_queue_depth"]
+        if "command_queue_depth" in config
+        else admission.DEFAULT_QUEUE_DEPTH
+    )
+    COMMAND_DEADLINE_SECONDS = (
+        config["command_deadline_seconds"]
+        if "command_deadline_seconds" in config
+        else admission.DEFAULT_DEADLINE_SECONDS
+    )
+    COMMAND_DEADLINES = dict(admission.DEFAULT_DEADLINES)
+    if "command_deadlines" in config:
+        COMMAND_DEADLINES.update(config["command_deadlines"])
+
+
+configure_startup(config)
+configure(config)
+
+
+def setup(argv=None):
+    """Read the command line (`argv`, or the process's own) and the config file it names,
+    start logging, take on the config and build the bot. `main` needs this done first.
+    """
+    global args, config, log_listener, BOT_TOKEN, GOOGLE_CREDS_JSON, PROFILES, bot
+    args = parser.parse_args(argv)
+    with open(args.config, "r") as f:
+        config = yaml.safe_load(f)
+
+    # Log records are written out by a listener thread, so the event loop never waits on
+    # I/O
+    log_listener = logs.setup_logging(
+        config["logging_path"] if "logging_path" in config else "bot.log",
+        config["log_level"] if "log_level" in config else "INFO",
+    )
+    atexit.register(log_listener.stop)
+
+    logging.info("Loading configuration...")
+    BOT_TOKEN = get_config_param_or_die(config, "bot_token")
+    GOOGLE_CREDS_JSON = get_config_param_or_die(config, "google_service_account_creds")
+    try:
+        PROFILES = profiles.load_profiles(config)
+        configure_startup(config)
+    except ValueError as e:
+        logging.error(str(e))
+        import sys
+
+        sys.exit(1)
+    PROFILES_BY_GUILD.clear()
+    PROFILES_BY_GUILD.update({p.server_id: p for p in PROFILES})
+    configure(config)
+
+    bot = MTBot(
+        command_prefix="!",
+        case_insensitive=True,
+        intents=intents,
+        description=DESCRIPTION,
+        **MEMBER_CACHE_OPTIONS,
+    )
+    for cmd in COMMANDS:
+        bot.add_command(cmd)
+    for func, name in LISTENERS:
+        bot.add_listener(func, name)
+
+
+def profile():
+    """The profile of the guild the current command is for."""
+    return profiles.current_profile.get()
+
+
+async def profile_for(ctx):
+    """Commands sent in a guild are for that guild; DMs are for the first guild the
+    author is a member of."""
+    if ctx.guild and ctx.guild.id in PROFILES_BY_GUILD:
+        return PROFILES_BY_GUILD[ctx.guild.id]
+    if len(PROFILES) == 1:
+        return PROFILES[0]
+    for candidate in PROFILES:
+        guild = bot.get_guild(candidate.server_id)
+        if guild and await bot.member_cache.get(guild, ctx.author.id):
+            return candidate
+    return PROFILES[0]
+
+
+def shared_sheets_lock(exclusive):
+    """Hold the guild's sheets lock for the duration of a command, once it's been let
+    through the guild's queue."""
+
     def decorator(func):
-        if isinstance(func, commands.Command):
-            func._max_concurrency = con_instance
-        else:
-            func.__commands_max_concurrency__ = con_instance
-        return func
+        @functools.wraps(func)
+        async def wrapper(ctx, *args, **kwargs):
+            command = ctx.command.qualified_name
+            key = (str(ctx.author), command, ctx.message.content.strip().lower())
+
+            async def notify(position):
+                await ctx.send(
+                    f"The sheets are busy right now. You're number {position} in line, "
+                    "and I'll get to it as soon as I can."
+                )
+
+            try:
+                async with profile().admission.admit(
+                    key,
+                    command,
+                    exclusive,
+                    deadline=COMMAND_DEADLINES.get(command, COMMAND_DEADLINE_SECONDS),
+                    max_depth=COMMAND_QUEUE_DEPTH,
+                    notify=notify,
+                ):
+                    return await func(ctx, *args, **kwargs)
+            except admission.AlreadyQueued as e:
+                return await ctx.send(
+                    f"You've already asked for that, and you're number {e.position} "
+                    "in line. Hang tight!"
+                )
+            except admission.QueueFull:
+                return await ctx.send(
+                    "I've got too much on my plate right now. Try again in a minute."
+                )
+            except admission.DeadlineExceeded:
+                return await ctx.send(
+                    f"Sorry, the sheets were busy for too long and I gave up on your "
+                    f"`!{command}`. Try again in a few minutes."
+                )
+
+        return wrapper
 
     return decorator
 
 
-# Create the decorator - any command decorated with this will execute sequentially
-sheets_access = shared_max_concurrency()
+# Create the decorators - commands decorated with sheets_access execute sequentially,
+# while read-only commands decorated with sheets_read_access may run alongside each other
+# (and share identical in-flight reads). Each guild has a lock of its own.
+sheets_access = shared_sheets_lock(exclusive=True)
+sheets_read_access = shared_sheets_lock(exclusive=False)
 
 
 # Custom check functions that can disallow commands from being run
@@ -160,56 +589,36 @@ async def check_channel_is_dm(ctx):
 
 
 async def check_user_is_council_or_dev(ctx):
-    guild = bot.get_guild(MT_SERVER_ID)
-    user = ctx.message.author
-    member = discord.utils.find(lambda m: m.id == user.id, guild.members)
-    role = discord.utils.find(
-        lambda r: r.name
-        in ("Elder Tree Treants (Council)", "MT Gardener Dev", "Council Help"),
-        member.roles,
-    )
-    return bool(role)
+    registry = profile().registry
+    member = await bot.member_cache.get(registry.guild, ctx.message.author.id)
+    if not member:
+        return False
+    return registry.is_council(member)
 
 
 async def check_user_can_have_nice_things(ctx):
-    guild = bot.get_guild(MT_SERVER_ID)
-    user = ctx.message.author
-    member = discord.utils.find(lambda m: m.id == user.id, guild.members)
-    role = discord.utils.find(
-        lambda r: r.name in ("Cannot Have Nice Things"),
-        member.roles,
-    )
-    return not bool(role)
+    registry = profile().registry
+    member = await bot.member_cache.get(registry.guild, ctx.message.author.id)
+    if not member:
+        return False
+    return not registry.cannot_have_nice_things(member)
 
 
 # Error handler
-@bot.event
+@listen()
 async def on_command_error(ctx, error):
     if isinstance(error, commands.errors.CheckFailure):
         pass
 
 
-@bot.event
+@listen()
 async def on_voice_state_update(member, before, after):
-    event_channels = bot.get_channel(EVENT_VOICE_CHANNEL_GROUP_ID).voice_channels
-
-    def entered_event_channel(before, after):
-        return before.channel not in event_channels and after.channel in event_channels
-
-    def exited_event_channel(before, after):
-        return before.channel in event_channels and after.channel not in event_channels
+    guild_profile = PROFILES_BY_GUILD.get(member.guild.id)
+    if guild_profile:
+        guild_profile.attendance.voice_update(member, before.channel, after.channel)
 
-    if bot.att_tracker:
-        if str(member) not in bot.att_tracker:
-            bot.att_tracker[str(member)] = []
 
-        if entered_event_channel(before, after):
-            bot.att_tracker[str(member)].append(arrow.now())
-        elif exited_event_channel(before, after):
-            bot.att_tracker[str(member)].append(arrow.now())
-
-
-@bot.command()
+@command()
 @commands.check(check_channel_is_dm)
 @commands.check(check_user_can_have_nice_things)
 async def suggest(ctx):
@@ -221,7 +630,7 @@ async def suggest(ctx):
         return await ctx.send(
             "Please elaborate a little bit more with your suggestion."
         )
-    channel = discord.utils.get(bot.get_all_channels(), id=FEEDBACK_CHANNEL_ID)
+    channel = profile().registry.feedback_channel
     content = ctx.message.content[len("!suggest ") :]
     suggestion_message = await channel.send(SUGGESTION_TEMPLATE.format(content))
     thread = await suggestion_message.create_thread(name="Suggestion Feedback")
@@ -235,10 +644,10 @@ async def suggest(ctx):
 
 async def verified_reactions_to_last_outlook():
     # Get the last posted outlook message
-    channel = bot.get_channel(FUTURE_OUTLOOK_ID)
+    channel = profile().registry.outlook_channel
     last_outlook_message = None
     async for message in channel.history(limit=10):
-        if message.author.id == int(PROBOT_ID):
+        if message.author.id == profile().probot_id:
             last_outlook_message = message
             break
 
@@ -251,7 +660,7 @@ async def verified_reactions_to_last_outlook():
             continue
         reaction_map[reaction.emoji.name] = []
         async for user in reaction.users():
-            if user.id == PROBOT_ID:
+            if user.id == profile().probot_id:
                 continue
             reaction_map[reaction.emoji.name].append(user)
 
@@ -262,13 +671,73 @@ async def verified_reactions_to_last_outlook():
     return can_go
 
 
-@bot.command()
+def stale_note(as_of):
+    """A line saying a reply was answered from an out of date copy, if it was."""
+    if as_of is None:
+        return ""
+    return (
+        f"\n*Google Sheets couldn't be checked, so this is as of <t:{int(as_of)}:R>.*"
+    )
+
+
+def replica_stale_since(*urls):
+    """When the replica's copies of these spreadsheets were last confirmed current, if
+    that's long enough ago to mention."""
+    if not bot.replica:
+        return None
+    as_of = bot.replica.as_of(*urls)
+    if as_of is None or time.time() - as_of <= REPLICA_STALE_SECONDS:
+        return None
+    return as_of
+
+
+async def refresh_job_sheets():
+    """Make sure what's known of the job and council sheets is up to date now.
+
+    The replica only refreshes every few minutes, and without one the job table only
+    asks Drive every half minute, either of which would miss last-minute changes to the
+    job sheet before alerts go out or the job comp is posted. Returns when the sheets
+    were last confirmed current if they couldn't be now, for `stale_note`.
+    """
+    if not bot.replica:
+        job_table = profile().job_table
+        try:
+            await job_table.refresh(check_now=True)
+        except Exception as e:
+            logging.warning(f"Couldn't check whether the job sheets changed: {e}")
+            return job_table.built
+        return None
+    urls = [profile().job_sheets_url, profile().council_sheets_url]
+    started = time.time()
+    await bot.replica.refresh(urls)
+    as_of = bot.replica.as_of(*urls)
+    if as_of is None or as_of >= started:
+        return None
+    return as_of
+
+
+def replicated_rows(url, title):
+    """Every row of a worksheet from the replica, or None to read it from Sheets."""
+    if not bot.replica:
+        return None
+    return bot.replica.values(url, title)
+
+
+@command()
 @commands.check(check_channel_is_dm)
-@sheets_access
+@sheets_read_access
 async def job(ctx):
-    msgs = await _job([ctx.message.author])
+    try:
+        msgs = await _job([ctx.message.author])
+    except Exception:
+        return await ctx.author.send(
+            "I can't reach the job sheets right now. Try again in a few minutes."
+        )
     if ctx.author in msgs:
-        await ctx.author.send(msgs[ctx.author])
+        as_of = replica_stale_since(
+            profile().job_sheets_url, profile().council_sheets_url
+        )
+        await ctx.author.send(msgs[ctx.author] + stale_note(as_of))
     else:
         await ctx.author.send(
             "I couldn't find you in the LS roster. Check with council that you're properly added."
@@ -277,11 +746,14 @@ async def job(ctx):
 
 async def get_roster_for_users(users):
     # Fetch the roster range that contains username, main, and alt name
-    agc = await bot.agcm.authorize()
-    council_ss = await agc.open_by_url(COUNCIL_SHEETS_URL)
-    roster_ws = await council_ss.worksheet("Wishlist Submissions")
-
-    roster_range = await roster_ws.get_values("A:D")
+    rows = replicated_rows(profile().council_sheets_url, "Wishlist Submissions")
+    if rows is not None:
+        roster_range = [row[:4] for row in rows]
+    else:
+        agc = await bot.agcm.authorize()
+        council_ss = await agc.open_by_url(profile().council_sheets_url)
+        roster_ws = await council_ss.worksheet("Wishlist Submissions")
+        roster_range = await roster_ws.get_values("A:D")
     roster = {}
     for i in range(1, len(roster_range)):
         row = roster_range[i]
@@ -303,89 +775,160 @@ async def get_roster_for_users(users):
 
 
 async def _job(users):
+    """Job messages for the users found on the roster, keyed by user.
+
+    If the sheets can't be read, answers from the last job table built, and raises only
+    if there isn't one.
+    """
     msgs = {}
-    roster = {}
+    job_table = profile().job_table
     try:
-        roster = await get_roster_for_users(users)
+        await job_table.refresh()
     except Exception as e:
-        logging.error(f"Something went wrong when trying to get the roster. {e}")
-        return msgs
+        logging.error(f"Something went wrong when trying to refresh the job table. {e}")
+        if job_table.built is None:
+            raise
+        logging.warning("Answering from the previous job table.")
+
+    for user in users:
+        entry = job_table.lookup(user)
+        if entry is None:
+            logging.warning(
+                f"{user} was not found in the roster. Double-check that they are on it."
+            )
+            continue
+        logs.log_sampled(
+            logging.DEBUG, "job.roster_entry", "Roster entry for %s: %s", user, entry
+        )
+        msgs[user] = f"{user.mention} - {entry['message']}"
 
-    agc = await bot.agcm.authorize()
-    party_ss = await agc.open_by_url(JOB_SHEETS_URL)
-    party_ws = await party_ss.worksheet(PARTY_SHEET_NAME)
+    logging.info("Done fetching jobs for users.")
+    logging.debug("Job messages: %s", msgs)
+    return msgs
 
-    logging.info("Pulling job comp sheet assigned chracters...")
 
-    def get_job_assignment(name, job_map):
-        return job_map[name] if (name and name in job_map) else None
+@command()
+async def ping(ctx):
+    return await ctx.send("Pong!")
 
-    try:
-        job_map = {_[0]: _[1] for _ in await party_ws.get_values("B:C")}
 
-        for user in users:
-            if user not in roster:
-                logging.warning(
-                    f"{user} was not found in the roster. Double-check that they are on it."
-                )
-                continue
-            main_name = roster[user]["main"]
-            alt_name = roster[user]["alt"]
+def format_stats():
+    """Summarize the metrics registry into something that fits in a discord message."""
+    registry = metrics.REGISTRY
 
-            logging.info(roster[user])
+    def latency(hist):
+        return f"{hist.count} / {hist.describe(0.5)} / {hist.describe(0.95)}"
 
-            main_job = get_job_assignment(roster[user]["main"], job_map)
-            alt_job = get_job_assignment(roster[user]["alt"], job_map)
+    uptime = arrow.get(registry.started).humanize(only_distance=True)
+    lines = [f"Up for {uptime}.", "", "Commands (runs / p50 / p95):"]
+    for labels, hist in sorted(
+        registry.series("mtgardener_command_seconds", "histograms"),
+        key=lambda series: -series[1].count,
+    ):
+        lines.append(f"  !{labels['command']}: {latency(hist)}")
 
-            if main_job or alt_job:
-                msg = ""
-                if main_job:
-                    msg += (
-                        f"[{main_name}: **{main_job if main_job else 'Unspecified'}**] "
-                    )
-                if alt_job:
-                    msg += f"[{alt_name}: **{alt_job if alt_job else 'Unspecified'}**]"
+    for labels, hist in registry.series("mtgardener_lock_wait_seconds", "histograms"):
+        lines.append(
+            f"Sheets lock waits, {labels['mode']} (count / p50 / p95): {latency(hist)}"
+        )
+    for labels, hist in registry.series("mtgardener_sync_cycle_seconds", "histograms"):
+        lines.append(
+            f"Sync cycles, {labels['guild']} (count / p50 / p95): {latency(hist)}"
+        )
 
-                msgs[user] = f"{user.mention} - {msg}"
-            else:
-                msgs[user] = f"{user.mention} - You're not on the job sheet."
+    per_worksheet = {}
+    for labels, count in registry.series("mtgardener_sheets_calls_total"):
+        name = labels["worksheet"] or labels["spreadsheet"] or "(client)"
+        per_worksheet[name] = per_worksheet.get(name, 0) + count
+    lines.append("")
+    lines.append(f"Sheets calls: {sum(per_worksheet.values())}")
+    for name, count in sorted(per_worksheet.items(), key=lambda item: -item[1]):
+        lines.append(f"  {name}: {count}")
+    coalesced = sum(
+        count for _, count in registry.series("mtgardener_sheets_coalesced_total")
+    )
+    lines.append(f"Sheets reads coalesced: {coalesced}")
+    rate_limited = sum(
+        count for _, count in registry.series("mtgardener_sheets_rate_limited_total")
+    )
+    lines.append(f"Sheets 429s: {rate_limited}")
+    drive_calls = sum(
+        count for _, count in registry.series("mtgardener_drive_calls_total")
+    )
+    lines.append(f"Drive calls: {drive_calls}")
+    if bot.replica:
+        as_of = bot.replica.as_of(*bot.replica.tracked)
+        checked = arrow.get(as_of).humanize() if as_of else "never"
+        lines.append(f"Sheets replica last confirmed current: {checked}")
+
+    if bot.governor:
+        lines.append("")
+        lines.append("Quota budgets (tokens / capacity, queued, throttled):")
+        for kind, (tokens, capacity, queued) in bot.governor.status().items():
+            throttled = sum(
+                count
+                for labels, count in registry.series(
+                    "mtgardener_governor_throttled_total"
+                )
+                if labels["budget"] == kind
+            )
+            lines.append(
+                f"  {kind}: {tokens:.1f} / {capacity:.0f}, {queued} queued, {throttled} throttled"
+            )
 
-        logging.info("Done fetching jobs for users.")
-        logging.debug(msgs)
-        return msgs
-    except Exception as e:
-        logging.error(traceback.format_exc())
+    content = "\n".join(lines)
+    if len(content) > 1900:
+        content = content[:1900] + "\n..."
+    return f"```{content}```"
 
 
-@bot.command()
-async def ping(ctx):
-    return await ctx.send("Pong!")
+@command()
+@commands.check(check_user_is_council_or_dev)
+async def stats(ctx):
+    await ctx.send(format_stats())
+
+
+async def git_output(*args):
+    """Run a git command without blocking the event loop."""
+    process = await asyncio.create_subprocess_exec(
+        "git",
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    stdout, _ = await process.communicate()
+    return str(stdout, "utf-8")
 
 
-@bot.command()
+@command()
 async def changelog(ctx):
     num_commits = 3
-    version_content = subprocess.check_output(
-        ["git", "log", "--use-mailmap", f"-n{num_commits}"]
-    )
-    await ctx.send("Most recent changes:\n```" + str(version_content, "utf-8") + "```")
+    if bot.changelog is None:
+        bot.changelog = await git_output("log", "--use-mailmap", f"-n{num_commits}")
+    version_content = bot.changelog
+    await ctx.send("Most recent changes:\n```" + version_content + "```")
 
 
-@bot.command()
+@command()
 @commands.check(check_channel_is_dm)
 @commands.check(check_user_is_council_or_dev)
-@sheets_access
+@sheets_read_access
 async def publishjobs(ctx):
+    as_of = await refresh_job_sheets()
     msg = await construct_joblist_message()
-    party_channel = discord.utils.get(bot.get_all_channels(), id=PARTY_COMP_CHANNEL_ID)
+    party_channel = profile().registry.party_channel
     await party_channel.send(msg)
+    if as_of:
+        await ctx.send("Job comp posted." + stale_note(as_of))
 
 
 async def construct_joblist_message():
-    agc = await bot.agcm.authorize()
-    party_ss = await agc.open_by_url(JOB_SHEETS_URL)
-    party_ws = await party_ss.worksheet(PARTY_SHEET_NAME)
-    data = await party_ws.get_all_values()
+    data = replicated_rows(profile().job_sheets_url, profile().party_sheet_name)
+    if data is None:
+        agc = await bot.agcm.authorize()
+        party_ss = await agc.open_by_url(profile().job_sheets_url)
+        party_ws = await party_ss.worksheet(profile().party_sheet_name)
+        data = await party_ws.get_all_values()
 
     msg = "```"
     for row in range(1, 43):
@@ -403,50 +946,267 @@ async def construct_joblist_message():
     return msg
 
 
-@bot.command()
+def format_alert_status(alerted_status):
+    if not alerted_status:
+        return "```\nAin't nobody here but us chickens!```"
+
+    user_alert_section = "```"
+    for user in alerted_status:
+        user_alert_section += f"{str(user)} - {alerted_status[user]}\n"
+    user_alert_section += "```"
+    return user_alert_section
+
+
+async def alert_targets():
+    """Alert subscribers, minus those on hiatus who didn't sign up for the next event."""
+    registry = profile().registry
+    sub_message = await registry.alert_message()
+    reaction = discord.utils.get(sub_message.reactions, emoji="📣")
+
+    users = []
+    async for user in reaction.users():
+        users.append(user)
+
+    logging.info("Cross-referencing latest attendance poll...")
+    can_go = set(await verified_reactions_to_last_outlook())
+
+    # Reactions only come with roles for cached members, so look up the rest. Only those
+    # who didn't sign up for the next event could be left out, so only they're checked.
+    unverified = [_ for _ in users if _ not in can_go]
+    guild_members = await bot.member_cache.get_many(
+        registry.guild, [_.id for _ in unverified]
+    )
+    on_hiatus = set(
+        [
+            _
+            for _ in unverified
+            if _.id in guild_members and registry.is_on_hiatus(guild_members[_.id])
+        ]
+    )
+    return [_ for _ in users if _ not in on_hiatus]
+
+
+async def send_job_alert(user, msg):
+    """DM a member their job for the event. Returns whether it was delivered."""
+    try:
+        await user.send("Reminder: You are signed up for the event tonight.\n" + msg)
+        return True
+    except:
+        return False
+
+
+class ScheduledAlert:
+    """A run of `!alertjobs` scheduled for an event's start time.
+
+    `lead` seconds ahead of the event, everything that can be is prepared: who to alert,
+    their DMs, their DM channels and the job comp post. A minute before the event only
+    what changed since is redone, so at the event itself all that's left is sending.
+    """
+
+    def __init__(self, ctx, event_time, lead, test=False):
+        self.ctx = ctx
+        self.profile = profile()
+        self.event_time = event_time
+        self.lead = lead
+        self.test = test
+        self.users = []
+        self.msgs = {}
+        self.comp_msg = None
+        self.table_built = None
+        # When the job sheets were last confirmed current, if they couldn't be checked
+        self.as_of = None
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    def cancel(self):
+        if self.task:
+            self.task.cancel()
+
+    async def run(self):
+        try:
+            with logs.log_context("alertjobs.scheduled"), profiles.use(self.profile):
+                await sleep_until(self.event_time - self.lead)
+                with governor.priority(governor.BACKGROUND):
+                    await self.stage()
+                if time.time() < self.event_time - ALERT_REFRESH_SECONDS:
+                    await sleep_until(self.event_time - ALERT_REFRESH_SECONDS)
+                    try:
+                        await self.refresh()
+                    except Exception as e:
+                        # What was staged is still good enough to send
+                        logging.warning(
+                            f"Couldn't refresh staged job alerts, sending them as staged. {e}"
+                        )
+                await sleep_until(self.event_time)
+                await self.fire()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(traceback.format_exc())
+            await self.ctx.send(
+                "ERROR: Something went wrong with the scheduled alerts."
+            )
+        finally:
+            if self.profile.scheduled_alert is self:
+                self.profile.scheduled_alert = None
+
+    async def open_dm_channels(self, users):
+        # Opening a DM channel is its own API call, so get it out of the way early
+        for user in users:
+            if user.dm_channel is None:
+                try:
+                    await user.create_dm()
+                except Exception as e:
+                    logging.warning(f"Couldn't open a DM channel with {user}: {e}")
+
+    async def stage(self):
+        logging.info("Staging scheduled job alerts...")
+        async with self.profile.sheets_lock.shared():
+            self.as_of = await refresh_job_sheets()
+            self.users = await alert_targets()
+            self.msgs = await _job(self.users)
+            self.comp_msg = await construct_joblist_message()
+        self.table_built = self.profile.job_table.built
+        await self.open_dm_channels(self.users)
+        logging.info(f"Staged job alerts for {len(self.users)} users.")
+
+    async def refresh(self):
+        logging.info("Refreshing staged job alerts...")
+        job_table = self.profile.job_table
+        async with self.profile.sheets_lock.shared():
+            users = await alert_targets()
+            self.as_of = await refresh_job_sheets()
+            await job_table.refresh()
+            if job_table.built != self.table_built:
+                logging.info("Job assignments changed since staging. Re-rendering...")
+                self.msgs = await _job(users)
+                self.comp_msg = await construct_joblist_message()
+                self.table_built = job_table.built
+            else:
+                new_users = [user for user in users if user not in self.msgs]
+                if new_users:
+                    self.msgs.update(await _job(new_users))
+        await self.open_dm_channels([user for user in users if user not in self.users])
+        self.users = users
+
+    async def fire(self):
+        start = time.time()
+        metrics.observe("mtgardener_alert_lateness_seconds", start - self.event_time)
+
+        missing = [user for user in self.users if user not in self.msgs]
+        for user in missing:
+            await self.ctx.send(
+                f"{str(user)} wasn't found in the roster. Double-check that they are added."
+            )
+        alerted = [user for user in self.users if user in self.msgs]
+        if self.test:
+            delivered = [True] * len(alerted)
+            await self.ctx.send(
+                "Simulated alerts...\n" + "\n".join(self.msgs[user] for user in alerted)
+            )
+        else:
+            delivered = await asyncio.gather(
+                *[send_job_alert(user, self.msgs[user]) for user in alerted]
+            )
+
+        alerted_status = {user: "FAILED" for user in missing}
+        for user, ok in zip(alerted, delivered):
+            alerted_status[user] = "DONE" if ok else "FAILED"
+
+        if self.test:
+            await self.ctx.send(
+                "The following job comp would be posted:\n" + self.comp_msg
+            )
+        else:
+            party_channel = self.profile.registry.party_channel
+            await party_channel.send(self.comp_msg)
+
+        metrics.observe("mtgardener_alert_dispatch_seconds", time.time() - start)
+        await self.ctx.send(
+            "**Scheduled alerts dispatched!** "
+            + format_alert_status(alerted_status)
+            + stale_note(self.as_of)
+        )
+
+
+_calendar = None
+
+
+def calendar():
+    """The parsedatetime calendar, imported on first use."""
+    global _calendar
+    if _calendar is None:
+        import parsedatetime
+
+        _calendar = parsedatetime.Calendar()
+    return _calendar
+
+
+async def sleep_until(when):
+    delay = when - time.time()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+async def schedule_alert(ctx, when, test):
+    time_struct, parsed = calendar().parse(when)
+    event_time = time.mktime(time_struct)
+    if not parsed or event_time <= time.time():
+        return await ctx.send(
+            "Usage: `!alertjobs [test] [in|on|at <event date and/or time>]` or `!alertjobs cancel`"
+        )
+
+    guild_profile = profile()
+    if guild_profile.scheduled_alert:
+        guild_profile.scheduled_alert.cancel()
+    guild_profile.scheduled_alert = ScheduledAlert(
+        ctx, event_time, ALERT_LEAD_MINUTES * 60, test=test
+    )
+    guild_profile.scheduled_alert.start()
+    # Members update their wishlists in the run-up to an event, so check them more often
+    if bot.sync_worker:
+        bot.sync_worker.notify(
+            "event", council_url=guild_profile.council_sheets_url, when=event_time
+        )
+    else:
+        guild_profile.sync_schedule.add_event(event_time)
+    stage_time = max(event_time - ALERT_LEAD_MINUTES * 60, time.time())
+    return await ctx.send(
+        f"📣 Job alerts will go out at <t:{int(event_time)}>, "
+        f"and I'll get them ready <t:{int(stage_time)}:R>."
+    )
+
+
+@command()
 @commands.check(check_channel_is_dm)
 @commands.check(check_user_is_council_or_dev)
-@sheets_access
+@sheets_read_access
 async def alertjobs(ctx):
     test = "test" in ctx.message.content
+    if "cancel" in ctx.message.content:
+        if not profile().scheduled_alert:
+            return await ctx.send("There are no scheduled alerts to cancel.")
+        profile().scheduled_alert.cancel()
+        profile().scheduled_alert = None
+        return await ctx.send("Scheduled alerts cancelled.")
+
+    schedule = re.search(r"\s((?:in|on|at)\s.+)$", ctx.message.content)
+    if schedule:
+        return await schedule_alert(ctx, schedule.group(1), test)
+
     try:
         update_msg = "*Grabbing users who have subscribed to alerts...* "
         message = await ctx.send(update_msg)
 
-        alert_channel = discord.utils.get(bot.get_all_channels(), id=ALERT_CHANNEL_ID)
-        sub_message = await alert_channel.fetch_message(ALERT_MESSAGE_ID)
-        reaction = discord.utils.get(sub_message.reactions, emoji="📣")
-
-        def get_user_alert_section(alerted_status):
-            if not alerted_status:
-                return "```\nAin't nobody here but us chickens!```"
-
-            user_alert_section = "```"
-            for user in alerted_status:
-                user_alert_section += f"{str(user)} - {alerted_status[user]}\n"
-            user_alert_section += "```"
-            return user_alert_section
-
-        users = []
-        async for user in reaction.users():
-            users.append(user)
-
-        logging.info("Cross-referencing latest attendance poll...")
         update_msg += "**Done**\n*Filtering out folks on hiatus who didn't sign up...* "
+        users = await alert_targets()
         await message.edit(content=update_msg)
-        can_go = set(await verified_reactions_to_last_outlook())
-
-        def is_on_hiatus(user):
-            for role in user.roles:
-                if "hiatus" in role.name.lower():
-                    return True
-            return False
-
-        on_hiatus = set([_ for _ in users if is_on_hiatus(user)])
-        users = [_ for _ in users if _ not in (on_hiatus - can_go)]
 
         update_msg += "**Done**\n*Fetching users' jobs...* "
         await message.edit(content=update_msg)
+        as_of = await refresh_job_sheets()
         msgs = await _job(users)
 
         alerted_status = {}
@@ -454,7 +1214,7 @@ async def alertjobs(ctx):
             alerted_status[user] = "PENDING"
 
         update_msg += "**Done** \n\n**Dispatching alerts to the following users!** "
-        await message.edit(content=update_msg + get_user_alert_section(alerted_status))
+        await message.edit(content=update_msg + format_alert_status(alerted_status))
 
         test_message = None
         test_content = "Simulated alerts...\n"
@@ -472,41 +1232,72 @@ async def alertjobs(ctx):
                 alerted_status[user] = "DONE"
                 await test_message.edit(content=test_content)
             else:
-                try:
-                    await user.send(
-                        "Reminder: You are signed up for the event tonight.\n"
-                        + msgs[user]
-                    )
-                    alerted_status[user] = "DONE"
-                except:
-                    alerted_status[user] = "FAILED"
+                delivered = await send_job_alert(user, msgs[user])
+                alerted_status[user] = "DONE" if delivered else "FAILED"
 
-            await message.edit(
-                content=update_msg + get_user_alert_section(alerted_status)
-            )
+            await message.edit(content=update_msg + format_alert_status(alerted_status))
 
         await message.edit(
             content=update_msg
-            + get_user_alert_section(alerted_status)
+            + format_alert_status(alerted_status)
             + "\n**All done!**"
+            + stale_note(as_of)
         )
 
         comp_msg = await construct_joblist_message()
-        party_channel = discord.utils.get(
-            bot.get_all_channels(), id=PARTY_COMP_CHANNEL_ID
-        )
+        party_channel = profile().registry.party_channel
         if test:
             await ctx.send("The following job comp would be posted:\n" + comp_msg)
         else:
             await party_channel.send(comp_msg)
 
+    except SheetsUnavailable as e:
+        logging.error(e)
+        await ctx.send(
+            "ERROR: Google Sheets can't be reached right now. Try again in a few minutes."
+        )
     except Exception as e:
         logging.error(e)
 
 
-@bot.command()
+async def read_dynamis_columns(*indices):
+    """Columns of the dynamis wishlist sheet, and when they were read.
+
+    The read time is None when they're fresh. They come from the replica if it has the
+    sheet. Otherwise, if the sheet can't be read, the last copy read is returned with its
+    time instead, as long as every column has been read before.
+    """
+    url = profile().council_sheets_url
+    title = profile().dynamis_wishlist_sheet_name
+    if bot.replica and bot.replica.has(url, title):
+        columns = [bot.replica.column(url, title, index) for index in indices]
+        return columns, replica_stale_since(url)
+
+    cache = profile().dynamis_columns
+    try:
+        agc = await bot.agcm.authorize()
+        ss = await agc.open_by_url(profile().council_sheets_url)
+        ws = await ss.worksheet(profile().dynamis_wishlist_sheet_name)
+        columns = [await ws.col_values(index) for index in indices]
+    except Exception as e:
+        if not all(index in cache for index in indices):
+            raise
+        logging.warning(
+            f"Couldn't read the dynamis wishlists, answering from cache. {e}"
+        )
+        return [cache[index][0] for index in indices], min(
+            cache[index][1] for index in indices
+        )
+
+    now = time.time()
+    for index, values in zip(indices, columns):
+        cache[index] = (values, now)
+    return columns, None
+
+
+@command()
 @commands.check(check_user_is_council_or_dev)
-@sheets_access
+@sheets_read_access
 async def dyna(ctx):
     try:
         zone_anchors = {
@@ -533,11 +1324,11 @@ async def dyna(ctx):
             if tokens[2].lower() not in zone_anchors:
                 return await ctx.send(invalid_zone_msg)
             else:
-                bot.registered_dynamis_zone = tokens[2].lower()
+                profile().registered_dynamis_zone = tokens[2].lower()
                 return await ctx.send(
-                    f"Current dynamis zone set to: `{bot.registered_dynamis_zone}`"
+                    f"Current dynamis zone set to: `{profile().registered_dynamis_zone}`"
                 )
-        elif not bot.registered_dynamis_zone:
+        elif not profile().registered_dynamis_zone:
             return await ctx.send(invalid_zone_msg)
 
         job = tokens[1]
@@ -571,28 +1362,28 @@ async def dyna(ctx):
                 "That is not a valid drop choice. Must be either af (default), -1, or acc."
             )
 
-        agc = await bot.agcm.authorize()
-        ss = await agc.open_by_url(COUNCIL_SHEETS_URL)
-        ws = await ss.worksheet(DYNAMIS_WISHLIST_SHEET_NAME)
-
         msg = f"Loot List for **{job.upper()} [{choice_type.upper()}]**\n"
         newline = "\n"
         tics = "```"
 
-        choice_one_index = zone_anchors[bot.registered_dynamis_zone] + 1
-        choice_two_index = zone_anchors[bot.registered_dynamis_zone] + 2
-        choice_other_index = zone_anchors[bot.registered_dynamis_zone] + 3
-        choice_minus_one_index = zone_anchors[bot.registered_dynamis_zone] + 4
-        choice_acc_index = zone_anchors[bot.registered_dynamis_zone] + 6
-        choice_acc_other_index = zone_anchors[bot.registered_dynamis_zone] + 8
+        choice_one_index = zone_anchors[profile().registered_dynamis_zone] + 1
+        choice_two_index = zone_anchors[profile().registered_dynamis_zone] + 2
+        choice_other_index = zone_anchors[profile().registered_dynamis_zone] + 3
+        choice_minus_one_index = zone_anchors[profile().registered_dynamis_zone] + 4
+        choice_acc_index = zone_anchors[profile().registered_dynamis_zone] + 6
+        choice_acc_other_index = zone_anchors[profile().registered_dynamis_zone] + 8
 
-        character_name_values = await ws.col_values(1)
         if choice_type == "af":
-            choice_one = await ws.col_values(choice_one_index)
-            choice_two = await ws.col_values(choice_two_index)
-            choice_other = await ws.col_values(choice_other_index)
+            (
+                character_name_values,
+                choice_one,
+                choice_two,
+                choice_other,
+            ), as_of = await read_dynamis_columns(
+                1, choice_one_index, choice_two_index, choice_other_index
+            )
 
-            logging.info(character_name_values)
+            logging.debug("Dynamis wishlist characters: %s", character_name_values)
             who_ones = [
                 character_name_values[i]
                 for i, v in enumerate(choice_one)
@@ -616,9 +1407,9 @@ async def dyna(ctx):
             else:
                 msg += "```\nFREE LOT```"
 
-            await ctx.send(msg)
+            await ctx.send(msg + stale_note(as_of))
         else:
-            if bot.registered_dynamis_zone not in (
+            if profile().registered_dynamis_zone not in (
                 "bubu",
                 "qufim",
                 "valkurm",
@@ -627,9 +1418,14 @@ async def dyna(ctx):
                 return await ctx.send(
                     "Current dynamis zone must be a dreamlands zone to do that."
                 )
-            choice_minus_one = await ws.col_values(choice_minus_one_index)
-            choice_acc = await ws.col_values(choice_acc_index)
-            choice_other = await ws.col_values(choice_acc_other_index)
+            (
+                character_name_values,
+                choice_minus_one,
+                choice_acc,
+                choice_other,
+            ), as_of = await read_dynamis_columns(
+                1, choice_minus_one_index, choice_acc_index, choice_acc_other_index
+            )
 
             who_ones = None
             if choice_type == "-1":
@@ -659,45 +1455,142 @@ async def dyna(ctx):
             else:
                 msg += "```\nFREE LOT```"
 
-            await ctx.send(msg)
+            await ctx.send(msg + stale_note(as_of))
+    except SheetsUnavailable as e:
+        logging.error(e)
+        await ctx.send(
+            "Google Sheets can't be reached right now. Try again in a few minutes."
+        )
     except Exception as e:
         logging.error(traceback.format_exc())
 
 
-@bot.command()
+@command()
 async def wishlist(ctx):
     return await sync(ctx, link="link")
 
 
-@bot.command()
-@sheets_access
-async def sync(ctx, link=None):
-    logging.info("Wishlist request initiated.")
+async def fetch_wishlist_entry(author):
+    """(wishlist URL, when it was last synced) registered to a discord user. Raises
+    ValueError if there's none."""
+    author_id = str(author).lower()
+    logging.info(f"Fetching wishlist URL for {author_id}")
+
+    rows = replicated_rows(profile().council_sheets_url, "Wishlist Submissions")
+    if rows is not None:
+        discord_ids = [row[3].lower() for row in rows]
+        row = rows[discord_ids.index(author_id)]
+        return row[4], row[2]
 
-    logging.info("Authorizing Google Sheets...")
     agc = await bot.agcm.authorize()
-    council_ss = await agc.open_by_url(COUNCIL_SHEETS_URL)
+    council_ss = await agc.open_by_url(profile().council_sheets_url)
+    wishlist_lookups = await council_ss.worksheet("Wishlist Submissions")
+
+    discord_ids = [_.lower() for _ in await wishlist_lookups.col_values(4)]
+    discord_id_index = discord_ids.index(author_id) + 1
+    synced_at, _, wishlist_url = (
+        await wishlist_lookups.get_values(f"C{discord_id_index}:E{discord_id_index}")
+    )[0]
+    return wishlist_url, synced_at
+
+
+async def fetch_wishlist_url(author):
+    """The wishlist URL registered to a discord user. Raises ValueError if there's none."""
+    return (await fetch_wishlist_entry(author))[0]
+
 
-    async def fetch_wishlist_url(author):
-        author_id = str(author).lower()
-        logging.info(f"Fetching wishlist URL for {author_id}")
+@sheets_access
+async def plan_sync(ctx, target):
+    """Dry run a sync and report what it would cost: the next sync cycle, a full resync
+    (`all`) or one member's wishlist."""
+    council_url = profile().council_sheets_url
+    level = governor.BACKGROUND
+    if target == "all":
+        title = "Full resync"
+    elif target:
+        title = f"Syncing {target}'s wishlist"
+        level = governor.INTERACTIVE
+        try:
+            wishlist_url = await fetch_wishlist_url(target)
+        except Exception:
+            return await ctx.send(f"{target} doesn't have a wishlist registered.")
+    else:
+        title = "Next wishlist sync"
+        if bot.sync_worker:
+            # The worker keeps the schedule of which wishlists are due
+            title += " (every wishlist checked, the sync worker knows which are due)"
+
+    await ctx.send("Planning it out... nothing will be written.")
+    plan = sync_plan.SyncPlan()
+    with sync_plan.recording(plan):
+        if target == "all":
+            summary = await wishlist_sync.sync_cycle(
+                bot.agcm, council_url, force=True, limit=sync_plan.SAMPLE_SIZE
+            )
+        elif target:
+            summary = {"status": "ok"}
+            try:
+                await wishlist_sync.sync_wishlist_url(
+                    bot.agcm, council_url, wishlist_url
+                )
+            except Exception as e:
+                logging.error(f"Couldn't plan a sync of {wishlist_url}: {e}")
+                summary["status"] = "error"
+        else:
+            summary = await wishlist_sync.sync_cycle(
+                bot.agcm,
+                council_url,
+                schedule=None if bot.sync_worker else profile().sync_schedule,
+            )
 
-        wishlist_lookups = await council_ss.worksheet("Wishlist Submissions")
+    totals = plan.totals(write_buffer.MAX_PENDING_RANGES)
+    if bot.sync_worker and level == governor.BACKGROUND:
+        settings = sync_worker_settings()
+        budgets = governor.SheetsGovernor(
+            settings["read_per_minute"],
+            settings["write_per_minute"],
+            settings["drive_per_minute"],
+        )
+    else:
+        budgets = bot.governor
+    seconds = budgets.seconds_for(
+        {"read": totals["reads"], "write": totals["writes"], "drive": totals["drive"]},
+        level,
+    )
+    report = plan.render(title, totals, seconds)
+    if summary["status"] != "ok":
+        report += (
+            "\n\nThe dry run hit an error (see the log), so this is only part of it."
+        )
+    if len(report) > 1900:
+        report = report[:1900] + "\n..."
+    await ctx.send(f"```{report}```")
 
-        discord_ids = [_.lower() for _ in await wishlist_lookups.col_values(4)]
-        discord_id_index = discord_ids.index(author_id) + 1
-        wishlist_url = (await wishlist_lookups.get_values(f"E{discord_id_index}"))[0][0]
-        return wishlist_url
+
+@command()
+async def sync(ctx, link=None, target=None):
+    logging.info("Wishlist request initiated.")
+
+    if link == "plan":
+        if not await check_user_is_council_or_dev(ctx):
+            return await ctx.send("Only council can plan syncs.")
+        return await plan_sync(ctx, target)
 
     wishlist_url = None
+    synced_at = None
     try:
         if not link:
+            wishlist_url, synced_at = await fetch_wishlist_entry(ctx.author)
+        elif link == "force":
             wishlist_url = await fetch_wishlist_url(ctx.author)
         elif link == "link":
             # Special case: "!wishlist link" --> Get a link to the requester's wishlist.
             wishlist_url = await fetch_wishlist_url(ctx.author)
             await ctx.message.add_reaction("👀")
-            return await ctx.author.send(f"Your wishlist link: {wishlist_url}")
+            as_of = replica_stale_since(profile().council_sheets_url)
+            return await ctx.author.send(
+                f"Your wishlist link: {wishlist_url}" + stale_note(as_of)
+            )
         else:
             wishlist_url = link
     except Exception as e:
@@ -706,246 +1599,331 @@ async def sync(ctx, link=None):
             "ERROR: Check with council to make sure your wishlist is registered."
         )
 
+    # One Drive lookup, before queueing for the sheets, saves a full sync of a
+    # wishlist nobody has touched since the last one. The council sheet's record of
+    # that may come from the replica, so syncs by this command count too.
+    recent = profile().synced_wishlists.get(wishlist_url)
+    if link != "force" and (synced_at or recent):
+        try:
+            modified = await wishlist_sync.last_modified(bot.agcm, wishlist_url)
+        except Exception as e:
+            logging.warning(f"Couldn't check whether {wishlist_url} changed: {e}")
+        else:
+            for since in (recent, synced_at):
+                if wishlist_sync.is_synced(modified, since):
+                    metrics.inc("mtgardener_sync_up_to_date_total")
+                    return await ctx.send(
+                        "That wishlist is already up to date: it hasn't changed since "
+                        f"it was last synced <t:{arrow.get(since).int_timestamp}:R>. "
+                        "Send `!sync force` if it still needs syncing."
+                    )
+
+    return await sync_wishlist(ctx, wishlist_url)
+
+
+@sheets_access
+async def sync_wishlist(ctx, wishlist_url):
     update_msg = "Syncing wishlist with council's sheet... "
     message = await ctx.send(update_msg)
 
-    logging.info("Fetching wishlist sheet reference...")
-    wishlist_ss = None
+    # Edits made from here on may not make it into this sync
+    started = arrow.utcnow()
     try:
-        wishlist_ss = await agc.open_by_url(wishlist_url)
-    except Exception as e:
-        logging.error(e)
+        if bot.sync_worker:
+            summary = await bot.sync_worker.submit(
+                "sync_url",
+                council_url=profile().council_sheets_url,
+                wishlist_url=wishlist_url,
+            )
+            complete = summary["complete"]
+        else:
+            complete = await wishlist_sync.sync_wishlist_url(
+                bot.agcm, profile().council_sheets_url, wishlist_url
+            )
+    except ValueError:
         return await ctx.send("ERROR: Wishlist URL is not valid.")
+    except (SyncWorkerError, asyncio.TimeoutError) as e:
+        logging.error(f"Wishlist sync failed in the sync worker: {e}")
+        return await ctx.send("ERROR: Something went wrong syncing your wishlist.")
+
+    if not complete:
+        # Not marked as synced, so trying again redoes the whole wishlist
+        return await message.edit(
+            content=update_msg
+            + "**Some of it couldn't be synced.** Check the character names are "
+            "filled out and try again."
+        )
 
-    await _sync_apply(wishlist_ss, council_ss)
+    profile().synced_wishlists[wishlist_url] = str(started)
+    metrics.inc("mtgardener_wishlists_synced_total", trigger="command")
     return await message.edit(content=update_msg + "**Done!**")
 
 
-@bot.command()
+@command()
 @commands.check(check_user_is_council_or_dev)
 async def kys(ctx):
     import os, sys
 
     await ctx.send("💀 byebye...")
     try:
+        # execv replaces the process without running atexit hooks, so flush the log now
+        log_listener.stop()
         os.execv(sys.executable, ["python"] + sys.argv)
     except Exception as e:
         logging.error("Exception " + str(e))
 
 
-@sheets_access
-@tasks.loop(minutes=15.0)
-async def sync_wishlists():
-    logging.info("Syncing all wishlists...")
-    logging.info("Force-pulling an access token for google drive metadata lookups...")
-
-    import google.auth.transport.requests
-    import aiohttp
+@command(name="profile")
+@commands.check(check_user_is_council_or_dev)
+async def profile_runs(ctx, target=None, runs: int = profiling.DEFAULT_RUNS):
+    """Profile the next runs of a command, or `sync` for the wishlist sync."""
+    if target is None:
+        if not profiling.sessions:
+            return await ctx.send(
+                "Usage: `!profile <command|sync> [runs]`, or `!profile off`. "
+                "Nothing is being profiled right now."
+            )
+        armed = ", ".join(
+            f"{name} ({session.runs - session.captured} to go)"
+            for name, session in profiling.sessions.items()
+        )
+        return await ctx.send(f"Profiling: {armed}")
+    if target.lower() == "off":
+        stopped = profiling.stop()
+        return await ctx.send(
+            f"Stopped profiling {', '.join(stopped)}."
+            if stopped
+            else "Nothing was being profiled."
+        )
 
-    async def fetch(url, session):
-        async with session.get(url) as resp:
-            return await resp.json()
+    target = target.lower().lstrip("!")
+    command = bot.get_command(target)
+    if target != "sync" and (command is None or command.name == "profile"):
+        return await ctx.send(f"There's no command called `{target}` to profile.")
+    if command is not None:
+        target = command.qualified_name
+    if not 1 <= runs <= profiling.MAX_RUNS:
+        return await ctx.send(
+            f"I can profile between 1 and {profiling.MAX_RUNS} runs at a time."
+        )
 
-    try:
-        agc = await bot.agcm.authorize()
-        request = google.auth.transport.requests.Request()
-        agc.gc.auth.refresh(request)
-        drive_access_token = "Bearer " + agc.gc.auth.token
-
-        council_ss = await agc.open_by_url(COUNCIL_SHEETS_URL)
-        logging.info("Pulling links and timestamps...")
-        wishlist_ws = await council_ss.worksheet("Wishlist Submissions")
-        wishlist_rows = await wishlist_ws.get_values("A:F")
-        ss_id_to_timestamps = {}
-
-        async with aiohttp.ClientSession(
-            headers={"Authorization": drive_access_token}
-        ) as session:
-            drive_urls = []
-            for i in range(1, len(wishlist_rows)):
-                wishlist_url = wishlist_rows[i][4]
-                if wishlist_rows[i][5] == "TRUE":
-                    continue
-
-                if not wishlist_url:
-                    continue
-
-                ss_id = None
-                try:
-                    ss_id = (
-                        re.compile(
-                            r".+docs.google.com\/spreadsheets\/d\/(.+?)\/?(?:\/.+)?$"
-                        )
-                        .match(wishlist_url)
-                        .group(1)
-                    )
-                except Exception as e:
-                    logging.error(f"Invalid URL: " + wishlist_url)
-                    continue
+    author = ctx.author
+    profiling.start(target, runs, PROFILING_PATH, author.send)
+    msg = f"Profiling the next {runs} run{'s' if runs > 1 else ''} of `{target}`. I'll DM you what I find."
+    if target == "sync" and bot.sync_worker:
+        msg += "\nThe wishlist sync runs in the worker process, so only the bot's side of `!sync` will be captured."
+    await ctx.send(msg)
+
+
+# Numeric settings `!reload` can change, which have to be above zero
+RELOADABLE_NUMBERS = (
+    "loop_stall_threshold",
+    "sheets_reads_per_minute",
+    "sheets_writes_per_minute",
+    "drive_requests_per_minute",
+    "alert_lead_minutes",
+    "replica_refresh_minutes",
+    "command_queue_depth",
+    "command_deadline_seconds",
+)
 
-                drive_urls.append(
-                    f"https://www.googleapis.com/drive/v3/files/{ss_id}?supportsAllDrives=true&fields=name,modifiedTime,webViewLink,id"
-                )
-                ss_id_to_timestamps[ss_id] = wishlist_rows[i][2]
-
-            logging.info("Executing parallel requests for wishlist metadata...")
-            tasks = []
-            for drive_url in drive_urls:
-                task = asyncio.ensure_future(fetch(drive_url, session))
-                tasks.append(task)
-
-            responses = await asyncio.gather(*tasks)
-            logging.info("Done. Checking to see which lists need updating...")
-
-            usernames_no_update_needed = []
-            for wishlist_metadata in responses:
-                mod_str = wishlist_metadata["modifiedTime"]
-                upd_str = ss_id_to_timestamps[wishlist_metadata["id"]]
-                web_link = wishlist_metadata["webViewLink"]
-                ss_name = wishlist_metadata["name"]
-                if not upd_str:
-                    logging.info(f"{ss_name} has never been updated. Updating...")
-                    wishlist_ss = await agc.open_by_url(web_link)
-                    await _sync_apply(wishlist_ss, council_ss)
-                elif arrow.get(mod_str) > arrow.get(upd_str):
-                    delta = arrow.now() - arrow.get(mod_str)
-                    delta_str = (
-                        f"{delta.days} days ago"
-                        if delta.days
-                        else f"{delta.seconds} seconds ago"
-                    )
-                    logging.info(f"{ss_name} is out of date ({delta_str}). Updating...")
-                    wishlist_ss = await agc.open_by_url(web_link)
-                    await _sync_apply(wishlist_ss, council_ss)
-                else:
-                    usernames_no_update_needed.append(ss_name)
 
-            logging.info(
-                f"{usernames_no_update_needed} - Up to date, no update needed."
+def read_config():
+    """Read the config file again and check it. Raises ValueError if it won't do."""
+    try:
+        with open(args.config, "r") as f:
+            new_config = yaml.safe_load(f)
+    except (OSError, yaml.YAMLError) as e:
+        raise ValueError(f"Couldn't read {args.config}: {e}")
+    if not isinstance(new_config, dict):
+        raise ValueError(f"{args.config} doesn't hold any settings")
+
+    for key in RELOADABLE_NUMBERS:
+        value = new_config.get(key)
+        if value is not None and not (isinstance(value, (int, float)) and value > 0):
+            raise ValueError(f"{key} has to be a number above zero, not {value!r}")
+    deadlines = new_config.get("command_deadlines") or {}
+    if not isinstance(deadlines, dict):
+        raise ValueError("command_deadlines has to map command names to seconds")
+    for command, value in deadlines.items():
+        if not (isinstance(value, (int, float)) and value > 0):
+            raise ValueError(
+                f"command_deadlines for {command} has to be above zero, not {value!r}"
             )
-    except Exception as e:
-        logging.error(
-            f"An error occurred while syncing wishlists. {traceback.format_exc()}"
-        )
-
+    try:
+        logging.Logger("check").setLevel(new_config.get("log_level", "INFO"))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"log_level isn't a log level: {e}")
 
-async def _sync_apply(wishlist_ss, council_ss):
-    from loot_mappings import (
-        DYNAMIS_MAIN,
-        DYNAMIS_ALT,
-        SKY_MAIN,
-        SKY_ALT,
-        SEA_MAIN,
-        SEA_ALT,
-        LIMBUS_MAIN,
-        LIMBUS_ALT,
+    # Throwaway profiles catch anything that would trip up the real ones
+    try:
+        new_profiles = profiles.load_profiles(new_config)
+    except (TypeError, ValueError) as e:
+        raise ValueError(str(e))
+    if {p.name for p in new_profiles} != {p.name for p in PROFILES}:
+        raise ValueError("Adding or removing guild profiles needs a restart")
+    for new_profile in new_profiles:
+        if not (
+            isinstance(new_profile.sync_minutes, (int, float))
+            and new_profile.sync_minutes > 0
+        ):
+            raise ValueError(
+                f"sync_interval_minutes of '{new_profile.name}' has to be above zero"
+            )
+        problems = new_profile.registry.refresh(bot)
+        if problems:
+            raise ValueError(f"In '{new_profile.name}', {problems[0]}")
+    return new_config
+
+
+def apply_config(new_config):
+    """Switch the running bot over to a config `read_config` has checked.
+
+    Nothing in here awaits, so no command or background job sees half of the change.
+    Caches, attendance tracking, scheduled alerts and reminders are all kept.
+    """
+    global config
+    sheets_before = {
+        p.name: (p.council_sheets_url, p.job_sheets_url, p.party_sheet_name)
+        for p in PROFILES
+    }
+    settings = profiles.profile_settings(new_config)
+    for guild_profile in PROFILES:
+        guild_profile.configure(settings[guild_profile.name])
+        # read_config checked the IDs resolve, and a new alert message is fetched on use
+        guild_profile.registry.refresh(bot)
+    PROFILES_BY_GUILD.clear()
+    PROFILES_BY_GUILD.update({p.server_id: p for p in PROFILES})
+    configure(new_config)
+    config = new_config
+
+    logging.getLogger().setLevel(
+        config["log_level"] if "log_level" in config else "INFO"
     )
+    bot.watchdog.threshold = LOOP_STALL_THRESHOLD
+    bot.governor.set_budgets(
+        SHEETS_READS_PER_MINUTE * (1 - SYNC_WORKER_SHARE),
+        SHEETS_WRITES_PER_MINUTE * (1 - SYNC_WORKER_SHARE),
+        DRIVE_REQUESTS_PER_MINUTE * (1 - SYNC_WORKER_SHARE),
+    )
+    for guild_profile in PROFILES:
+        guild_profile.sync_schedule.min_interval = guild_profile.sync_minutes * 60
+        guild_profile.sync_schedule.boost = guild_profile.sync_boost_minutes * 60
+        if guild_profile.sync_loop:
+            guild_profile.sync_loop.change_interval(minutes=guild_profile.sync_minutes)
+        sheets = (
+            guild_profile.council_sheets_url,
+            guild_profile.job_sheets_url,
+            guild_profile.party_sheet_name,
+        )
+        if sheets != sheets_before[guild_profile.name]:
+            guild_profile.job_table = new_job_table(guild_profile)
+    if bot.replica:
+        track_replica_sheets()
+        bot.replica_loop.change_interval(minutes=REPLICA_REFRESH_MINUTES)
+    if bot.sync_worker:
+        bot.sync_worker.reload(sync_worker_settings())
 
-    logging.info(f"Applying wishlist sync for {wishlist_ss.title}...")
-    council_dynamis_ws = await council_ss.worksheet("Dynamis Wishlists")
-    council_sky_ws = await council_ss.worksheet("Sky Requests")
-    council_sea_ws = await council_ss.worksheet("Sea Requests")
-    council_limbus_ws = await council_ss.worksheet("Limbus Requests")
 
-    logging.info("Looking up character names for wishlist sync...")
-    charname_main = None
-    charname_alt = None
+@command()
+@commands.check(check_user_is_council_or_dev)
+async def reload(ctx):
+    """Re-read the config file and loot mappings, without restarting."""
+    start = time.perf_counter()
     try:
-        charname_main = (
-            (await wishlist_ss.values_get("INSTRUCTIONS!D2"))["values"][0][0]
-            .lower()
-            .strip()
+        new_config = read_config()
+        mappings = wishlist_sync.load_loot_mappings()
+    except ValueError as e:
+        metrics.inc("mtgardener_reloads_total", status="error")
+        return await ctx.send(f"Nothing was reloaded, still running as before. {e}")
+
+    needs_restart = [
+        key for key in RESTART_SETTINGS if new_config.get(key) != config.get(key)
+    ]
+    apply_config(new_config)
+    wishlist_sync.use_loot_mappings(mappings)
+    elapsed = time.perf_counter() - start
+    logging.info(f"Reloaded the config and loot mappings in {elapsed:.3f}s.")
+    metrics.inc("mtgardener_reloads_total", status="ok")
+
+    msg = f"Reloaded the config and loot mappings in {elapsed * 1000:.0f}ms."
+    if needs_restart:
+        msg += (
+            f"\nThese changed, but only take effect after a restart (`!kys`): "
+            f"{', '.join(needs_restart)}"
         )
-        charname_alt = (
-            (await wishlist_ss.values_get("INSTRUCTIONS!F2"))["values"][0][0]
-            .lower()
-            .strip()
+    await ctx.send(msg)
+
+
+async def sync_wishlists(guild_profile):
+    logs.command_name.set("sync_wishlists")
+    logs.correlation_id.set(logs.new_correlation_id())
+    profiles.current_profile.set(guild_profile)
+    # Let interactive commands jump ahead of this cycle's requests
+    governor.current_priority.set(governor.BACKGROUND)
+    session = profiling.session_for("sync") if profiling.sessions else None
+    if session:
+        async with session.capture(f"sync_wishlists ({guild_profile.name})"):
+            summary = await wishlist_sync.sync_cycle(
+                bot.agcm,
+                guild_profile.council_sheets_url,
+                lock=guild_profile.sheets_lock.exclusive,
+                schedule=guild_profile.sync_schedule,
+            )
+    else:
+        summary = await wishlist_sync.sync_cycle(
+            bot.agcm,
+            guild_profile.council_sheets_url,
+            lock=guild_profile.sheets_lock.exclusive,
+            schedule=guild_profile.sync_schedule,
         )
-    except Exception as e:
-        pass
+    record_sync_cycle(summary, guild_profile.name)
 
-    if not charname_main:
-        logging.error("Character names are not filled out!")
-        return
 
-    logging.info(
-        f"  Syncing wishlist items for {charname_main}{' and ' + charname_alt if charname_alt else ''}..."
-    )
+def start_sync_loop(guild_profile):
+    """Sync the guild's wishlists on its own schedule."""
 
-    async def push_wishlist_updates(charname, mapping, wishlist_ss, council_ws):
-        dest = next(iter(mapping))
-        dest = dest[: dest.index("!")]
-        logging.info(f"{charname}: pulling from {dest}")
-        charname_col_values = [_.lower() for _ in await council_ws.col_values(1)]
+    @tasks.loop(minutes=guild_profile.sync_minutes)
+    async def sync_loop():
+        await sync_wishlists(guild_profile)
 
-        row_index = None
-        try:
-            row_index = charname_col_values.index(charname) + 1
-        except:
-            logging.warning(f"Could not find {charname} in {council_ws}")
-            return
-
-        batch_gets = list(mapping.keys())
-        items_to_push = await wishlist_ss.values_batch_get(ranges=batch_gets)
-
-        logging.info(f"{charname}: pushing to council sheet {council_ws.title}")
-        batch_updates = []
-        batch_clears = []
-        for item in items_to_push["valueRanges"]:
-            destination = mapping[item["range"]] + str(row_index)
-            if "values" in item:
-                batch_updates.append({"range": destination, "values": item["values"]})
-            else:
-                batch_clears.append(destination)
+    guild_profile.sync_loop = sync_loop
+    sync_loop.start()
 
-        await council_ws.batch_clear(batch_clears)
-        return await council_ws.batch_update(batch_updates)
 
-    dynamis_megadict_main = {k: v for d in DYNAMIS_MAIN for k, v in d.items()}
-    dynamis_megadict_alt = {k: v for d in DYNAMIS_ALT for k, v in d.items()}
+async def refresh_replica():
+    logs.command_name.set("refresh_replica")
+    logs.correlation_id.set(logs.new_correlation_id())
+    governor.current_priority.set(governor.BACKGROUND)
+    await bot.replica.refresh()
 
-    try:
-        # Main
-        await push_wishlist_updates(
-            charname_main, dynamis_megadict_main, wishlist_ss, council_dynamis_ws
-        )
-        await push_wishlist_updates(
-            charname_main, SKY_MAIN, wishlist_ss, council_sky_ws
-        )
-        await push_wishlist_updates(
-            charname_main, SEA_MAIN, wishlist_ss, council_sea_ws
-        )
-        await push_wishlist_updates(
-            charname_main, LIMBUS_MAIN, wishlist_ss, council_limbus_ws
-        )
 
-        # Alt
-        if charname_alt:
-            await push_wishlist_updates(
-                charname_alt, dynamis_megadict_alt, wishlist_ss, council_dynamis_ws
-            )
-            await push_wishlist_updates(
-                charname_alt, SKY_ALT, wishlist_ss, council_sky_ws
-            )
-            await push_wishlist_updates(
-                charname_alt, SEA_ALT, wishlist_ss, council_sea_ws
-            )
-            await push_wishlist_updates(
-                charname_alt, LIMBUS_ALT, wishlist_ss, council_limbus_ws
-            )
-    except Exception as e:
-        logging.error(e)
+def start_replica_loop():
+    """Keep the local copy of the sheets up to date."""
 
-    # TODO: clean this up
-    wishlist_lookups = await council_ss.worksheet("Wishlist Submissions")
-    charnames = [_.lower() for _ in (await wishlist_lookups.col_values(1))]
-    update_index = charnames.index(charname_main.lower()) + 1
-    await wishlist_lookups.update_acell(f"C{update_index}", str(arrow.utcnow()))
-    logging.info("Done!")
-    return
+    @tasks.loop(minutes=REPLICA_REFRESH_MINUTES)
+    async def replica_loop():
+        await refresh_replica()
+
+    bot.replica_loop = replica_loop
+    replica_loop.start()
 
 
-@bot.command()
+def record_sync_cycle(summary, guild):
+    metrics.observe("mtgardener_sync_cycle_seconds", summary["seconds"], guild=guild)
+    metrics.inc("mtgardener_sync_cycles_total", status=summary["status"], guild=guild)
+    metrics.inc(
+        "mtgardener_wishlists_synced_total",
+        summary["synced"],
+        trigger="cycle",
+        guild=guild,
+    )
+    metrics.inc(
+        "mtgardener_wishlists_not_due_total", summary.get("skipped", 0), guild=guild
+    )
+
+
+@command()
 @commands.check(check_user_can_have_nice_things)
 async def reminder(ctx):
     regex = re.compile(r"!reminder(?:\s(to .+))?\s((?:in|on|at)[a-zA-Z0-9\s]+)(@.+)?")
@@ -959,8 +1937,7 @@ async def reminder(ctx):
         matches = res.groups()
         when = matches[1]
 
-        cal = parsedatetime.Calendar()
-        time_struct, _ = cal.parse(when)
+        time_struct, _ = calendar().parse(when)
         target_time = time.mktime(time_struct)
 
         async def remind_in(when, msg, mentions_section):
@@ -985,74 +1962,202 @@ async def reminder(ctx):
         logging.error(traceback.format_exc())
 
 
-@bot.command()
-async def att(ctx, state, event_name=None):
+async def save_attendance(guild_profile, event):
+    """Write an event's points to the roster sheet, and say how it went."""
+    label, points = event
+    try:
+        # The client keeps spreadsheets it opened, so this only costs a call the first time
+        agc = await bot.agcm.authorize()
+        roster_ss = await agc.open_by_url(guild_profile.google_sheets_url)
+        column, missing = await attendance.write_back(
+            roster_ss,
+            guild_profile.roster_sheet_name,
+            label,
+            points,
+            name_column=guild_profile.roster_name_column,
+        )
+    except Exception as e:
+        logging.error(f"Couldn't write attendance for {label} to the roster: {e}")
+        return (
+            "I couldn't write the points to the roster sheet. "
+            "Send `!att save` to try again."
+        )
+    metrics.inc("mtgardener_attendance_saved_total", len(points) - len(missing))
+    msg = (
+        f"Wrote points for {len(points) - len(missing)} members to column {column} "
+        f"(**{label}**) of {guild_profile.roster_sheet_name}."
+    )
+    if missing:
+        msg += f" Not on the roster: {', '.join(sorted(missing))}."
+    return msg
+
+
+@command()
+async def att(
+    ctx,
+    state,
+    event_name=None,
+    *channels: typing.Union[discord.VoiceChannel, discord.CategoryChannel],
+):
     try:
-        event_channels = bot.get_channel(EVENT_VOICE_CHANNEL_GROUP_ID).voice_channels
-        if state == "start":
-            bot.att_tracker = {}
-            bot.att_tracking_start = arrow.now()
-            bot.att_tracking_message = await ctx.message.reply(
+        guild_profile = profile()
+        sessions = guild_profile.attendance
+        if state == "save":
+            if not await check_user_is_council_or_dev(ctx):
+                return await ctx.send(
+                    "Only council can write attendance to the roster sheet."
+                )
+            event = sessions.last_event(event_name)
+            if not event:
+                return await ctx.send("There's no tracked event to save.")
+            return await ctx.send(await save_attendance(guild_profile, event))
+        elif state == "list":
+            if not sessions:
+                return await ctx.send("There's no attendance session running.")
+            lines = [
+                f"**{session.name}** since <t:{session.started.int_timestamp}:t>, "
+                f"{len(session.tracker)} members tracked"
+                for session in sessions.sessions.values()
+            ]
+            return await ctx.send("\n".join(lines))
+        elif state == "start":
+            # Named channels or categories, or else the configured event channels
+            voice_channels = []
+            for channel in channels:
+                if isinstance(channel, discord.CategoryChannel):
+                    voice_channels += channel.voice_channels
+                else:
+                    voice_channels.append(channel)
+            try:
+                session = sessions.start(
+                    event_name, voice_channels or guild_profile.registry.event_channels
+                )
+            except attendance_sessions.SessionExists as e:
+                return await ctx.send(
+                    f"Attendance for **{e}** is already being tracked. Give this one "
+                    "another name, e.g. `!att start Sky`."
+                )
+            session.mark_present()
+            session.message = await ctx.message.reply(
                 f"Starting attendance tracking{(' **for ' + event_name + '**') if event_name else ''}."
             )
-            for event_channel in event_channels:
-                for event_member in event_channel.members:
-                    if str(event_member) not in bot.att_tracker:
-                        bot.att_tracker[str(event_member)] = []
-                    bot.att_tracker[str(event_member)].append(arrow.now())
 
         elif state == "stop":
-            att_delta = arrow.now() - bot.att_tracking_start
-            bot.att_tracking_start = None
-            for event_channel in event_channels:
-                for event_member in event_channel.members:
-                    if str(event_member) not in bot.att_tracker:
-                        bot.att_tracker[str(event_member)] = []
-                    bot.att_tracker[str(event_member)].append(arrow.now())
-            results = {}
-            for user in bot.att_tracker:
-                timestamps = bot.att_tracker[user]
-                pairs = [
-                    (timestamps[i], timestamps[i - 1])
-                    for i in range(len(timestamps) - 1, 0, -2)
-                ]
-                total = 0
-                for end, start in pairs:
-                    total += (end - start).seconds
-
-                # hacky work-around, if the total time is EXACTLY a half hour increment
-                # add in one second to avoid banker's rounding
-                if total % (60 * 30) == 0:
-                    total += 1
-
-                results[user] = (round(total / (60 * 60)), total / att_delta.seconds)
-
-            discord_users_tracked = [
-                _ for _ in bot.get_guild(MT_SERVER_ID).members if str(_) in results
-            ]
-            roster = await get_roster_for_users(discord_users_tracked)
+            try:
+                session = sessions.stop(event_name)
+            except LookupError as e:
+                return await ctx.send(str(e))
+            ended = arrow.now()
+            session.mark_present(ended)
+            results = session.results(ended)
+
+            roster = await get_roster_for_users(list(session.members.values()))
             points_lookup = {
-                roster[user]["main"]: results[str(user)][0]
-                for user in discord_users_tracked
+                roster[user]["main"]: results[str(user)][0] for user in roster
             }
-            await bot.att_tracking_message.reply(
-                f"Stopping attendance tracking. Points: ```{points_lookup}```"
+            event = (
+                attendance.event_label(session.name, session.started),
+                points_lookup,
+            )
+            sessions.record(session.name, event)
+            # Anyone can track an event, but only council write to the roster sheet
+            if await check_user_is_council_or_dev(ctx):
+                saved = await save_attendance(guild_profile, event)
+            else:
+                saved = (
+                    "A council member can write them to the roster sheet with "
+                    "`!att save`."
+                )
+            await (session.message or ctx.message).reply(
+                f"Stopping attendance tracking. Points: ```{points_lookup}```\n{saved}"
             )
-            bot.att_tracker = None
-            bot.att_tracking_message = None
     except Exception as e:
         logging.error(traceback.format_exc())
 
 
-@bot.listen()
+def refresh_registry(guild, roles_only=False):
+    """Look up a guild's configured channels and roles again after discord changed them."""
+    guild_profile = PROFILES_BY_GUILD.get(guild.id)
+    if not guild_profile:
+        return
+    if roles_only:
+        guild_profile.registry.refresh_roles()
+        return
+    for problem in guild_profile.registry.refresh(bot):
+        logging.error(f"In '{guild_profile.name}', {problem}")
+
+
+@listen("on_guild_channel_create")
+@listen("on_guild_channel_delete")
+async def on_guild_channel_change(channel):
+    refresh_registry(channel.guild)
+
+
+@listen()
+async def on_guild_channel_update(before, after):
+    refresh_registry(after.guild)
+
+
+@listen("on_guild_role_create")
+@listen("on_guild_role_delete")
+async def on_guild_role_change(role):
+    refresh_registry(role.guild, roles_only=True)
+
+
+@listen()
+async def on_guild_role_update(before, after):
+    refresh_registry(after.guild, roles_only=True)
+
+
+@listen("on_raw_message_edit")
+@listen("on_raw_message_delete")
+@listen("on_raw_reaction_add")
+@listen("on_raw_reaction_remove")
+@listen("on_raw_reaction_clear")
+@listen("on_raw_reaction_clear_emoji")
+async def on_raw_message_change(payload):
+    guild_profile = PROFILES_BY_GUILD.get(payload.guild_id)
+    if guild_profile:
+        guild_profile.registry.message_changed(payload.message_id)
+
+
+@listen()
 async def on_ready():
+    problems = []
+    for guild_profile in PROFILES:
+        problems += [
+            f"In '{guild_profile.name}', {problem}"
+            for problem in await guild_profile.registry.resolve(bot)
+        ]
+    if problems and not bot.ready_once:
+        # A wrong ID in the config would otherwise only show up when a command needs it
+        for problem in problems:
+            logging.critical(problem)
+        bot.startup_problems = problems
+        return await bot.close()
+    for problem in problems:
+        logging.error(problem)
+    bot.ready_once = True
     logging.info("Bot is ready!")
 
 
 async def main():
+    logging.info(f"Imported the bot in {IMPORT_SECONDS:.2f}s.")
+    metrics.set_gauge("mtgardener_import_seconds", IMPORT_SECONDS, stage="bot")
+    # Import the Sheets modules on a thread while the bot logs in and connects to the
+    # gateway. setup_hook sets up the Sheets side on a task once they're in.
+    bot.sheets_import = asyncio.get_running_loop().run_in_executor(
+        None, import_sheets_modules
+    )
     # start the client
     async with bot:
         await bot.start(BOT_TOKEN)
+    if bot.startup_problems:
+        import sys
+
+        sys.exit(1)
 
 
-asyncio.run(main())
+if __name__ == "__main__":
+    setup()
+    asyncio.run(main())
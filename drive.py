@@ -0,0 +1,220 @@
+"""Google Drive file metadata lookups.
+
+gspread only talks to the Sheets API, which doesn't say when a spreadsheet last changed.
+The Drive API does, so anything that wants to skip work on unchanged sheets asks here.
+Lookups of several files go through Drive's batch endpoint, which takes up to 100 of
+them in one multipart HTTP request and answers each in a part of its own.
+"""
+
+import re
+import json
+import time
+import uuid
+import asyncio
+import urllib.parse
+
+import aiohttp
+import google.auth.transport.requests
+
+import sheets
+import metrics
+import sync_plan
+
+DRIVE_FILES_URL = "https://www.googleapis.com/drive/v3/files"
+DRIVE_BATCH_URL = "https://www.googleapis.com/batch/drive/v3"
+
+# Most requests Drive accepts in one batch
+BATCH_SIZE = 100
+
+DEFAULT_FIELDS = "name,modifiedTime,webViewLink,id"
+SPREADSHEET_URL_PATTERN = re.compile(
+    r".+docs.google.com\/spreadsheets\/d\/(.+?)\/?(?:\/.+)?$"
+)
+
+
+def spreadsheet_id(url):
+    """The file ID in a Google Sheets URL. Raises AttributeError if it isn't one."""
+    return SPREADSHEET_URL_PATTERN.match(url).group(1)
+
+
+async def session(agcm):
+    """An aiohttp session authorized with the client manager's service account."""
+    agc = await agcm.authorize()
+    auth = agc.gc.auth
+    if not getattr(auth, "valid", False):
+        # The refresh is a blocking HTTP call, so keep it off the event loop
+        await asyncio.get_running_loop().run_in_executor(
+            None, auth.refresh, google.auth.transport.requests.Request()
+        )
+    return aiohttp.ClientSession(headers={"Authorization": "Bearer " + auth.token})
+
+
+async def file_metadata(agcm, session, file_id, fields=DEFAULT_FIELDS):
+    """Fetch a file's Drive metadata, waiting on the governor's Drive budget first.
+
+    Rate limited, 5xx, network failures and timeouts are retried with backoff like
+    Sheets calls.
+    """
+    plan = sync_plan.current_plan.get()
+    if plan is not None:
+        plan.drive_call([file_id])
+    attempt = 0
+    while True:
+        if agcm.governor:
+            await agcm.governor.acquire("drive")
+        start = time.perf_counter()
+        status = "error"
+        try:
+            async with session.get(
+                f"{DRIVE_FILES_URL}/{file_id}",
+                params={"supportsAllDrives": "true", "fields": fields},
+            ) as resp:
+                status = resp.status
+                body = await resp.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if attempt + 1 >= sheets.MAX_ATTEMPTS:
+                raise
+        finally:
+            metrics.inc("mtgardener_drive_calls_total", status=status)
+            metrics.observe(
+                "mtgardener_drive_call_seconds", time.perf_counter() - start
+            )
+
+        if status != "error" and status != 429 and status < 500:
+            return body
+        attempt += 1
+        if attempt >= sheets.MAX_ATTEMPTS:
+            return body
+        if status == 429 and agcm.governor:
+            agcm.governor.throttle("drive")
+        metrics.inc("mtgardener_drive_retries_total", status=status)
+        await asyncio.sleep(sheets.backoff(attempt))
+
+
+def _retryable(status):
+    return status == "error" or status == 429 or status >= 500
+
+
+def _batch_body(file_ids, fields, boundary):
+    """A multipart/mixed batch of metadata GETs, one part per file in order."""
+    path = urllib.parse.urlsplit(DRIVE_FILES_URL).path
+    query = urllib.parse.urlencode({"supportsAllDrives": "true", "fields": fields})
+    body = ""
+    for i, file_id in enumerate(file_ids):
+        body += (
+            f"--{boundary}\r\n"
+            "Content-Type: application/http\r\n"
+            f"Content-ID: <item{i}>\r\n\r\n"
+            f"GET {path}/{urllib.parse.quote(file_id)}?{query}\r\n\r\n"
+        )
+    return body + f"--{boundary}--\r\n"
+
+
+def _part_response(raw):
+    """(status, JSON body) of the HTTP response held in one part of a batch response."""
+    head, _, body = raw.replace(b"\r\n", b"\n").partition(b"\n\n")
+    status = int(head.split(None, 2)[1])
+    try:
+        return status, json.loads(body) if body.strip() else {}
+    except ValueError:
+        text = body.decode("utf-8", "replace")
+        return status, {"error": {"code": status, "message": text}}
+
+
+async def _read_batch(resp):
+    """{part number: (status, body)} of a batch response, by each part's Content-ID."""
+    parts = {}
+    reader = aiohttp.MultipartReader.from_response(resp)
+    while True:
+        part = await reader.next()
+        if part is None:
+            return parts
+        # Drive answers <itemN> with <response-itemN>
+        content_id = part.headers.get("Content-ID", "").strip("<>")
+        raw = await part.read()
+        if content_id.startswith("response-item"):
+            parts[int(content_id[len("response-item") :])] = _part_response(raw)
+
+
+async def files_metadata(agcm, session, file_ids, fields=DEFAULT_FIELDS):
+    """Fetch the Drive metadata of several files, BATCH_SIZE to an HTTP request.
+
+    Returns {file ID: metadata}. A file Drive couldn't look up maps to the error it
+    answered with, which has an "error" key. Files that were rate limited or hit a 5xx
+    are retried with backoff in a smaller batch, like Sheets calls.
+    """
+    file_ids = list(dict.fromkeys(file_ids))
+    results = {}
+    await asyncio.gather(
+        *[
+            _fetch_batch(agcm, session, file_ids[i : i + BATCH_SIZE], fields, results)
+            for i in range(0, len(file_ids), BATCH_SIZE)
+        ]
+    )
+    return results
+
+
+async def _fetch_batch(agcm, session, file_ids, fields, results):
+    plan = sync_plan.current_plan.get()
+    if plan is not None:
+        plan.drive_call(file_ids, BATCH_SIZE)
+    pending = file_ids
+    attempt = 0
+    while True:
+        if agcm.governor:
+            # Drive counts every file in a batch against the quota, not the batch
+            await agcm.governor.acquire("drive", cost=len(pending))
+        boundary = "batch_" + uuid.uuid4().hex
+        start = time.perf_counter()
+        status = "error"
+        parts = {}
+        body = None
+        try:
+            async with session.post(
+                DRIVE_BATCH_URL,
+                data=_batch_body(pending, fields, boundary),
+                headers={"Content-Type": f"multipart/mixed; boundary={boundary}"},
+            ) as resp:
+                status = resp.status
+                if status == 200:
+                    parts = await _read_batch(resp)
+                else:
+                    body = await resp.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            if attempt + 1 >= sheets.MAX_ATTEMPTS:
+                raise
+            status = "error"
+        finally:
+            metrics.inc("mtgardener_drive_calls_total", status=status)
+            metrics.observe(
+                "mtgardener_drive_call_seconds", time.perf_counter() - start
+            )
+
+        retry = []
+        reason = status
+        for i, file_id in enumerate(pending):
+            if status == 200:
+                # A part missing from the response is as good as a failed one
+                part_status, part_body = parts.get(
+                    i, (500, {"error": {"code": 500, "message": "No response part"}})
+                )
+                metrics.inc("mtgardener_drive_batch_parts_total", status=part_status)
+            else:
+                part_status = status
+                part_body = body or {"error": {"code": status}}
+            results[file_id] = part_body
+            if _retryable(part_status):
+                retry.append(file_id)
+                if reason == 200 or part_status == 429:
+                    reason = part_status
+
+        if not retry:
+            return
+        attempt += 1
+        if attempt >= sheets.MAX_ATTEMPTS:
+            return
+        if reason == 429 and agcm.governor:
+            agcm.governor.throttle("drive")
+        metrics.inc("mtgardener_drive_retries_total", status=reason)
+        await asyncio.sleep(sheets.backoff(attempt))
+        pending = retry
@@ -0,0 +1,240 @@
+"""Quota governor for Google Sheets and Drive requests.
+
+Google enforces per-minute read and write quotas on the Sheets API. Every
+request the bot makes takes a token from one of the governor's buckets first,
+and when tokens run short, waiting requests are released in priority order so
+that interactive commands jump ahead of the background wishlist sync.
+"""
+
+import time
+import heapq
+import asyncio
+import itertools
+import contextlib
+import contextvars
+
+import metrics
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+# The priority of whatever is making Sheets requests in the current task
+current_priority = contextvars.ContextVar("sheets_priority", default=INTERACTIVE)
+
+# How many seconds worth of requests a bucket may burst through at once
+BURST_SECONDS = 10
+
+# Fraction of a bucket's capacity that background work may not dip into
+BACKGROUND_RESERVE = 0.25
+
+# gspread methods that only read. Everything else is billed as a write.
+READ_METHODS = {
+    "open",
+    "open_by_key",
+    "open_by_url",
+    "openall",
+    "list_spreadsheet_files",
+    "fetch_sheet_metadata",
+    "worksheet",
+    "worksheets",
+    "get_worksheet",
+    "get_worksheet_by_id",
+    "values_get",
+    "values_batch_get",
+    "get",
+    "batch_get",
+    "get_values",
+    "get_all_values",
+    "get_all_records",
+    "col_values",
+    "row_values",
+    "acell",
+    "cell",
+    "range",
+    "find",
+    "findall",
+}
+
+
+def method_kind(method):
+    return "read" if getattr(method, "__name__", "") in READ_METHODS else "write"
+
+
+@contextlib.contextmanager
+def priority(level):
+    """Run the enclosed Sheets requests at the given priority."""
+    token = current_priority.set(level)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, name, per_minute):
+        self.name = name
+        self._set_rate(per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.waiters = []
+        self.counter = itertools.count()
+        self.timer = None
+
+    def _set_rate(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * BURST_SECONDS)
+        self.reserve = self.capacity * BACKGROUND_RESERVE
+
+    def set_rate(self, per_minute):
+        """Change the budget, keeping the tokens already earned at the old rate."""
+        self._refill()
+        self._set_rate(per_minute)
+        self.tokens = min(self.tokens, self.capacity)
+        if self.waiters:
+            self._dispatch()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _floor(self, level, cost):
+        if level == INTERACTIVE:
+            return 0
+        return min(self.reserve, self.capacity - cost)
+
+    def _report_depth(self):
+        for level, name in PRIORITY_NAMES.items():
+            depth = sum(
+                1
+                for waiter in self.waiters
+                if waiter[0] == level and not waiter[3].done()
+            )
+            metrics.set_gauge(
+                "mtgardener_governor_queue_depth",
+                depth,
+                budget=self.name,
+                priority=name,
+            )
+
+    def drain(self):
+        """Spend every token, so requests wait for the bucket to refill."""
+        self._refill()
+        self.tokens = 0
+
+    def queue_depth(self):
+        return sum(1 for waiter in self.waiters if not waiter[3].done())
+
+    def seconds_for(self, count, level=INTERACTIVE):
+        """How long `count` more requests would take to get tokens, if nothing else
+        wanted any."""
+        self._refill()
+        available = max(0.0, self.tokens - self._floor(level, 1))
+        return max(0.0, (count - available) / self.rate)
+
+    async def acquire(self, level, cost=1):
+        cost = min(cost, self.capacity)
+        self._refill()
+        if not self.waiters and self.tokens - cost >= self._floor(level, cost):
+            self.tokens -= cost
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (level, next(self.counter), cost, future))
+        self._report_depth()
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The token was granted just as we were cancelled, so give it back
+                self.tokens += cost
+            self._dispatch()
+            raise
+
+    def _dispatch(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+        self._refill()
+        while self.waiters:
+            level, _, cost, future = self.waiters[0]
+            if future.done():
+                heapq.heappop(self.waiters)
+                continue
+            if self.tokens - cost < self._floor(level, cost):
+                break
+            heapq.heappop(self.waiters)
+            self.tokens -= cost
+            future.set_result(None)
+        self._report_depth()
+
+        if self.waiters:
+            level, _, cost, _ = self.waiters[0]
+            shortfall = cost + self._floor(level, cost) - self.tokens
+            self.timer = asyncio.get_running_loop().call_later(
+                max(shortfall / self.rate, 0.01), self._dispatch
+            )
+
+
+class SheetsGovernor:
+    """Token buckets for Sheets reads, Sheets writes and Drive requests."""
+
+    def __init__(self, read_per_minute=60, write_per_minute=60, drive_per_minute=600):
+        self.buckets = {
+            "read": TokenBucket("read", read_per_minute),
+            "write": TokenBucket("write", write_per_minute),
+            "drive": TokenBucket("drive", drive_per_minute),
+        }
+
+    async def acquire(self, kind, cost=1, level=None):
+        level = current_priority.get() if level is None else level
+        start = time.perf_counter()
+        await self.buckets[kind].acquire(level, cost)
+        waited = time.perf_counter() - start
+        metrics.observe(
+            "mtgardener_governor_wait_seconds",
+            waited,
+            budget=kind,
+            priority=PRIORITY_NAMES[level],
+        )
+        if waited > 0.001:
+            metrics.inc(
+                "mtgardener_governor_throttled_total",
+                budget=kind,
+                priority=PRIORITY_NAMES[level],
+            )
+
+    def set_budgets(self, read_per_minute, write_per_minute, drive_per_minute):
+        self.buckets["read"].set_rate(read_per_minute)
+        self.buckets["write"].set_rate(write_per_minute)
+        self.buckets["drive"].set_rate(drive_per_minute)
+
+    def seconds_for(self, counts, level=INTERACTIVE):
+        """How long the given number of requests per budget would take to get through.
+
+        The budgets refill side by side, so the slowest one decides. Other traffic and
+        Google's response times only add to it.
+        """
+        return max(
+            (
+                self.buckets[kind].seconds_for(count, level)
+                for kind, count in counts.items()
+            ),
+            default=0.0,
+        )
+
+    def throttle(self, kind):
+        """Back off a budget Google says we're over, whatever the governor thinks."""
+        self.buckets[kind].drain()
+        metrics.inc("mtgardener_governor_drained_total", budget=kind)
+
+    def status(self):
+        """Tokens available and requests queued, per budget."""
+        status = {}
+        for kind, bucket in self.buckets.items():
+            bucket._refill()
+            status[kind] = (bucket.tokens, bucket.capacity, bucket.queue_depth())
+        return status
@@ -0,0 +1,167 @@
+"""Materialized job assignments for `!job` and `!alertjobs`.
+
+Joining the roster against the job sheet costs a handful of Sheets reads, and the answer
+only changes when someone edits one of those spreadsheets. The table joins them once,
+keeps every member's rendered reply, and rebuilds only when Drive reports that the job
+or council spreadsheet was modified since.
+
+Given a Replica, the table is built from its local copies instead, and rebuilt whenever
+the replica has copied a newer version, without asking Drive or Sheets itself.
+"""
+
+import time
+import asyncio
+import logging
+
+import drive
+
+# Minimum seconds between asking Drive whether the sheets changed
+CHECK_INTERVAL = 30
+
+
+def render(main_name, main_job, alt_name, alt_job):
+    """The `!job` reply for one member, minus the mention."""
+    if not main_job and not alt_job:
+        return "You're not on the job sheet."
+
+    msg = ""
+    if main_job:
+        msg += f"[{main_name}: **{main_job if main_job else 'Unspecified'}**] "
+    if alt_job:
+        msg += f"[{alt_name}: **{alt_job if alt_job else 'Unspecified'}**]"
+    return msg
+
+
+class JobTable:
+    """Every roster member's main/alt job assignments, keyed by discord username."""
+
+    def __init__(
+        self,
+        agcm,
+        council_url,
+        job_url,
+        party_sheet_name,
+        check_interval=CHECK_INTERVAL,
+        replica=None,
+    ):
+        self.agcm = agcm
+        self.replica = replica
+        self.council_url = council_url
+        self.job_url = job_url
+        self.party_sheet_name = party_sheet_name
+        self.check_interval = check_interval
+        self.entries = {}
+        self.versions = None
+        self.checked = None
+        self.built = None
+        self._lock = None
+
+    @property
+    def lock(self):
+        # Created lazily so it binds to the running loop, not whichever existed at import
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def _replicated(self):
+        return (
+            self.replica is not None
+            and self.replica.has(self.council_url, "Wishlist Submissions")
+            and self.replica.has(self.job_url, self.party_sheet_name)
+        )
+
+    def _due(self):
+        if self._replicated():
+            # Looking at the replica's versions costs nothing
+            return True
+        return self.checked is None or (
+            time.monotonic() - self.checked >= self.check_interval
+        )
+
+    async def _versions(self):
+        """When the job and council spreadsheets were last modified, or None if unknown."""
+        if self._replicated():
+            return (
+                "replica",
+                self.replica.version(self.job_url),
+                self.replica.version(self.council_url),
+            )
+        try:
+            ss_ids = [
+                drive.spreadsheet_id(url) for url in (self.job_url, self.council_url)
+            ]
+            async with await drive.session(self.agcm) as session:
+                metadata = await drive.files_metadata(
+                    self.agcm, session, ss_ids, fields="modifiedTime"
+                )
+            return tuple(metadata[ss_id]["modifiedTime"] for ss_id in ss_ids)
+        except Exception as e:
+            logging.warning(f"Couldn't check whether the job sheets changed: {e}")
+            return None
+
+    async def refresh(self, force=False, check_now=False):
+        """Rebuild the table if the sheets changed, checking Drive at most every interval.
+
+        With `check_now`, Drive is asked whatever the interval, for when an edit made
+        moments ago matters.
+        """
+        if not (force or check_now or self._due()):
+            return
+
+        async with self.lock:
+            # Someone else may have refreshed while we waited
+            if not (force or check_now or self._due()):
+                return
+            versions = await self._versions()
+            if force or versions is None or versions != self.versions:
+                await self._rebuild()
+                self.versions = versions
+            self.checked = time.monotonic()
+
+    async def _rebuild(self):
+        logging.info("Rebuilding the job assignment table...")
+        if self._replicated():
+            roster_range = [
+                row[:4]
+                for row in self.replica.values(self.council_url, "Wishlist Submissions")
+            ]
+            job_range = [
+                row[1:3]
+                for row in self.replica.values(self.job_url, self.party_sheet_name)
+            ]
+        else:
+            agc = await self.agcm.authorize()
+            council_ss = await agc.open_by_url(self.council_url)
+            roster_ws = await council_ss.worksheet("Wishlist Submissions")
+            party_ss = await agc.open_by_url(self.job_url)
+            party_ws = await party_ss.worksheet(self.party_sheet_name)
+
+            roster_range, job_range = await asyncio.gather(
+                roster_ws.get_values("A:D"), party_ws.get_values("B:C")
+            )
+        job_map = {row[0]: row[1] for row in job_range}
+
+        def get_job_assignment(name):
+            return job_map[name] if (name and name in job_map) else None
+
+        entries = {}
+        for row in roster_range[1:]:
+            main_name = row[0]
+            alt_name = row[1] if row[1] else None
+            main_job = get_job_assignment(main_name)
+            alt_job = get_job_assignment(alt_name)
+            entries[row[3]] = {
+                "main": main_name,
+                "alt": alt_name,
+                "main_job": main_job,
+                "alt_job": alt_job,
+                "message": render(main_name, main_job, alt_name, alt_job),
+            }
+
+        self.entries = entries
+        self.built = time.time()
+        logging.info(f"Job assignment table built for {len(entries)} members.")
+
+    def lookup(self, user):
+        """The member's entry, or None if they aren't on the roster."""
+        return self.entries.get(str(user))
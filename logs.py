@@ -0,0 +1,122 @@
+"""Logging setup for MT Gardener.
+
+Records are handed to a queue on the thread that logs them and written out by a listener
+thread, so the event loop never waits on file or console I/O. The log file gets one JSON
+object per line, tagged with the command (or background job) and correlation ID that
+produced it; the console keeps the familiar one-line text format.
+"""
+
+import json
+import time
+import uuid
+import queue
+import logging
+import contextlib
+import contextvars
+import logging.handlers
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+
+# What the current task is doing, stamped onto every record it logs
+command_name = contextvars.ContextVar("log_command", default=None)
+correlation_id = contextvars.ContextVar("log_correlation_id", default=None)
+
+
+def new_correlation_id():
+    return uuid.uuid4().hex[:12]
+
+
+@contextlib.contextmanager
+def log_context(command, correlation=None):
+    """Tag records logged inside the block with a command name and correlation ID."""
+    command_token = command_name.set(command)
+    correlation_token = correlation_id.set(correlation or new_correlation_id())
+    try:
+        yield
+    finally:
+        command_name.reset(command_token)
+        correlation_id.reset(correlation_token)
+
+
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        record.command = command_name.get()
+        record.correlation_id = correlation_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "command": getattr(record, "command", None),
+            "correlation_id": getattr(record, "correlation_id", None),
+            "logger": record.name,
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def setup_logging(path, level="INFO"):
+    """Route the root logger through a queue to a JSON file and the console.
+
+    Returns the started QueueListener; stop it to flush anything still queued.
+    """
+    log_queue = queue.SimpleQueue()
+
+    file_handler = logging.FileHandler(path)
+    file_handler.setFormatter(JsonFormatter())
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler)
+    listener.start()
+    return listener
+
+
+class LogSampler:
+    """Sampling and rate limiting for messages logged once per row, user or wishlist.
+
+    For each key, only every `every`th message is considered, and at most `limit` of
+    those are logged per `window` seconds. The number dropped is reported when the
+    window rolls over, so the cost of logging stays flat as the roster grows.
+    """
+
+    def __init__(self):
+        self.windows = {}
+
+    def log(self, level, key, msg, *args, every=1, limit=10, window=60.0):
+        if not logging.getLogger().isEnabledFor(level):
+            return
+
+        now = time.monotonic()
+        start, seen, logged, dropped = self.windows.get(key, (now, 0, 0, 0))
+        if now - start >= window:
+            if dropped:
+                logging.log(
+                    level,
+                    f"({dropped} '{key}' messages sampled out in the last {now - start:.0f}s)",
+                )
+            start, seen, logged, dropped = now, 0, 0, 0
+
+        seen += 1
+        if seen % every == 0 and logged < limit:
+            logged += 1
+            logging.log(level, msg, *args)
+        else:
+            dropped += 1
+        self.windows[key] = (start, seen, logged, dropped)
+
+
+_sampler = LogSampler()
+log_sampled = _sampler.log
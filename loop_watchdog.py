@@ -0,0 +1,69 @@
+"""Event loop stall watchdog.
+
+The discord gateway heartbeat, every command and the wishlist sync all share one asyncio
+loop, so anything that blocks it stalls the whole bot. A heartbeat task on the loop
+records how late it wakes up, and a monitor thread watching that heartbeat logs the
+loop thread's stack whenever the loop has been stuck for longer than the threshold.
+"""
+
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+
+import metrics
+
+
+class LoopWatchdog:
+    def __init__(self, threshold=0.5, interval=0.1):
+        self.threshold = threshold
+        self.interval = interval
+        self.last_tick = None
+        self.loop_thread_id = None
+        self.task = None
+        self.thread = None
+        self.stopping = threading.Event()
+
+    def start(self):
+        """Start watching the running loop. Must be called from a coroutine on that loop."""
+        self.loop_thread_id = threading.get_ident()
+        self.last_tick = time.monotonic()
+        self.task = asyncio.ensure_future(self.heartbeat())
+        self.thread = threading.Thread(
+            target=self.monitor, name="loop-watchdog", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.task:
+            self.task.cancel()
+
+    async def heartbeat(self):
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.last_tick = time.monotonic()
+            metrics.observe(
+                "mtgardener_loop_lag_seconds",
+                max(0.0, self.last_tick - before - self.interval),
+            )
+
+    def monitor(self):
+        reported_tick = None
+        while not self.stopping.wait(self.interval):
+            last_tick = self.last_tick
+            stalled_for = time.monotonic() - last_tick
+            if stalled_for < self.threshold or reported_tick == last_tick:
+                continue
+
+            # Report each stall once, with what the loop thread is stuck on right now
+            reported_tick = last_tick
+            metrics.inc("mtgardener_loop_stalls_total")
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "(unavailable)"
+            logging.warning(
+                f"Event loop has been blocked for {stalled_for:.2f}s. Loop thread stack:\n{stack}"
+            )
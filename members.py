@@ -0,0 +1,108 @@
+"""Guild member lookups that work with or without a full member cache.
+
+By default discord.py keeps every member of every guild in memory. With
+`member_cache: lean` in the config, it only keeps members who are in a voice channel
+(attendance tracking needs those) and guilds aren't chunked at startup, so memory no
+longer grows with guild size. Everything else that needs a member, like the role checks
+on DM commands or the hiatus check on alert subscribers, looks them up here. Lookups
+use the client's cache first, then a small LRU of recent answers, and only then ask
+discord.
+"""
+
+import time
+import collections
+
+import discord
+
+import metrics
+
+# How many looked-up members are remembered in lean mode
+DEFAULT_SIZE = 256
+
+# Seconds before a remembered member is looked up again, so role changes are picked up
+MEMBER_TTL = 300
+
+# Most members discord returns for one gateway query
+QUERY_BATCH = 100
+
+
+def client_options(mode):
+    """Extra discord client options for a `member_cache` setting (full or lean)."""
+    if mode == "lean":
+        return {
+            "member_cache_flags": discord.MemberCacheFlags(voice=True, joined=False),
+            "chunk_guilds_at_startup": False,
+        }
+    if mode != "full":
+        raise ValueError(f"member_cache must be full or lean, not {mode}")
+    return {}
+
+
+class MemberCache:
+    """Members looked up outside the client's cache, least recently used dropped first."""
+
+    def __init__(self, max_size=DEFAULT_SIZE, ttl=MEMBER_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        # (guild ID, user ID) -> (when it was looked up, the member or None)
+        self.entries = collections.OrderedDict()
+
+    def _cached(self, guild, user_id):
+        """(found, member) from the client's cache or the LRU."""
+        member = guild.get_member(user_id)
+        if member is not None:
+            metrics.inc("mtgardener_member_lookups_total", source="client")
+            return True, member
+
+        key = (guild.id, user_id)
+        entry = self.entries.get(key)
+        if entry and time.monotonic() - entry[0] < self.ttl:
+            self.entries.move_to_end(key)
+            metrics.inc("mtgardener_member_lookups_total", source="lru")
+            return True, entry[1]
+        return False, None
+
+    def _remember(self, guild, user_id, member):
+        key = (guild.id, user_id)
+        self.entries[key] = (time.monotonic(), member)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    async def get(self, guild, user_id):
+        """The guild's member with that ID, or None if they aren't in it."""
+        found, member = self._cached(guild, user_id)
+        if found:
+            return member
+
+        metrics.inc("mtgardener_member_lookups_total", source="fetch")
+        try:
+            member = await guild.fetch_member(user_id)
+        except discord.NotFound:
+            member = None
+        self._remember(guild, user_id, member)
+        return member
+
+    async def get_many(self, guild, user_ids):
+        """The guild's members with those IDs, keyed by ID. Non-members are left out.
+
+        Misses are asked for a hundred at a time over the gateway rather than one REST
+        call each, and aren't kept, so one big lookup doesn't flush the LRU.
+        """
+        members = {}
+        missing = []
+        for user_id in user_ids:
+            found, member = self._cached(guild, user_id)
+            if not found:
+                missing.append(user_id)
+            elif member is not None:
+                members[user_id] = member
+
+        for i in range(0, len(missing), QUERY_BATCH):
+            batch = missing[i : i + QUERY_BATCH]
+            metrics.inc("mtgardener_member_lookups_total", len(batch), source="query")
+            for member in await guild.query_members(
+                user_ids=batch, limit=QUERY_BATCH, cache=False
+            ):
+                members[member.id] = member
+        return members
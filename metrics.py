@@ -0,0 +1,165 @@
+"""In-process metrics for MT Gardener.
+
+Counters, gauges and latency histograms are kept in a single registry, which can
+be rendered as Prometheus text or summarized for the `!stats` command.
+"""
+
+import time
+import contextlib
+
+# Upper bounds (in seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def _escape(label_value):
+    return (
+        str(label_value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    )
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def quantile(self, q):
+        """Estimate a quantile from the bucket counts (upper bound of the bucket it lands in).
+
+        Past the last bucket, that bucket's bound is returned: the quantile is at least
+        that. `describe` says so.
+        """
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.bucket_counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return self.buckets[-1]
+
+    def describe(self, q):
+        """A quantile in seconds for people to read, e.g. "0.5s" or "> 300.0s"."""
+        value = self.quantile(q)
+        # Values past the last bound aren't counted in any bucket
+        if self.count and q * self.count > sum(self.bucket_counts):
+            return f"> {value}s"
+        return f"{value}s"
+
+
+class Metrics:
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.started = time.time()
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+    def inc(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        self.histograms[key].observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter_value(self, name, **labels):
+        return self.counters.get(self._key(name, labels), 0)
+
+    def series(self, name, kind="counters"):
+        """All (labels, value) pairs recorded for a metric name."""
+        return [
+            (dict(labels), value)
+            for (metric, labels), value in getattr(self, kind).items()
+            if metric == name
+        ]
+
+    def render_prometheus(self):
+        def fmt_labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+        lines = []
+        typed = set()
+        for (name, labels), value in sorted(self.counters.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{fmt_labels(labels)} {value}")
+        for (name, labels), value in sorted(self.gauges.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} gauge")
+                typed.add(name)
+            lines.append(f"{name}{fmt_labels(labels)} {value}")
+        for (name, labels), hist in sorted(self.histograms.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, count in zip(hist.buckets, hist.bucket_counts):
+                cumulative += count
+                lines.append(
+                    f"{name}_bucket{fmt_labels(labels, [('le', bound)])} {cumulative}"
+                )
+            lines.append(
+                f"{name}_bucket{fmt_labels(labels, [('le', '+Inf')])} {hist.count}"
+            )
+            lines.append(f"{name}_sum{fmt_labels(labels)} {hist.sum}")
+            lines.append(f"{name}_count{fmt_labels(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+
+# The process-wide registry, and shortcuts to it
+REGISTRY = Metrics()
+inc = REGISTRY.inc
+set_gauge = REGISTRY.set_gauge
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+
+
+async def start_http_server(host, port):
+    """Serve the registry as Prometheus text on http://host:port/metrics."""
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(
+            text=REGISTRY.render_prometheus(),
+            content_type="text/plain",
+            charset="utf-8",
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner
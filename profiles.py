@@ -0,0 +1,127 @@
+"""Per-guild configuration profiles.
+
+One bot process can serve several linkshells, each in its own discord guild with its own
+channels and spreadsheets. Everything that differs between them, along with the caches
+and state built from it, lives on a GuildProfile. The discord gateway connection, the
+Sheets client and the request governor are shared by all of them.
+"""
+
+import contextlib
+import contextvars
+
+from sheets import SheetsLock
+from admission import Admission
+from registry import Registry
+from attendance_sessions import AttendanceSessions
+from sync_schedule import SyncSchedule
+
+# Settings every profile needs, either from the top level of the config or its own entry
+REQUIRED_FIELDS = (
+    "server_id",
+    "feedback_channel_id",
+    "future_outlook_id",
+    "alert_channel_id",
+    "alert_message_id",
+    "event_channel_group_id",
+    "roster_sheet_name",
+    "party_sheet_name",
+    "dynamis_wishlist_sheet_name",
+    "party_comp_channel_id",
+    "google_sheets_url",
+    "job_sheets_url",
+    "council_sheets_url",
+    "probot_id",
+)
+
+# The profile of the guild the current command or background job is working for
+current_profile = contextvars.ContextVar("guild_profile")
+
+
+@contextlib.contextmanager
+def use(profile):
+    """Run the enclosed code on behalf of the given guild profile."""
+    token = current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        current_profile.reset(token)
+
+
+class GuildProfile:
+    def __init__(self, name, settings):
+        self.name = name
+        self.configure(settings)
+
+        # Caches and state, kept apart per guild
+        self.sheets_lock = SheetsLock()
+        self.admission = Admission(self.sheets_lock, name)
+        # Resolved once the bot has connected to discord
+        self.registry = Registry(self)
+        self.job_table = None
+        self.sync_loop = None
+        self.sync_schedule = SyncSchedule(
+            self.sync_minutes * 60, boost=self.sync_boost_minutes * 60
+        )
+        self.scheduled_alert = None
+        self.registered_dynamis_zone = None
+        # Column number -> (values, when they were read) of the dynamis wishlist sheet
+        self.dynamis_columns = {}
+        self.attendance = AttendanceSessions()
+        # Wishlist URL -> when `!sync` last synced it, which the replica may not show yet
+        self.synced_wishlists = {}
+
+    def configure(self, settings):
+        """Take on the given settings. Caches and state are left as they are."""
+        self.server_id = settings["server_id"]
+        self.feedback_channel_id = settings["feedback_channel_id"]
+        self.future_outlook_id = settings["future_outlook_id"]
+        self.alert_channel_id = settings["alert_channel_id"]
+        self.alert_message_id = settings["alert_message_id"]
+        self.event_channel_group_id = settings["event_channel_group_id"]
+        self.party_comp_channel_id = settings["party_comp_channel_id"]
+        self.roster_sheet_name = settings["roster_sheet_name"]
+        self.party_sheet_name = settings["party_sheet_name"]
+        self.dynamis_wishlist_sheet_name = settings["dynamis_wishlist_sheet_name"]
+        self.google_sheets_url = settings["google_sheets_url"]
+        # Column of the roster sheet with character names, which attendance is matched on
+        # (None for the first)
+        self.roster_name_column = settings.get("roster_name_column")
+        self.job_sheets_url = settings["job_sheets_url"]
+        self.council_sheets_url = settings["council_sheets_url"]
+        self.probot_id = int(settings["probot_id"])
+        self.sync_minutes = settings.get("sync_interval_minutes", 15)
+        self.sync_boost_minutes = settings.get("sync_boost_minutes", 120)
+
+    def __repr__(self):
+        return f"<GuildProfile {self.name} ({self.server_id})>"
+
+
+def profile_settings(config):
+    """The settings of each guild profile described by the config, by profile name.
+
+    Entries under `guilds` are named profiles whose settings override the top-level ones.
+    Without a `guilds` section the top-level settings make up a single "default" profile,
+    which is how single-linkshell configs have always looked. Raises ValueError if a
+    profile is missing a required setting.
+    """
+    defaults = {key: value for key, value in config.items() if key != "guilds"}
+    guilds = config.get("guilds") or {"default": {}}
+
+    settings = {}
+    for name, overrides in guilds.items():
+        settings[name] = dict(defaults, **(overrides or {}))
+        missing = [field for field in REQUIRED_FIELDS if field not in settings[name]]
+        if missing:
+            raise ValueError(
+                f"Guild profile '{name}' is missing required parameters: {', '.join(missing)}"
+            )
+    return settings
+
+
+def load_profiles(config):
+    """Build the guild profiles described by the config. Raises ValueError like
+    `profile_settings`."""
+    return [
+        GuildProfile(name, settings)
+        for name, settings in profile_settings(config).items()
+    ]
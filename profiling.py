@@ -0,0 +1,324 @@
+"""On-demand profiling of commands and wishlist sync cycles.
+
+`!profile <command|sync> [n]` arms a Profiler for the next n runs of a command, where
+`sync` covers both `!sync` and the periodic wishlist sync. Each of those runs is captured
+with cProfile, tracemalloc and timings of the asyncio tasks it starts. How long it spent
+waiting on Sheets, Drive, the governor and the sheets lock is read off the metrics. The
+full results are written to files, and a summary goes to whoever asked for them.
+
+Nothing is hooked in while no profiler is armed: callers only look further when
+`sessions` isn't empty.
+"""
+
+import os
+import io
+import sys
+import time
+import pstats
+import asyncio
+import logging
+import cProfile
+import contextlib
+import tracemalloc
+import collections.abc
+
+import metrics
+
+DEFAULT_RUNS = 1
+MAX_RUNS = 20
+
+# Rows per table in the summary, and in the files written next to it
+SUMMARY_ROWS = 6
+FILE_ROWS = 60
+
+# Frames kept per allocation traceback while tracing memory
+TRACEMALLOC_FRAMES = 10
+
+# Where the event loop sits when it has nothing to do, which cProfile counts as time spent
+IDLE_FUNCTIONS = ("<method 'poll'", "<method 'select'", "<method 'control'")
+
+# Histograms of time spent waiting on something, summed over a run
+WAITS = (
+    ("Sheets calls", "mtgardener_sheets_call_seconds"),
+    ("  queued before sending", "mtgardener_sheets_wait_seconds"),
+    ("Drive calls", "mtgardener_drive_call_seconds"),
+    ("Governor", "mtgardener_governor_wait_seconds"),
+    ("Sheets lock", "mtgardener_lock_wait_seconds"),
+)
+
+# What's being profiled -> the Profiler armed for it
+sessions = {}
+
+# cProfile, tracemalloc and the task factory are process-wide, so one run at a time
+_capturing = False
+
+# Reports being written, kept so they aren't garbage collected halfway
+_reports = set()
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def start(target, runs, path, notify):
+    """Profile the next `runs` runs of `target`, passing each summary to `notify`."""
+    sessions[target] = Profiler(target, runs, path, notify)
+    return sessions[target]
+
+
+def stop(target=None):
+    """Stop profiling `target`, or everything. Returns what was stopped."""
+    if target is None:
+        stopped = list(sessions)
+        sessions.clear()
+        return stopped
+    return [target] if sessions.pop(target, None) else []
+
+
+def session_for(target):
+    """The profiler that wants to capture this run of `target`, if one does."""
+    session = sessions.get(target)
+    if session is None or _capturing:
+        return None
+    return session
+
+
+def _wait_totals():
+    totals = {}
+    for _, metric in WAITS:
+        series = metrics.REGISTRY.series(metric, "histograms")
+        totals[metric] = (
+            sum(hist.count for _, hist in series),
+            sum(hist.sum for _, hist in series),
+        )
+    return totals
+
+
+def _package(filename):
+    """Roughly which package a profiled function belongs to."""
+    if filename.startswith("~") or filename.startswith("<"):
+        return "(builtins)"
+    path = os.path.abspath(filename)
+    if os.path.dirname(path) == _ROOT:
+        return os.path.splitext(os.path.basename(path))[0]
+    parts = path.split(os.sep)
+    for marker in ("site-packages", "dist-packages"):
+        if marker in parts:
+            return os.path.splitext(parts[parts.index(marker) + 1])[0]
+    for prefix in sorted(sys.path, key=len, reverse=True):
+        if prefix and path.startswith(os.path.abspath(prefix) + os.sep):
+            rest = path[len(os.path.abspath(prefix)) + 1 :]
+            return os.path.splitext(rest.split(os.sep)[0])[0]
+    return os.path.basename(path)
+
+
+class _TaskTiming:
+    def __init__(self, name):
+        self.name = name
+        self.created = time.perf_counter()
+        self.finished = None
+        self.running = 0.0
+        self.steps = 0
+
+
+class _TimedCoroutine(collections.abc.Coroutine):
+    """Wraps a task's coroutine to time each step it runs on the loop."""
+
+    def __init__(self, coro, timing):
+        self.coro = coro
+        self.timing = timing
+
+    def _step(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        except BaseException:
+            self.timing.finished = time.perf_counter()
+            raise
+        finally:
+            self.timing.running += time.perf_counter() - start
+            self.timing.steps += 1
+
+    def send(self, value):
+        return self._step(self.coro.send, value)
+
+    def throw(self, *args):
+        return self._step(self.coro.throw, *args)
+
+    def close(self):
+        return self.coro.close()
+
+    def __await__(self):
+        return self.coro.__await__()
+
+
+class _Capture:
+    """Everything recorded about one run."""
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.tasks = []
+        self.previous_factory = self.loop.get_task_factory()
+        self.loop.set_task_factory(self._task_factory)
+        self.was_tracing = tracemalloc.is_tracing()
+        if not self.was_tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        self.memory_before = tracemalloc.take_snapshot()
+        self.waits = _wait_totals()
+        self.profile = cProfile.Profile()
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        self.wall = time.perf_counter() - self.wall
+        self.cpu = time.thread_time() - self.cpu
+        after = _wait_totals()
+        self.waits = {
+            metric: (after[metric][0] - count, after[metric][1] - seconds)
+            for metric, (count, seconds) in self.waits.items()
+        }
+        self.memory_after = tracemalloc.take_snapshot()
+        if not self.was_tracing:
+            tracemalloc.stop()
+        self.loop.set_task_factory(self.previous_factory)
+
+    def _task_factory(self, loop, coro, **kwargs):
+        timing = _TaskTiming(getattr(coro, "__qualname__", type(coro).__name__))
+        self.tasks.append(timing)
+        coro = _TimedCoroutine(coro, timing)
+        if self.previous_factory:
+            return self.previous_factory(loop, coro, **kwargs)
+        return asyncio.Task(coro, loop=loop, **kwargs)
+
+    def report(self, title, rows):
+        """The run written up as text, with `rows` rows per table."""
+        lines = [
+            title,
+            f"{self.wall:.2f}s wall, {self.cpu:.2f}s of CPU on the event loop's thread",
+            "",
+            "Waiting (seconds, calls; concurrent waits add up past wall time):",
+        ]
+        for label, metric in WAITS:
+            count, seconds = self.waits[metric]
+            lines.append(f"  {label}: {seconds:.2f}s, {count}")
+
+        stats = pstats.Stats(self.profile)
+        idle = 0.0
+        busy = {}
+        by_package = {}
+        for key, timings in stats.stats.items():
+            filename, _, function = key
+            if filename == "~" and function.startswith(IDLE_FUNCTIONS):
+                idle += timings[2]
+                continue
+            busy[key] = timings
+            package = _package(filename)
+            by_package[package] = by_package.get(package, 0.0) + timings[2]
+        lines.append(f"  Event loop idle: {idle:.2f}s")
+        lines.append("")
+        lines.append("Loop CPU by package (own time):")
+        for package, seconds in sorted(by_package.items(), key=lambda i: -i[1])[:rows]:
+            lines.append(f"  {package}: {seconds:.3f}s")
+
+        lines.append("")
+        lines.append("Slowest functions (own time, calls):")
+        slowest = sorted(busy.items(), key=lambda item: -item[1][2])[:rows]
+        for (filename, line, function), (_, calls, own, _, _) in slowest:
+            where = f"{os.path.basename(filename)}:{line}" if line else filename
+            lines.append(f"  {own:.3f}s {calls}x {function} ({where})")
+
+        growth = self.memory_after.filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+            ]
+        ).compare_to(self.memory_before, "lineno")
+        grown = [stat for stat in growth if stat.size_diff > 0]
+        lines.append("")
+        lines.append(
+            f"Memory still held at the end: {sum(s.size_diff for s in grown) / 1024:.0f} KiB"
+        )
+        for stat in grown[:rows]:
+            frame = stat.traceback[0]
+            lines.append(
+                f"  +{stat.size_diff / 1024:.0f} KiB "
+                f"{os.path.basename(frame.filename)}:{frame.lineno}"
+            )
+
+        by_name = {}
+        for task in self.tasks:
+            count, running, wall = by_name.get(task.name, (0, 0.0, 0.0))
+            finished = task.finished or time.perf_counter()
+            by_name[task.name] = (
+                count + 1,
+                running + task.running,
+                wall + finished - task.created,
+            )
+        lines.append("")
+        lines.append("Tasks started (count, running on the loop / alive):")
+        for name, (count, running, wall) in sorted(
+            by_name.items(), key=lambda item: -item[1][1]
+        )[:rows]:
+            lines.append(f"  {name}: {count}x, {running:.3f}s / {wall:.2f}s")
+        return "\n".join(lines)
+
+    def write(self, base, title):
+        """Save the cProfile data and a long report. Blocking, so run in an executor."""
+        self.profile.dump_stats(base + ".prof")
+        detail = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=detail)
+        stats.sort_stats("cumulative").print_stats(FILE_ROWS)
+        stats.sort_stats("tottime").print_stats(FILE_ROWS)
+        with open(base + ".txt", "w") as f:
+            f.write(self.report(title, FILE_ROWS))
+            f.write("\n\n")
+            f.write(detail.getvalue())
+
+
+class Profiler:
+    """Captures the next `runs` runs of `target`."""
+
+    def __init__(self, target, runs, path, notify):
+        self.target = target
+        self.runs = runs
+        self.captured = 0
+        self.path = path
+        self.notify = notify
+
+    @contextlib.asynccontextmanager
+    async def capture(self, label):
+        global _capturing
+        _capturing = True
+        self.captured += 1
+        run = self.captured
+        if run >= self.runs and sessions.get(self.target) is self:
+            del sessions[self.target]
+
+        capture = _Capture()
+        capture.start()
+        try:
+            yield
+        finally:
+            capture.stop()
+            _capturing = False
+            # Written up once the run is over, so it doesn't add to what was measured
+            task = asyncio.ensure_future(self._report(capture, label, run))
+            _reports.add(task)
+            task.add_done_callback(_reports.discard)
+
+    async def _report(self, capture, label, run):
+        title = f"{label}, run {run} of {self.runs}"
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        base = os.path.join(self.path, f"{self.target}-{stamp}-{run}")
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            await asyncio.get_running_loop().run_in_executor(
+                None, capture.write, base, title
+            )
+            summary = capture.report(title, SUMMARY_ROWS)
+            summary += f"\n\nFull results: {base}.txt and {base}.prof"
+            if len(summary) > 1900:
+                summary = summary[:1900] + "\n..."
+            await self.notify(f"```{summary}```")
+        except Exception as e:
+            logging.error(f"Couldn't report profiling results for {label}: {e}")
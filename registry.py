@@ -0,0 +1,143 @@
+"""The discord objects a guild profile refers to, looked up once rather than on every use.
+
+A profile names its channels, its event voice channel group and the job alert message by
+ID, and commands check members for a few roles by name. Each profile's Registry resolves
+all of them when the bot connects, so commands get cached objects instead of scanning
+every channel the bot can see, comparing role names or fetching the alert message again.
+
+The bot refreshes a registry when discord reports that channels or roles changed, and
+the alert message is fetched again after it's edited or reacted to. Anything configured
+that can't be found is returned as a problem, which is fatal at startup.
+"""
+
+# Roles whose members may use council commands
+COUNCIL_ROLES = ("Elder Tree Treants (Council)", "MT Gardener Dev", "Council Help")
+
+# Members with this role don't get the fun commands
+NO_NICE_THINGS_ROLE = "Cannot Have Nice Things"
+
+# Roles with this in their name mark members on hiatus
+HIATUS_MARKER = "hiatus"
+
+# Profile settings holding the ID of a text channel -> what the channel is for
+CHANNELS = {
+    "feedback_channel_id": "feedback",
+    "future_outlook_id": "outlook",
+    "alert_channel_id": "alert",
+    "party_comp_channel_id": "party_comp",
+}
+
+
+class Registry:
+    """One guild's configured channels, roles and alert message, resolved."""
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.guild = None
+        # What a channel is for (see CHANNELS) -> the channel
+        self.channels = {}
+        self.event_channels = []
+        # Role IDs
+        self.council_roles = set()
+        self.no_nice_things_roles = set()
+        self.hiatus_roles = set()
+        self._alert_message = None
+
+    @property
+    def feedback_channel(self):
+        return self.channels.get("feedback")
+
+    @property
+    def outlook_channel(self):
+        return self.channels.get("outlook")
+
+    @property
+    def alert_channel(self):
+        return self.channels.get("alert")
+
+    @property
+    def party_channel(self):
+        return self.channels.get("party_comp")
+
+    def refresh(self, client):
+        """Look up the guild, channels and roles from the client's cache again.
+
+        Returns what couldn't be found, as messages naming the setting at fault.
+        """
+        profile = self.profile
+        problems = []
+        self.guild = client.get_guild(profile.server_id)
+        if self.guild is None:
+            problems.append(
+                f"server_id {profile.server_id} isn't a guild the bot is in"
+            )
+
+        for setting, purpose in CHANNELS.items():
+            channel_id = getattr(profile, setting)
+            self.channels[purpose] = client.get_channel(channel_id)
+            if self.channels[purpose] is None:
+                problems.append(
+                    f"{setting} {channel_id} isn't a channel the bot can see"
+                )
+
+        group = client.get_channel(profile.event_channel_group_id)
+        # Only channel categories have voice channels
+        if group is None or not hasattr(group, "voice_channels"):
+            problems.append(
+                f"event_channel_group_id {profile.event_channel_group_id} isn't a "
+                "channel category the bot can see"
+            )
+            self.event_channels = []
+        else:
+            self.event_channels = list(group.voice_channels)
+
+        self.refresh_roles()
+        return problems
+
+    def refresh_roles(self):
+        roles = self.guild.roles if self.guild else []
+        self.council_roles = {role.id for role in roles if role.name in COUNCIL_ROLES}
+        self.no_nice_things_roles = {
+            role.id for role in roles if role.name == NO_NICE_THINGS_ROLE
+        }
+        self.hiatus_roles = {
+            role.id for role in roles if HIATUS_MARKER in role.name.lower()
+        }
+
+    async def resolve(self, client):
+        """Refresh everything, fetching the alert message too. Returns the problems."""
+        problems = self.refresh(client)
+        self._alert_message = None
+        if self.alert_channel is not None:
+            try:
+                await self.alert_message()
+            except Exception as e:
+                problems.append(
+                    f"alert_message_id {self.profile.alert_message_id} couldn't be "
+                    f"fetched from the alert channel: {e}"
+                )
+        return problems
+
+    async def alert_message(self):
+        """The job alert message, fetched again if it changed since it was last used."""
+        message = self._alert_message
+        if message is None or message.id != self.profile.alert_message_id:
+            message = await self.alert_channel.fetch_message(
+                self.profile.alert_message_id
+            )
+            self._alert_message = message
+        return message
+
+    def message_changed(self, message_id):
+        """Forget the alert message if that's the one that changed."""
+        if message_id == self.profile.alert_message_id:
+            self._alert_message = None
+
+    def is_council(self, member):
+        return any(role.id in self.council_roles for role in member.roles)
+
+    def cannot_have_nice_things(self, member):
+        return any(role.id in self.no_nice_things_roles for role in member.roles)
+
+    def is_on_hiatus(self, member):
+        return any(role.id in self.hiatus_roles for role in member.roles)
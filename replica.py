@@ -0,0 +1,203 @@
+"""Local read replica of the council and job spreadsheets.
+
+Read commands only need a handful of worksheets, and those change a few times a day.
+The replica keeps a copy of each in a SQLite file, refreshed in the background whenever
+Drive reports that its spreadsheet changed, so `!job`, `!dyna`, `!wishlist` and roster
+lookups are answered from local disk. They keep working through Sheets slowdowns and
+outages, and survive a restart. How current the copy is can be told from `as_of`.
+"""
+
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+import contextlib
+
+from gspread.utils import absolute_range_name, fill_gaps
+
+import drive
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS spreadsheets (
+    id TEXT PRIMARY KEY,
+    modified TEXT,
+    checked REAL
+);
+CREATE TABLE IF NOT EXISTS worksheets (
+    spreadsheet TEXT,
+    title TEXT,
+    rows TEXT,
+    PRIMARY KEY (spreadsheet, title)
+);
+"""
+
+
+class Replica:
+    """Copies of the tracked worksheets, kept in the SQLite database at `path`."""
+
+    def __init__(self, agcm, path):
+        self.agcm = agcm
+        self.path = path
+        # Spreadsheet URL -> titles of the worksheets to keep
+        self.tracked = {}
+        # Spreadsheet ID -> (Drive modifiedTime of the copy, when it was last confirmed)
+        self.versions = {}
+        # (spreadsheet ID, title) -> decoded rows, dropped whenever the copy changes
+        self.decoded = {}
+        self._lock = None
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+            for ss_id, modified, checked in db.execute(
+                "SELECT id, modified, checked FROM spreadsheets"
+            ):
+                self.versions[ss_id] = (modified, checked)
+
+    @property
+    def lock(self):
+        # Created lazily so it binds to the running loop, not whichever existed at import
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    @contextlib.contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def track(self, url, titles):
+        """Keep a copy of the given worksheets of the spreadsheet at `url`."""
+        self.tracked.setdefault(url, set()).update(titles)
+
+    async def refresh(self, urls=None):
+        """Re-copy every tracked spreadsheet that changed since it was last copied.
+
+        Given `urls`, only those of the tracked spreadsheets are checked.
+        """
+        async with self.lock:
+            ss_ids = {
+                url: drive.spreadsheet_id(url)
+                for url in self.tracked
+                if urls is None or url in urls
+            }
+            if not ss_ids:
+                return
+            try:
+                async with await drive.session(self.agcm) as session:
+                    metadata = await drive.files_metadata(
+                        self.agcm, session, list(ss_ids.values()), fields="modifiedTime"
+                    )
+            except Exception as e:
+                logging.warning(
+                    f"Couldn't check whether the replicated sheets changed: {e}"
+                )
+                return
+            for url, ss_id in ss_ids.items():
+                try:
+                    await self._refresh(url, self.tracked[url], metadata[ss_id])
+                except Exception as e:
+                    logging.warning(f"Couldn't refresh the replica of {url}: {e}")
+
+    async def _refresh(self, url, titles, metadata):
+        ss_id = drive.spreadsheet_id(url)
+        modified = metadata["modifiedTime"]
+        copied = self.versions.get(ss_id, (None, None))[0]
+        have_all = all(self.has(url, title) for title in titles)
+        loop = asyncio.get_running_loop()
+        if modified == copied and have_all:
+            checked = await loop.run_in_executor(None, self._confirm, ss_id)
+            self.versions[ss_id] = (modified, checked)
+            return
+
+        logging.info(f"Copying {len(titles)} worksheets of {url} to the replica...")
+        agc = await self.agcm.authorize()
+        ss = await agc.open_by_url(url)
+        titles = sorted(titles)
+        response = await ss.values_batch_get(
+            [absolute_range_name(title) for title in titles]
+        )
+        rows = {
+            title: fill_gaps(value_range.get("values", []))
+            for title, value_range in zip(titles, response["valueRanges"])
+        }
+        checked = await loop.run_in_executor(None, self._store, ss_id, modified, rows)
+        self.versions[ss_id] = (modified, checked)
+        for title in rows:
+            self.decoded.pop((ss_id, title), None)
+
+    # The two below run in an executor, so they only touch the database
+
+    def _store(self, ss_id, modified, rows):
+        checked = time.time()
+        with self._connect() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO worksheets (spreadsheet, title, rows) "
+                "VALUES (?, ?, ?)",
+                [(ss_id, title, json.dumps(values)) for title, values in rows.items()],
+            )
+            db.execute(
+                "INSERT OR REPLACE INTO spreadsheets (id, modified, checked) "
+                "VALUES (?, ?, ?)",
+                (ss_id, modified, checked),
+            )
+        return checked
+
+    def _confirm(self, ss_id):
+        checked = time.time()
+        with self._connect() as db:
+            db.execute(
+                "UPDATE spreadsheets SET checked = ? WHERE id = ?", (checked, ss_id)
+            )
+        return checked
+
+    def has(self, url, title):
+        key = (drive.spreadsheet_id(url), title)
+        if key in self.decoded:
+            return True
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT 1 FROM worksheets WHERE spreadsheet = ? AND title = ?", key
+            ).fetchone()
+        return row is not None
+
+    def values(self, url, title):
+        """Every row of a worksheet, padded to the same width, or None if not copied."""
+        key = (drive.spreadsheet_id(url), title)
+        if key not in self.decoded:
+            with self._connect() as db:
+                row = db.execute(
+                    "SELECT rows FROM worksheets WHERE spreadsheet = ? AND title = ?",
+                    key,
+                ).fetchone()
+            if row is None:
+                return None
+            self.decoded[key] = json.loads(row[0])
+        return self.decoded[key]
+
+    def column(self, url, title, col):
+        """A worksheet's column like `Worksheet.col_values`, or None if not copied."""
+        rows = self.values(url, title)
+        if rows is None:
+            return None
+        values = [row[col - 1] if col <= len(row) else "" for row in rows]
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def version(self, url):
+        """The Drive modifiedTime of the spreadsheet's copy, or None if not copied."""
+        return self.versions.get(drive.spreadsheet_id(url), (None, None))[0]
+
+    def as_of(self, *urls):
+        """When the copies of these spreadsheets were last confirmed current."""
+        checked = [
+            self.versions.get(drive.spreadsheet_id(url), (None, None))[1]
+            for url in urls
+        ]
+        if None in checked:
+            return None
+        return min(checked)
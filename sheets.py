@@ -0,0 +1,228 @@
+"""How MT Gardener paces, retries and guards its Sheets traffic.
+
+The pieces here don't need Google's client libraries, which are slow to import, so
+anything can use them. The client manager that puts them to work is in `sheets_client`.
+"""
+
+import time
+import random
+import asyncio
+import contextlib
+
+import metrics
+from governor import method_kind
+
+# Attempts at a request failing with a 5xx or network error before giving up on it.
+# Rate limited (429) requests are retried until they go through.
+MAX_ATTEMPTS = 5
+
+# Retries wait a random time up to BACKOFF_BASE * 2**attempt seconds, at most BACKOFF_CAP
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 64.0
+
+# Consecutive failed requests to one spreadsheet that open its circuit breaker, and how
+# many seconds it stays open before a single request is let through to try again
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 30
+
+
+class SheetsUnavailable(Exception):
+    """Raised instead of calling Google while a spreadsheet's circuit breaker is open."""
+
+
+def backoff(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """Seconds to wait before retry number `attempt`, with full jitter."""
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def call_labels(method):
+    """Metric labels describing which spreadsheet/worksheet a gspread call targets."""
+    target = getattr(method, "__self__", None)
+    worksheet = ""
+    spreadsheet = ""
+    if hasattr(target, "spreadsheet") and hasattr(target, "title"):
+        # gspread.Worksheet
+        worksheet = target.title
+        spreadsheet = getattr(target.spreadsheet, "title", "")
+    elif hasattr(target, "title") and hasattr(target, "id"):
+        # gspread.Spreadsheet
+        spreadsheet = target.title
+    return {
+        "spreadsheet": spreadsheet,
+        "worksheet": worksheet,
+        "method": getattr(method, "__name__", str(method)),
+    }
+
+
+def coalesce_key(method, args, kwargs):
+    """Identify a read so concurrent identical reads can share one request.
+
+    Keyed on the spreadsheet, worksheet, method and its arguments. Writes return None and
+    are never coalesced.
+    """
+    if method_kind(method) != "read":
+        return None
+    target = getattr(method, "__self__", None)
+    spreadsheet = getattr(getattr(target, "spreadsheet", None), "id", None)
+    worksheet = None
+    if spreadsheet is not None:
+        worksheet = getattr(target, "id", None)
+    else:
+        spreadsheet = getattr(target, "id", None)
+    return (
+        spreadsheet,
+        worksheet,
+        getattr(method, "__name__", str(method)),
+        repr(args),
+        repr(sorted(kwargs.items())),
+    )
+
+
+def breaker_key(method, args):
+    """The spreadsheet a gspread call is for, as far as circuit breaking goes."""
+    target = getattr(method, "__self__", None)
+    spreadsheet = getattr(getattr(target, "spreadsheet", None), "id", None)
+    if spreadsheet is None:
+        spreadsheet = getattr(target, "id", None)
+    name = getattr(method, "__name__", "")
+    if spreadsheet is None and name.startswith("open_by") and args:
+        # Opening a spreadsheet by key or URL. A URL is reduced to its key, so the
+        # spreadsheet has the one breaker however it's reached.
+        spreadsheet = args[0]
+        if name == "open_by_url":
+            # drive imports this module, so it's imported here rather than at the top
+            import drive
+
+            try:
+                spreadsheet = drive.spreadsheet_id(spreadsheet)
+            except AttributeError:
+                pass
+    return spreadsheet
+
+
+class CircuitBreaker:
+    """Fails fast on a spreadsheet Google keeps failing to serve.
+
+    After `threshold` consecutive failed requests (each counted once, after its retries
+    ran out) the breaker opens and requests are refused for
+    `cooldown` seconds. Then one request is let through: if it works the breaker closes,
+    otherwise it opens again.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened = None
+        self.trial = False
+
+    @property
+    def state(self):
+        if self.opened is None:
+            return "closed"
+        if time.monotonic() - self.opened >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial:
+            self.trial = True
+            return True
+        return False
+
+    def succeeded(self):
+        self.failures = 0
+        self.opened = None
+        self.trial = False
+
+    def failed(self):
+        self.failures += 1
+        if self.trial or self.failures >= self.threshold:
+            self.opened = time.monotonic()
+        self.trial = False
+
+    def abandoned(self):
+        """The request let through never finished, so let another one try."""
+        self.trial = False
+
+
+class SheetsLock:
+    """Reader/writer lock for commands that touch the sheets.
+
+    Any number of read-only commands can hold it at once, which lets their identical reads
+    be coalesced. Writers hold it alone, and a waiting writer holds off new readers so a
+    stream of `!job`s cannot starve a `!sync`. Given a timeout, waiting for it raises
+    asyncio.TimeoutError once that many seconds have passed.
+    """
+
+    def __init__(self):
+        self.readers = 0
+        self.writing = False
+        self.writers_waiting = 0
+        self._condition = None
+
+    @property
+    def condition(self):
+        # Created lazily so it binds to the running loop, not whichever existed at import
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def would_wait(self, exclusive):
+        """Whether taking the lock right now would mean waiting for someone else."""
+        if exclusive:
+            return self.writing or bool(self.readers)
+        return self.writing or bool(self.writers_waiting)
+
+    @contextlib.asynccontextmanager
+    async def shared(self, timeout=None):
+        start = time.perf_counter()
+        async with self.condition:
+            await asyncio.wait_for(
+                self.condition.wait_for(
+                    lambda: not self.writing and not self.writers_waiting
+                ),
+                timeout,
+            )
+            self.readers += 1
+        metrics.observe(
+            "mtgardener_lock_wait_seconds", time.perf_counter() - start, mode="shared"
+        )
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.readers -= 1
+                self.condition.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def exclusive(self, timeout=None):
+        start = time.perf_counter()
+        async with self.condition:
+            self.writers_waiting += 1
+            try:
+                await asyncio.wait_for(
+                    self.condition.wait_for(
+                        lambda: not self.writing and not self.readers
+                    ),
+                    timeout,
+                )
+            finally:
+                self.writers_waiting -= 1
+                # Readers held off by this writer may be able to go if it gave up
+                self.condition.notify_all()
+            self.writing = True
+        metrics.observe(
+            "mtgardener_lock_wait_seconds",
+            time.perf_counter() - start,
+            mode="exclusive",
+        )
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.writing = False
+                self.condition.notify_all()
@@ -0,0 +1,235 @@
+"""Google Sheets client manager used by MT Gardener.
+
+Every gspread call made through gspread_asyncio funnels through
+`AsyncioGspreadClientManager._call`, so that is where the bot hooks in to
+observe (and later, shape) its traffic to the Sheets API.
+"""
+
+import time
+import asyncio
+import logging
+import contextvars
+
+import gspread_asyncio
+from google.oauth2.service_account import Credentials
+
+import metrics
+import sync_plan
+from governor import method_kind
+from sheets import (
+    MAX_ATTEMPTS,
+    SheetsUnavailable,
+    CircuitBreaker,
+    backoff,
+    breaker_key,
+    call_labels,
+    coalesce_key,
+)
+
+# When the current call's request was actually sent to Google
+_issued_at = contextvars.ContextVar("sheets_issued_at", default=None)
+
+
+class _Retry(Exception):
+    """Carries a retryable error out of gspread_asyncio's retry loop.
+
+    That loop sleeps with the client's call lock held, stalling every other request, so
+    the manager backs off outside of it instead.
+    """
+
+    def __init__(self, error, status):
+        super().__init__(error)
+        self.error = error
+        self.status = status
+
+
+def service_account_credentials(path):
+    """Load and scope the service account credentials the bot talks to Google with."""
+    creds = Credentials.from_service_account_file(path)
+    scoped = creds.with_scopes(
+        [
+            "https://spreadsheets.google.com/feeds",
+            "https://www.googleapis.com/auth/spreadsheets",
+            "https://www.googleapis.com/auth/drive",
+        ]
+    )
+    return scoped
+
+
+class GardenerClientManager(gspread_asyncio.AsyncioGspreadClientManager):
+    """Client manager that records latency, call counts and API errors for every Sheets call.
+
+    When given a SheetsGovernor, every request (including retries) waits for a token from
+    the governor instead of gspread_asyncio's fixed delay between calls.
+
+    Identical reads that are in flight at the same time are single-flighted: the first
+    caller issues the request and everyone else awaits its result.
+
+    Rate limited, 5xx and network failures are retried with exponential backoff and jitter
+    rather than gspread_asyncio's fixed delay, and a rate limit empties the governor's
+    bucket so everything slows down together. Each spreadsheet has a CircuitBreaker, so
+    during an outage callers get SheetsUnavailable right away instead of waiting on
+    retries.
+    """
+
+    def __init__(self, *args, governor=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.governor = governor
+        self.inflight = {}
+        self.breakers = {}
+
+    def breaker(self, method, args):
+        key = breaker_key(method, args)
+        if key not in self.breakers:
+            self.breakers[key] = CircuitBreaker()
+        return self.breakers[key]
+
+    async def _call(self, method, *args, **kwargs):
+        key = coalesce_key(method, args, kwargs)
+        if key is None:
+            return await self._instrumented_call(method, *args, **kwargs)
+
+        if key in self.inflight:
+            metrics.inc("mtgardener_sheets_coalesced_total", **call_labels(method))
+            return await asyncio.shield(self.inflight[key])
+
+        # Run the request as its own task, so one caller giving up doesn't cancel it for
+        # everyone else waiting on it
+        request = asyncio.ensure_future(
+            self._instrumented_call(method, *args, **kwargs)
+        )
+        self.inflight[key] = request
+
+        def forget(request):
+            if self.inflight.get(key) is request:
+                del self.inflight[key]
+            if not request.cancelled():
+                request.exception()
+
+        request.add_done_callback(forget)
+        return await asyncio.shield(request)
+
+    async def _instrumented_call(self, method, *args, **kwargs):
+        labels = call_labels(method)
+        plan = sync_plan.current_plan.get()
+        if plan is not None:
+            if method_kind(method) == "write":
+                raise sync_plan.DryRunWrite(
+                    f"{labels['method']} would have written during a dry run"
+                )
+            plan.read(labels, args)
+        breaker = self.breaker(method, args)
+        # Once let through, a request makes all its attempts
+        if not breaker.allow():
+            metrics.inc(
+                "mtgardener_sheets_breaker_rejected_total",
+                spreadsheet=labels["spreadsheet"],
+            )
+            raise SheetsUnavailable(
+                f"Google Sheets is failing for {labels['spreadsheet'] or 'this spreadsheet'}, "
+                f"not trying again for a while"
+            )
+        attempt = 0
+        while True:
+            try:
+                result = await self._attempt(method, labels, *args, **kwargs)
+            except _Retry as retry:
+                attempt += 1
+                if retry.status != 429 and attempt >= MAX_ATTEMPTS:
+                    # The breaker counts failed requests, not attempts
+                    breaker.failed()
+                    self._report_breaker(breaker, labels)
+                    raise retry.error from None
+                delay = backoff(attempt)
+                metrics.inc(
+                    "mtgardener_sheets_retries_total",
+                    status=retry.status or "network",
+                    method=labels["method"],
+                )
+                logging.warning(
+                    f"Sheets call {labels['method']} failed ({retry.status or retry.error}), "
+                    f"retrying in {delay:.1f}s."
+                )
+                await asyncio.sleep(delay)
+                continue
+            except asyncio.CancelledError:
+                # A request that never finished says nothing about the spreadsheet
+                breaker.abandoned()
+                raise
+            except Exception:
+                # Any other error was Google answering, so it's up
+                self._close_breaker(breaker, labels)
+                raise
+            self._close_breaker(breaker, labels)
+            return result
+
+    def _close_breaker(self, breaker, labels):
+        was_failing = breaker.failures or breaker.opened is not None
+        breaker.succeeded()
+        if was_failing:
+            self._report_breaker(breaker, labels)
+
+    def _report_breaker(self, breaker, labels):
+        metrics.set_gauge(
+            "mtgardener_sheets_breaker_open",
+            int(breaker.state != "closed"),
+            spreadsheet=labels["spreadsheet"],
+        )
+
+    async def _attempt(self, method, labels, *args, **kwargs):
+        status = "ok"
+        start = time.perf_counter()
+        _issued_at.set(None)
+        try:
+            if self.governor:
+                await self.governor.acquire(
+                    method_kind(method), cost=kwargs.get("api_call_count", 1)
+                )
+            return await super()._call(method, *args, **kwargs)
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            end = time.perf_counter()
+            metrics.inc("mtgardener_sheets_calls_total", status=status, **labels)
+            metrics.observe(
+                "mtgardener_sheets_call_seconds", end - start, method=labels["method"]
+            )
+            issued_at = _issued_at.get()
+            if issued_at is not None:
+                # Time spent behind the governor and the client's call lock
+                metrics.observe(
+                    "mtgardener_sheets_wait_seconds",
+                    issued_at - start,
+                    method=labels["method"],
+                )
+
+    async def before_gspread_call(self, method, args, kwargs):
+        _issued_at.set(time.perf_counter())
+        await super().before_gspread_call(method, args, kwargs)
+
+    async def handle_gspread_error(self, e, method, args, kwargs):
+        labels = call_labels(method)
+        code = e.response.status_code
+        metrics.inc(
+            "mtgardener_sheets_api_errors_total",
+            status=code,
+            spreadsheet=labels["spreadsheet"],
+        )
+        if code == 429:
+            metrics.inc(
+                "mtgardener_sheets_rate_limited_total",
+                spreadsheet=labels["spreadsheet"],
+                worksheet=labels["worksheet"],
+            )
+            if self.governor:
+                # Google thinks we're over quota even if the governor doesn't
+                self.governor.throttle(method_kind(method))
+        raise _Retry(e, code)
+
+    async def handle_requests_error(self, e, method, args, kwargs):
+        raise _Retry(e, None)
+
+    async def delay(self):
+        if not self.governor:
+            return await super().delay()
@@ -0,0 +1,156 @@
+"""Dry runs of the wishlist sync, to see what one would cost before running it.
+
+While a SyncPlan is recording, the sync code runs as usual except that nothing is
+written. The Sheets client notes every request it makes and refuses writes, Drive
+lookups are noted, and write buffers note the requests they would have sent instead of
+sending them. Reads still go to Google, since what a sync writes depends on what it
+reads. That keeps the plan exact, but it costs the same reads as the sync itself, so a
+full resync is planned from a sample of wishlists and scaled up to all of them.
+"""
+
+import math
+import contextlib
+import contextvars
+
+# Wishlists actually read when planning a full resync
+SAMPLE_SIZE = 3
+
+# Rows in the breakdown of reads
+READ_ROWS = 12
+
+# The plan the current task's Sheets and Drive requests are recorded on, if any
+current_plan = contextvars.ContextVar("sync_plan", default=None)
+
+
+class DryRunWrite(Exception):
+    """Something tried to write to the sheets while a plan was recording."""
+
+
+@contextlib.contextmanager
+def recording(plan):
+    """Record the enclosed code's requests on `plan`, and don't let it write."""
+    token = current_plan.set(plan)
+    try:
+        yield plan
+    finally:
+        current_plan.reset(token)
+
+
+class SyncPlan:
+    """The requests a sync made, or would have made, with nothing written."""
+
+    def __init__(self):
+        # The wishlist being synced, or None for work done once per sync
+        self.wishlist = None
+        # (wishlist, what was read) per Sheets read
+        self.reads = []
+        # File ID of each Drive lookup
+        self.drive = []
+        # Drive HTTP requests, and the most files the caller puts in one
+        self.drive_requests = 0
+        self.drive_batch_size = 1
+        # (kind, ranges, cells) per write request that would have been sent
+        self.writes = []
+        # Wishlists looked at, and how many there were if that was a sample
+        self.sampled = []
+        self.due = None
+
+    def read(self, labels, args):
+        where = labels["worksheet"] or labels["spreadsheet"] or "(opening)"
+        detail = ", ".join(str(arg) for arg in args if isinstance(arg, (str, int)))
+        self.reads.append((self.wishlist, f"{where}: {labels['method']}({detail})"))
+
+    def drive_call(self, file_ids, batch_size=1):
+        """A Drive request looking up `file_ids`, from a caller sending up to
+        `batch_size` files per request."""
+        self.drive += file_ids
+        self.drive_requests += 1
+        self.drive_batch_size = max(self.drive_batch_size, batch_size)
+
+    def write(self, kind, cells):
+        """A write request, given the number of cells in each of its ranges."""
+        self.writes.append((kind, len(cells), sum(cells)))
+
+    def start_wishlist(self, name):
+        self.wishlist = name
+        self.sampled.append(name)
+
+    def totals(self, flush_every):
+        """Request and cell counts, scaled up to every due wishlist if this is a sample.
+
+        `flush_every` is how many ranges a write buffer holds before sending them.
+        """
+        shared = sum(1 for wishlist, _ in self.reads if wishlist is None)
+        reads = len(self.reads) - shared
+        drive = len(self.drive)
+        drive_requests = self.drive_requests
+        ranges = sum(ranges for _, ranges, _ in self.writes)
+        cells = sum(cells for _, _, cells in self.writes)
+        write_requests = len(self.writes)
+        if self.due and self.sampled and self.due > len(self.sampled):
+            scale = self.due / len(self.sampled)
+            reads *= scale
+            cells *= scale
+            drive = self.due
+            drive_requests = math.ceil(drive / self.drive_batch_size)
+            ranges *= scale
+            # The buffer sends what it has every `flush_every` ranges
+            write_requests *= math.ceil(ranges / flush_every)
+        return {
+            "reads": shared + math.ceil(reads),
+            "writes": write_requests,
+            "drive": drive,
+            "drive_requests": drive_requests,
+            "ranges": math.ceil(ranges),
+            "cells": math.ceil(cells),
+        }
+
+    def render(self, title, totals, seconds):
+        """The plan written up for a discord message."""
+        lines = [title]
+        duration = (
+            f"{seconds / 60:.0f} minutes" if seconds >= 120 else f"{seconds:.0f}s"
+        )
+        if self.due and self.due > len(self.sampled):
+            lines.append(
+                f"Read {len(self.sampled)} of {self.due} wishlists and scaled up to all."
+            )
+        lines += [
+            "",
+            f"Sheets reads:    {totals['reads']}",
+            f"Sheets writes:   {totals['writes']} requests, {totals['ranges']} ranges, "
+            f"{totals['cells']} cells",
+            f"Drive lookups:   {totals['drive']} files in "
+            f"{totals['drive_requests']} requests",
+            f"API calls:       "
+            f"{totals['reads'] + totals['writes'] + totals['drive_requests']}",
+            f"At least {duration} under the current request budgets",
+        ]
+
+        counts = {}
+        for _, what in self.reads:
+            counts[what] = counts.get(what, 0) + 1
+        if counts:
+            lines += ["", "Reads made while planning:"]
+            rows = sorted(counts.items(), key=lambda item: -item[1])
+            for what, count in rows[:READ_ROWS]:
+                lines.append(f"  {count}x {what}")
+            if len(rows) > READ_ROWS:
+                lines.append(f"  ...and {len(rows) - READ_ROWS} more")
+
+        kinds = {}
+        for kind, ranges, cells in self.writes:
+            requests, total_ranges, total_cells = kinds.get(kind, (0, 0, 0))
+            kinds[kind] = (requests + 1, total_ranges + ranges, total_cells + cells)
+        if kinds:
+            sample = (
+                " (from the sample)"
+                if self.due and self.due > len(self.sampled)
+                else ""
+            )
+            lines += ["", f"Writes held back{sample}:"]
+            for kind, (requests, ranges, cells) in kinds.items():
+                lines.append(
+                    f"  {kind}: {requests} requests, {ranges} ranges, {cells} cells"
+                )
+        return "\n".join(lines)
@@ -0,0 +1,75 @@
+"""Deciding when each wishlist is next worth syncing.
+
+Kept apart from the sync itself, so guild profiles can own a schedule without importing
+the Sheets and Drive clients.
+"""
+
+import time
+import statistics
+import collections
+
+import arrow
+
+# Least often a wishlist is checked, however long it's gone without an edit
+MAX_CHECK_INTERVAL = 12 * 60 * 60
+
+# How many recent edits are remembered per wishlist
+EDIT_HISTORY = 5
+
+# Once a wishlist has gone this many of its usual gaps without an edit, its old rhythm no
+# longer says anything about when the next edit is coming
+RHYTHM_GAPS = 4
+
+
+class SyncSchedule:
+    """When each wishlist is next worth asking Drive about.
+
+    A wishlist is checked again after a quarter of the time since it was last edited (or of
+    its usual gap between edits, if that's shorter and the wishlist hasn't gone several of
+    those gaps without an edit), between `min_interval` and `max_interval`. Wishlists being worked on are checked every cycle, ones nobody has
+    touched in weeks a couple of times a day. Within `boost` seconds before a scheduled
+    event, when members tend to be making their changes, everything is checked every cycle.
+    """
+
+    def __init__(self, min_interval, max_interval=MAX_CHECK_INTERVAL, boost=0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.boost = boost
+        self.edits = {}
+        self.next_check = {}
+        self.events = []
+
+    def add_event(self, when):
+        now = time.time()
+        self.events = [event for event in self.events if event > now] + [when]
+
+    def boosted(self, now):
+        return any(event - self.boost <= now <= event for event in self.events)
+
+    def due(self, ss_id, now=None):
+        now = time.time() if now is None else now
+        return self.boosted(now) or now >= self.next_check.get(ss_id, 0)
+
+    def interval(self, ss_id, now):
+        edits = self.edits.get(ss_id)
+        if not edits:
+            return self.min_interval
+        quiet = now - edits[-1]
+        gaps = [later - earlier for earlier, later in zip(edits, list(edits)[1:])]
+        if gaps:
+            usual = statistics.median(gaps)
+            # A burst of edits long ago shouldn't keep the wishlist checked every run
+            if quiet <= usual * RHYTHM_GAPS:
+                quiet = min(quiet, usual)
+        return min(max(quiet / 4, self.min_interval), self.max_interval)
+
+    def observe(self, ss_id, modified_time, now=None):
+        """Record what Drive said about a wishlist and schedule its next check."""
+        now = time.time() if now is None else now
+        edits = self.edits.setdefault(ss_id, collections.deque(maxlen=EDIT_HISTORY))
+        modified = arrow.get(modified_time).timestamp()
+        if not edits or modified > edits[-1]:
+            edits.append(modified)
+        # Half a cycle early, so a wishlist due next cycle isn't missed by a cycle that
+        # starts a moment sooner than this one finished
+        self.next_check[ss_id] = now + self.interval(ss_id, now) - self.min_interval / 2
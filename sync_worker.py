@@ -0,0 +1,372 @@
+"""Standalone process for the wishlist sync.
+
+With `sync_worker: process` in the config, the periodic wishlist sync and on-demand
+`!sync` jobs run in a child process with its own event loop, Sheets client and share of
+the request budgets. The bot hands it jobs over the child's stdin and reads results back
+from its stdout, one JSON object per line, so a heavy sync cycle can't hold up commands
+or gateway heartbeats, and a crash in the sync only costs a restart of the worker.
+
+The worker is started as a script rather than through multiprocessing, whose spawned
+children re-import the bot's main module (config, logging, discord client and all).
+"""
+
+import os
+import sys
+import json
+import asyncio
+import logging
+import itertools
+import functools
+import traceback
+
+import logs
+import metrics
+import governor
+import write_buffer
+import wishlist_sync
+from sheets import SheetsLock
+from sync_schedule import SyncSchedule
+from sheets_client import GardenerClientManager, service_account_credentials
+
+# How long the bot waits on an on-demand job before giving up on it
+JOB_TIMEOUT = 600
+
+# Longest the supervisor waits before restarting a worker that keeps crashing
+MAX_RESTART_DELAY = 60
+
+# A worker that stays up this long is considered healthy again
+HEALTHY_UPTIME = 300
+
+
+class SyncWorkerError(Exception):
+    pass
+
+
+def _call_totals():
+    """Sheets and Drive requests made by this process so far."""
+    return {
+        "sheets_calls": sum(
+            value
+            for _, value in metrics.REGISTRY.series("mtgardener_sheets_calls_total")
+        ),
+        "drive_calls": sum(
+            value
+            for _, value in metrics.REGISTRY.series("mtgardener_drive_calls_total")
+        ),
+    }
+
+
+class _CallCounter:
+    """Requests made since the last result was reported back to the bot."""
+
+    def __init__(self):
+        self.reported = _call_totals()
+
+    def delta(self):
+        totals = _call_totals()
+        delta = {name: totals[name] - self.reported[name] for name in totals}
+        self.reported = totals
+        return delta
+
+
+async def _serve(settings, jobs, send):
+    agcm = GardenerClientManager(
+        functools.partial(service_account_credentials, settings["creds_path"]),
+        governor=governor.SheetsGovernor(
+            read_per_minute=settings["read_per_minute"],
+            write_per_minute=settings["write_per_minute"],
+            drive_per_minute=settings["drive_per_minute"],
+        ),
+        loop=asyncio.get_running_loop(),
+    )
+    counter = _CallCounter()
+    schedules = {
+        guild["council_url"]: SyncSchedule(
+            guild["interval"], boost=guild.get("boost", 0)
+        )
+        for guild in settings["guilds"]
+    }
+    # Writes to one guild's council sheet go one at a time
+    locks = {}
+
+    def lock_for(council_url):
+        if council_url not in locks:
+            locks[council_url] = SheetsLock()
+        return locks[council_url].exclusive
+
+    async def periodic(guild):
+        while True:
+            with logs.log_context("sync_wishlists"), governor.priority(
+                governor.BACKGROUND
+            ):
+                summary = await wishlist_sync.sync_cycle(
+                    agcm,
+                    guild["council_url"],
+                    lock=lock_for(guild["council_url"]),
+                    schedule=schedules[guild["council_url"]],
+                )
+            send(
+                {
+                    "id": None,
+                    "kind": "cycle",
+                    "guild": guild["name"],
+                    "ok": True,
+                    "summary": summary,
+                    **counter.delta(),
+                }
+            )
+            await asyncio.sleep(guild["interval"])
+
+    def reload(changes):
+        # The bot's `!reload` changed the config or loot mappings
+        agcm.governor.set_budgets(
+            changes["read_per_minute"],
+            changes["write_per_minute"],
+            changes["drive_per_minute"],
+        )
+        changed = {guild["council_url"]: guild for guild in changes["guilds"]}
+        for guild in settings["guilds"]:
+            if guild["council_url"] in changed:
+                guild.update(changed[guild["council_url"]])
+                schedule = schedules[guild["council_url"]]
+                schedule.min_interval = guild["interval"]
+                schedule.boost = guild.get("boost", 0)
+        try:
+            wishlist_sync.use_loot_mappings(wishlist_sync.load_loot_mappings())
+        except ValueError as e:
+            logging.error(f"Couldn't reload the loot mappings: {e}")
+        logging.info("Reloaded settings and loot mappings.")
+
+    async def handle(job):
+        result = {"id": job["id"], "kind": job["kind"], "ok": True, "summary": None}
+        council_url = job["council_url"]
+        with logs.log_context(job["kind"], job.get("correlation_id")):
+            try:
+                if job["kind"] == "sync_url":
+                    result["summary"] = {
+                        "complete": await wishlist_sync.sync_wishlist_url(
+                            agcm,
+                            council_url,
+                            job["wishlist_url"],
+                            lock=lock_for(council_url),
+                        )
+                    }
+                elif job["kind"] == "cycle":
+                    result["summary"] = await wishlist_sync.sync_cycle(
+                        agcm, council_url, lock=lock_for(council_url)
+                    )
+                else:
+                    raise SyncWorkerError(f"Unknown job kind: {job['kind']}")
+            except Exception as e:
+                logging.error(f"Sync job failed. {traceback.format_exc()}")
+                result.update(ok=False, error=str(e), error_type=type(e).__name__)
+        result.update(counter.delta())
+        send(result)
+
+    cycles = [asyncio.create_task(periodic(guild)) for guild in settings["guilds"]]
+    handlers = set()
+    # The bot closes our stdin to stop us
+    while line := await jobs.readline():
+        job = json.loads(line)
+        if job["kind"] == "event":
+            # A notice, not a job: nothing is sent back
+            if job["council_url"] in schedules:
+                schedules[job["council_url"]].add_event(job["when"])
+            continue
+        if job["kind"] == "reload":
+            reload(job)
+            continue
+        task = asyncio.create_task(handle(job))
+        handlers.add(task)
+        task.add_done_callback(handlers.discard)
+
+    for task in cycles + list(handlers):
+        task.cancel()
+    await asyncio.gather(*cycles, *handlers, return_exceptions=True)
+    await write_buffer.flush_all()
+
+
+async def _worker_main():
+    loop = asyncio.get_running_loop()
+    jobs = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(jobs), sys.stdin)
+    settings = json.loads(await jobs.readline())
+
+    listener = logs.setup_logging(settings["log_path"], settings["log_level"])
+    # stdout carries results, so nothing else may write to it
+    results = sys.stdout
+    sys.stdout = sys.stderr
+
+    def send(result):
+        results.write(json.dumps(result) + "\n")
+        results.flush()
+
+    logging.info("Sync worker started.")
+    try:
+        await _serve(settings, jobs, send)
+    finally:
+        logging.info("Sync worker stopped.")
+        listener.stop()
+
+
+class SyncWorker:
+    """The bot's handle on the sync worker process.
+
+    Starts the process, restarts it if it dies, and matches results coming back from it to
+    the jobs that were submitted. Results of the worker's own scheduled cycles are passed
+    to `on_cycle`, along with the name of the guild they were for.
+    """
+
+    def __init__(self, settings, on_cycle=None):
+        self.settings = settings
+        self.on_cycle = on_cycle
+        self.process = None
+        self.started = None
+        self.reader = None
+        self.supervisor = None
+        self.pending = {}
+        self.counter = itertools.count(1)
+        self.restarts = 0
+        self.stopping = False
+
+    async def _spawn(self):
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable,
+            os.path.abspath(__file__),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+        )
+        self.started = asyncio.get_running_loop().time()
+        self._write(self.settings)
+        self.reader = asyncio.create_task(self._read_results(self.process))
+        logging.info(f"Started sync worker process {self.process.pid}.")
+
+    async def start(self):
+        await self._spawn()
+        self.supervisor = asyncio.create_task(self._supervise())
+
+    def _write(self, message):
+        self.process.stdin.write((json.dumps(message) + "\n").encode())
+
+    def reload(self, settings):
+        """Hand the worker changed settings, and have it re-read the loot mappings.
+
+        They're kept for when it's next restarted, too.
+        """
+        self.settings.update(settings)
+        self.notify("reload", **settings)
+
+    def running(self):
+        return self.process is not None and self.process.returncode is None
+
+    def notify(self, kind, **payload):
+        """Tell the worker something it doesn't answer, like an upcoming event."""
+        if not self.running():
+            return
+        self._write({"id": None, "kind": kind, **payload})
+
+    async def submit(self, kind, timeout=JOB_TIMEOUT, **payload):
+        """Hand a job to the worker and wait for its result summary.
+
+        Raises SyncWorkerError straight away if the worker isn't running, e.g. while it's
+        being restarted, rather than leaving the caller waiting out the timeout.
+        """
+        if not self.running():
+            raise SyncWorkerError("Sync worker is not running")
+        job_id = next(self.counter)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[job_id] = future
+        try:
+            self._write(
+                {
+                    "id": job_id,
+                    "kind": kind,
+                    "correlation_id": logs.correlation_id.get(),
+                    **payload,
+                }
+            )
+            await self.process.stdin.drain()
+            result = await asyncio.wait_for(future, timeout)
+        except (BrokenPipeError, ConnectionResetError):
+            raise SyncWorkerError("Sync worker is not running")
+        finally:
+            self.pending.pop(job_id, None)
+
+        if not result["ok"]:
+            if result.get("error_type") == "ValueError":
+                raise ValueError(result["error"])
+            raise SyncWorkerError(result["error"])
+        return result["summary"]
+
+    def _record(self, result):
+        metrics.inc("mtgardener_sync_worker_sheets_calls_total", result["sheets_calls"])
+        metrics.inc("mtgardener_sync_worker_drive_calls_total", result["drive_calls"])
+        metrics.inc(
+            "mtgardener_sync_worker_jobs_total",
+            kind=result["kind"],
+            status="ok" if result["ok"] else "error",
+        )
+
+    async def _read_results(self, process):
+        async for line in process.stdout:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                logging.warning(f"Unexpected output from the sync worker: {line!r}")
+                continue
+
+            self._record(result)
+            if result["id"] is None:
+                if self.on_cycle:
+                    self.on_cycle(result["summary"], result["guild"])
+                continue
+            future = self.pending.get(result["id"])
+            if future and not future.done():
+                future.set_result(result)
+
+    def _fail_pending(self, reason):
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(SyncWorkerError(reason))
+        self.pending.clear()
+
+    async def _supervise(self):
+        while True:
+            code = await self.process.wait()
+            # Results it sent before exiting still count
+            await self.reader
+            if self.stopping:
+                self._fail_pending("Sync worker stopped")
+                return
+
+            logging.error(f"Sync worker exited with code {code}. Restarting...")
+            metrics.inc("mtgardener_sync_worker_restarts_total")
+            self._fail_pending("Sync worker crashed")
+
+            if asyncio.get_running_loop().time() - self.started > HEALTHY_UPTIME:
+                self.restarts = 0
+            await asyncio.sleep(min(2**self.restarts, MAX_RESTART_DELAY))
+            self.restarts += 1
+            await self._spawn()
+
+    async def stop(self, timeout=10):
+        self.stopping = True
+        if self.process is None or self.process.returncode is not None:
+            return
+
+        self.process.stdin.close()
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning("Sync worker did not stop in time. Terminating it.")
+            self.process.terminate()
+            await self.process.wait()
+        if self.supervisor:
+            await self.supervisor
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(_worker_main())
+    except KeyboardInterrupt:
+        pass
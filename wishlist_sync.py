@@ -0,0 +1,422 @@
+"""Wishlist sync: copying members' wishlist spreadsheets into the council sheets.
+
+Nothing here depends on the discord bot, so the same code runs inline on the bot's event
+loop or in the standalone sync worker process (see sync_worker.py).
+"""
+
+import re
+import time
+import logging
+import traceback
+import importlib.util
+
+import arrow
+
+import logs
+import drive
+import sync_plan
+import loot_mappings
+from write_buffer import WriteBuffer
+
+# The mappings loot_mappings.py must define. Dynamis has one per zone, which are merged.
+LOOT_MAPPINGS = (
+    "DYNAMIS_MAIN",
+    "DYNAMIS_ALT",
+    "SKY_MAIN",
+    "SKY_ALT",
+    "SEA_MAIN",
+    "SEA_ALT",
+    "LIMBUS_MAIN",
+    "LIMBUS_ALT",
+)
+WISHLIST_CELL_PATTERN = re.compile(r"^[^!]+![A-Z]+[0-9]+$")
+COUNCIL_COLUMN_PATTERN = re.compile(r"^[A-Z]+$")
+
+
+def compile_loot_mappings(module):
+    """Check a loot_mappings module and flatten it into {name: {wishlist cell: column}}.
+
+    Raises ValueError describing the first problem found.
+    """
+    compiled = {}
+    for name in LOOT_MAPPINGS:
+        if not hasattr(module, name):
+            raise ValueError(f"{name} is missing")
+        parts = getattr(module, name)
+        if not name.startswith("DYNAMIS"):
+            parts = [parts]
+        merged = {}
+        for part in parts:
+            if not isinstance(part, dict):
+                raise ValueError(f"{name} should map wishlist cells to council columns")
+            for cell, column in part.items():
+                if not WISHLIST_CELL_PATTERN.match(str(cell)):
+                    raise ValueError(
+                        f"{name}: {cell!r} isn't a wishlist cell like 'SKY!B3'"
+                    )
+                if not COUNCIL_COLUMN_PATTERN.match(str(column)):
+                    raise ValueError(
+                        f"{name}: {column!r} for {cell} isn't a council column like 'C'"
+                    )
+                merged[cell] = column
+        sheets = {cell[: cell.index("!")] for cell in merged}
+        if len(sheets) != 1:
+            raise ValueError(
+                f"{name} should read from one wishlist sheet, not {len(sheets)}"
+            )
+        compiled[name] = merged
+    return compiled
+
+
+def load_loot_mappings(path=None):
+    """Read and compile loot_mappings.py afresh, without touching the mappings in use."""
+    spec = importlib.util.spec_from_file_location(
+        "loot_mappings", path or loot_mappings.__file__
+    )
+    module = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(module)
+    except Exception as e:
+        raise ValueError(f"loot_mappings.py doesn't load: {e}") from e
+    return compile_loot_mappings(module)
+
+
+# The loot mappings in use. A sync reads them once, so it never mixes old and new.
+loot = compile_loot_mappings(loot_mappings)
+
+
+def use_loot_mappings(compiled):
+    """Sync with the given compiled mappings from now on."""
+    global loot
+    loot = compiled
+
+
+async def sync_cycle(
+    agcm, council_url, lock=None, schedule=None, force=False, limit=None
+):
+    """Check registered wishlists' Drive metadata and sync the ones that changed.
+
+    Writes to the council sheets are buffered for the whole cycle and flushed at the end.
+    `lock`, if given, is called to get an async context manager held around the flush.
+    With a SyncSchedule, only wishlists it says are due (and ones never synced) are
+    checked. With `force`, every registered wishlist is synced whether it changed or not.
+    `limit` stops after that many wishlists, for planning from a sample. Returns a
+    summary of the cycle.
+    """
+    logging.info("Syncing all wishlists...")
+    summary = {
+        "status": "ok",
+        "checked": 0,
+        "skipped": 0,
+        "synced": 0,
+        "up_to_date": 0,
+    }
+    cycle_start = time.perf_counter()
+    buffer = None
+    plan = sync_plan.current_plan.get()
+    # (file ID, modified time) of wishlists checked, and of those synced, for the
+    # schedule. Synced ones only count once their writes are flushed, so a failed
+    # sync is retried next cycle rather than put off.
+    observed = []
+    applied = []
+
+    try:
+        agc = await agcm.authorize()
+        council_ss = await agc.open_by_url(council_url)
+        buffer = WriteBuffer(council_ss, lock=lock)
+        logging.info("Pulling links and timestamps...")
+        wishlist_ws = await council_ss.worksheet("Wishlist Submissions")
+        wishlist_rows = await wishlist_ws.get_values("A:F")
+        ss_id_to_timestamps = {}
+
+        logging.info("Authorizing google drive metadata lookups...")
+        async with await drive.session(agcm) as session:
+            ss_ids = []
+            for i in range(1, len(wishlist_rows)):
+                wishlist_url = wishlist_rows[i][4]
+                if wishlist_rows[i][5] == "TRUE":
+                    continue
+
+                if not wishlist_url:
+                    continue
+
+                ss_id = None
+                try:
+                    ss_id = drive.spreadsheet_id(wishlist_url)
+                except Exception as e:
+                    logging.error(f"Invalid URL: " + wishlist_url)
+                    continue
+
+                never_synced = not wishlist_rows[i][2]
+                if (
+                    schedule
+                    and not force
+                    and not never_synced
+                    and not schedule.due(ss_id)
+                ):
+                    summary["skipped"] += 1
+                    continue
+
+                ss_ids.append(ss_id)
+                ss_id_to_timestamps[ss_id] = wishlist_rows[i][2]
+
+            if plan is not None:
+                plan.due = len(ss_ids)
+            if limit is not None:
+                ss_ids = ss_ids[:limit]
+
+            logging.info("Looking up wishlist metadata in batches...")
+            metadata = await drive.files_metadata(agcm, session, ss_ids)
+            logging.info("Done. Checking to see which lists need updating...")
+
+            for ss_id in ss_ids:
+                wishlist_metadata = metadata[ss_id]
+                if "error" in wishlist_metadata:
+                    # Left unobserved, so the schedule has it checked again next cycle
+                    logging.warning(
+                        f"Couldn't look up wishlist {ss_id} on Drive: "
+                        f"{wishlist_metadata['error']}"
+                    )
+                    continue
+                summary["checked"] += 1
+                mod_str = wishlist_metadata["modifiedTime"]
+                upd_str = ss_id_to_timestamps[wishlist_metadata["id"]]
+                web_link = wishlist_metadata["webViewLink"]
+                ss_name = wishlist_metadata["name"]
+                if plan is not None:
+                    plan.start_wishlist(ss_name)
+                if force:
+                    logging.info(f"Resyncing {ss_name}...")
+                elif not upd_str:
+                    logging.info(f"{ss_name} has never been updated. Updating...")
+                elif not is_synced(mod_str, upd_str):
+                    delta = arrow.now() - arrow.get(mod_str)
+                    delta_str = (
+                        f"{delta.days} days ago"
+                        if delta.days
+                        else f"{delta.seconds} seconds ago"
+                    )
+                    logging.info(f"{ss_name} is out of date ({delta_str}). Updating...")
+                else:
+                    summary["up_to_date"] += 1
+                    logs.log_sampled(
+                        logging.DEBUG,
+                        "sync.up_to_date",
+                        "%s - Up to date, no update needed.",
+                        ss_name,
+                    )
+                    observed.append((ss_id, mod_str))
+                    continue
+
+                wishlist_ss = await agc.open_by_url(web_link)
+                if await sync_apply(wishlist_ss, council_ss, buffer):
+                    summary["synced"] += 1
+                    applied.append((ss_id, mod_str))
+
+            logging.info(
+                f"{summary['up_to_date']} wishlists up to date, no update needed, "
+                f"{summary['skipped']} not due for a check."
+            )
+    except Exception as e:
+        summary["status"] = "error"
+        logging.error(
+            f"An error occurred while syncing wishlists. {traceback.format_exc()}"
+        )
+    finally:
+        # Whatever was synced before an error (or shutdown) still gets written
+        if buffer:
+            try:
+                await buffer.flush()
+                observed += applied
+            except Exception as e:
+                summary["status"] = "error"
+                logging.error(
+                    f"An error occurred while writing synced wishlists. {traceback.format_exc()}"
+                )
+    # A dry run mustn't put off the real check of a wishlist
+    if schedule and plan is None:
+        for ss_id, mod_str in observed:
+            schedule.observe(ss_id, mod_str)
+    summary["seconds"] = time.perf_counter() - cycle_start
+    return summary
+
+
+def is_synced(modified_time, synced_at):
+    """Whether a wishlist last modified at `modified_time` hasn't changed since it was
+    synced at `synced_at`, as written to column C of the wishlist submissions."""
+    if not synced_at:
+        return False
+    try:
+        return arrow.get(modified_time) <= arrow.get(synced_at)
+    except (TypeError, ValueError):
+        return False
+
+
+async def last_modified(agcm, wishlist_url):
+    """When Drive says the wishlist at `wishlist_url` was last edited. One Drive call.
+
+    Raises ValueError if the URL isn't a spreadsheet or Drive couldn't look it up.
+    """
+    try:
+        ss_id = drive.spreadsheet_id(wishlist_url)
+    except AttributeError:
+        raise ValueError(f"Wishlist URL is not valid: {wishlist_url}")
+    async with await drive.session(agcm) as session:
+        metadata = await drive.file_metadata(
+            agcm, session, ss_id, fields="modifiedTime"
+        )
+    if "modifiedTime" not in metadata:
+        raise ValueError(f"Drive couldn't look up {wishlist_url}: {metadata}")
+    return metadata["modifiedTime"]
+
+
+async def sync_wishlist_url(agcm, council_url, wishlist_url, lock=None):
+    """Sync a single wishlist on demand. Raises ValueError if the URL can't be opened.
+
+    Returns whether all of the wishlist was synced (see `sync_apply`).
+    """
+    agc = await agcm.authorize()
+    council_ss = await agc.open_by_url(council_url)
+
+    logging.info("Fetching wishlist sheet reference...")
+    try:
+        wishlist_ss = await agc.open_by_url(wishlist_url)
+    except Exception as e:
+        logging.error(e)
+        raise ValueError(f"Wishlist URL is not valid: {wishlist_url}")
+
+    buffer = WriteBuffer(council_ss, lock=lock)
+    complete = await sync_apply(wishlist_ss, council_ss, buffer)
+    await buffer.flush()
+    return complete
+
+
+async def sync_apply(wishlist_ss, council_ss, buffer=None):
+    """Copy one member's wishlist picks into the council sheets.
+
+    The writes are queued on `buffer` for the caller to flush. Without one they're
+    written before this returns. Returns whether every pick was copied. If any of them
+    failed, the wishlist isn't marked as synced, so it stays due for another try.
+    """
+    if buffer is None:
+        buffer = WriteBuffer(council_ss)
+        complete = await sync_apply(wishlist_ss, council_ss, buffer)
+        await buffer.flush()
+        return complete
+
+    mappings = loot
+
+    logging.info(f"Applying wishlist sync for {wishlist_ss.title}...")
+    council_dynamis_ws = await council_ss.worksheet("Dynamis Wishlists")
+    council_sky_ws = await council_ss.worksheet("Sky Requests")
+    council_sea_ws = await council_ss.worksheet("Sea Requests")
+    council_limbus_ws = await council_ss.worksheet("Limbus Requests")
+
+    logging.info("Looking up character names for wishlist sync...")
+    charname_main = None
+    charname_alt = None
+    try:
+        charname_main = (
+            (await wishlist_ss.values_get("INSTRUCTIONS!D2"))["values"][0][0]
+            .lower()
+            .strip()
+        )
+        charname_alt = (
+            (await wishlist_ss.values_get("INSTRUCTIONS!F2"))["values"][0][0]
+            .lower()
+            .strip()
+        )
+    except Exception as e:
+        pass
+
+    if not charname_main:
+        logging.error("Character names are not filled out!")
+        return False
+
+    logging.info(
+        f"  Syncing wishlist items for {charname_main}{' and ' + charname_alt if charname_alt else ''}..."
+    )
+
+    async def push_wishlist_updates(charname, mapping, wishlist_ss, council_ws):
+        dest = next(iter(mapping))
+        dest = dest[: dest.index("!")]
+        logs.log_sampled(
+            logging.INFO, "sync.pull", "%s: pulling from %s", charname, dest, limit=40
+        )
+        charname_col_values = [_.lower() for _ in await council_ws.col_values(1)]
+
+        row_index = None
+        try:
+            row_index = charname_col_values.index(charname) + 1
+        except:
+            logging.warning(f"Could not find {charname} in {council_ws}")
+            return
+
+        batch_gets = list(mapping.keys())
+        items_to_push = await wishlist_ss.values_batch_get(ranges=batch_gets)
+
+        logs.log_sampled(
+            logging.INFO,
+            "sync.push",
+            "%s: pushing to council sheet %s",
+            charname,
+            council_ws.title,
+            limit=40,
+        )
+        batch_updates = []
+        batch_clears = []
+        for item in items_to_push["valueRanges"]:
+            destination = mapping[item["range"]] + str(row_index)
+            if "values" in item:
+                batch_updates.append({"range": destination, "values": item["values"]})
+            else:
+                batch_clears.append(destination)
+
+        await buffer.clear(council_ws, batch_clears)
+        await buffer.update(council_ws, batch_updates)
+
+    try:
+        # Main
+        await push_wishlist_updates(
+            charname_main, mappings["DYNAMIS_MAIN"], wishlist_ss, council_dynamis_ws
+        )
+        await push_wishlist_updates(
+            charname_main, mappings["SKY_MAIN"], wishlist_ss, council_sky_ws
+        )
+        await push_wishlist_updates(
+            charname_main, mappings["SEA_MAIN"], wishlist_ss, council_sea_ws
+        )
+        await push_wishlist_updates(
+            charname_main, mappings["LIMBUS_MAIN"], wishlist_ss, council_limbus_ws
+        )
+
+        # Alt
+        if charname_alt:
+            await push_wishlist_updates(
+                charname_alt, mappings["DYNAMIS_ALT"], wishlist_ss, council_dynamis_ws
+            )
+            await push_wishlist_updates(
+                charname_alt, mappings["SKY_ALT"], wishlist_ss, council_sky_ws
+            )
+            await push_wishlist_updates(
+                charname_alt, mappings["SEA_ALT"], wishlist_ss, council_sea_ws
+            )
+            await push_wishlist_updates(
+                charname_alt, mappings["LIMBUS_ALT"], wishlist_ss, council_limbus_ws
+            )
+    except Exception as e:
+        logging.error(f"Couldn't sync all of {wishlist_ss.title}: {e}")
+        return False
+
+    # TODO: clean this up
+    wishlist_lookups = await council_ss.worksheet("Wishlist Submissions")
+    charnames = [_.lower() for _ in (await wishlist_lookups.col_values(1))]
+    update_index = charnames.index(charname_main.lower()) + 1
+    # Queued last, so it's only written if the picks above were
+    await buffer.update(
+        wishlist_lookups,
+        [{"range": f"C{update_index}", "values": [[str(arrow.utcnow())]]}],
+        value_input_option="USER_ENTERED",
+    )
+    logging.info("Done!")
+    return True
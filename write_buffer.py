@@ -0,0 +1,262 @@
+"""Write-behind buffer for spreadsheet writes.
+
+Syncing one wishlist clears and rewrites a row on four council worksheets and stamps its
+"Updated" cell, which used to be nine write requests per wishlist. A WriteBuffer collects
+those writes instead and sends them as a few spreadsheet-wide `values:batchClear` and
+`values:batchUpdate` requests when flushed.
+
+Writes land in the order they were made: a write only joins an earlier request if nothing
+queued between them touches the same cells. A flush stops at the first request that
+fails and drops everything after it, so whatever a caller writes last (like the
+"Updated" timestamp) is only written if everything before it was.
+
+While a sync_plan.SyncPlan is recording, flushing records the requests on it rather than
+sending them.
+"""
+
+import asyncio
+import logging
+
+from gspread.utils import a1_range_to_grid_range, absolute_range_name
+
+import metrics
+import sync_plan
+
+# Flush on its own once this many ranges are waiting, to keep requests a sane size
+MAX_PENDING_RANGES = 2000
+
+# Buffers holding writes that haven't been sent yet
+_unflushed = set()
+
+
+def _extent(range_name, values=None):
+    """The rows and columns a write touches, as 0-based (start, end) pairs.
+
+    An end of None means the range is open-ended in that direction. An update covers as
+    much of the sheet as its values do, starting from the range's first cell.
+    """
+    grid = a1_range_to_grid_range(range_name)
+    rows = (grid.get("startRowIndex", 0), grid.get("endRowIndex"))
+    cols = (grid.get("startColumnIndex", 0), grid.get("endColumnIndex"))
+    if values is not None:
+        rows = (rows[0], rows[0] + len(values))
+        cols = (cols[0], cols[0] + max((len(row) for row in values), default=0))
+    return rows, cols
+
+
+def _cells(name, values=None):
+    """How many cells a write to an absolute range covers. Open-ended ranges count as
+    one."""
+    if values is not None:
+        return sum(len(row) for row in values)
+    (row_start, row_end), (col_start, col_end) = _extent(name.rsplit("!", 1)[-1])
+    if row_end is None or col_end is None:
+        return 1
+    return (row_end - row_start) * (col_end - col_start)
+
+
+def _spans_overlap(first, second):
+    return (second[1] is None or first[0] < second[1]) and (
+        first[1] is None or second[0] < first[1]
+    )
+
+
+def _overlaps(a, b):
+    return _spans_overlap(a[0], b[0]) and _spans_overlap(a[1], b[1])
+
+
+class _Extents:
+    """The cells a request's writes touch on one worksheet.
+
+    Nearly every write covers part of a single row, so those are kept by row and a write
+    is only compared with others in the rows it covers. Writes spanning several rows are
+    few and compared with everything.
+    """
+
+    def __init__(self):
+        # Row -> column spans written in it
+        self.rows = {}
+        # Extents covering more than one row, or open-ended
+        self.wide = []
+
+    def add(self, extent):
+        (row_start, row_end), cols = extent
+        if row_end == row_start + 1:
+            self.rows.setdefault(row_start, []).append(cols)
+        else:
+            self.wide.append(extent)
+
+    def overlaps(self, extent):
+        if any(_overlaps(extent, other) for other in self.wide):
+            return True
+        (row_start, row_end), cols = extent
+        if row_end == row_start + 1:
+            rows = [self.rows.get(row_start, ())]
+        elif row_end is not None and row_end - row_start < len(self.rows):
+            rows = [self.rows.get(row, ()) for row in range(row_start, row_end)]
+        else:
+            rows = [
+                spans
+                for row, spans in self.rows.items()
+                if _spans_overlap((row, row + 1), (row_start, row_end))
+            ]
+        return any(_spans_overlap(cols, other) for spans in rows for other in spans)
+
+
+class _Request:
+    """Writes of one kind that go out together as a single request."""
+
+    def __init__(self, kind, value_input_option):
+        self.kind = kind
+        self.value_input_option = value_input_option
+        # Absolute range -> values, or None for clears. A later write to the exact same
+        # range replaces the earlier one.
+        self.writes = {}
+        # Worksheet title -> _Extents
+        self.extents = {}
+
+    @property
+    def key(self):
+        return (self.kind, self.value_input_option)
+
+    def touches(self, title, extent):
+        return title in self.extents and self.extents[title].overlaps(extent)
+
+    def add(self, title, range_name, values, extent):
+        name = absolute_range_name(title, range_name)
+        self.writes.pop(name, None)
+        self.writes[name] = values
+        self.extents.setdefault(title, _Extents()).add(extent)
+
+
+class WriteBuffer:
+    """Collects writes to one spreadsheet and sends them in as few requests as it can.
+
+    `lock`, if given, is called to get an async context manager held while flushing.
+    """
+
+    def __init__(self, spreadsheet, lock=None, max_pending=MAX_PENDING_RANGES):
+        self.spreadsheet = spreadsheet
+        self.sheets_lock = lock
+        self.max_pending = max_pending
+        self.requests = []
+        self._lock = None
+
+    @property
+    def lock(self):
+        # Created lazily so it binds to the running loop, not whichever existed at import
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    @property
+    def pending(self):
+        return sum(len(request.writes) for request in self.requests)
+
+    def _add(self, kind, value_input_option, title, range_name, values=None):
+        key = (kind, value_input_option)
+        extent = _extent(range_name, values)
+
+        # The write goes in after the last request that touches the same cells
+        start = 0
+        for i in reversed(range(len(self.requests))):
+            if self.requests[i].touches(title, extent):
+                start = i
+                break
+        for request in self.requests[start:]:
+            if request.key == key:
+                break
+        else:
+            request = _Request(kind, value_input_option)
+            self.requests.append(request)
+
+        request.add(title, range_name, values, extent)
+        _unflushed.add(self)
+        metrics.inc("mtgardener_buffered_writes_total", kind=kind)
+
+    async def clear(self, worksheet, ranges):
+        """Queue clearing the given ranges of a worksheet, like `Worksheet.batch_clear`."""
+        for range_name in ranges:
+            self._add("clear", None, worksheet.title, range_name)
+        await self._flush_if_full()
+
+    async def update(self, worksheet, data, value_input_option="RAW"):
+        """Queue writing `{"range", "values"}` dicts, like `Worksheet.batch_update`."""
+        for value_range in data:
+            self._add(
+                "update",
+                value_input_option,
+                worksheet.title,
+                value_range["range"],
+                value_range["values"],
+            )
+        await self._flush_if_full()
+
+    async def _flush_if_full(self):
+        if self.pending >= self.max_pending:
+            await self.flush()
+
+    async def flush(self):
+        """Send everything queued so far, in order."""
+        async with self.lock:
+            if not self.requests:
+                return
+            if self.sheets_lock is None:
+                return await self._send_all()
+            async with self.sheets_lock():
+                return await self._send_all()
+
+    async def _send_all(self):
+        try:
+            while self.requests:
+                await self._send(self.requests[0])
+                # Only forgotten once sent, so a flush cut short by shutdown can resume
+                self.requests.pop(0)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Later writes may rely on the ones that failed, so they're dropped as well
+            dropped = self.pending
+            self.requests.clear()
+            logging.error(f"Write buffer flush failed, dropping {dropped} writes.")
+            raise
+        finally:
+            if not self.requests:
+                _unflushed.discard(self)
+
+    async def _send(self, request):
+        # gspread_asyncio doesn't wrap the spreadsheet-wide batch calls, so go through its
+        # client manager the way its own wrappers do
+        plan = sync_plan.current_plan.get()
+        if plan is not None:
+            plan.write(
+                request.kind,
+                [_cells(name, values) for name, values in request.writes.items()],
+            )
+            return
+        ss = self.spreadsheet
+        if request.kind == "clear":
+            await ss.agcm._call(
+                ss.ss.values_batch_clear, body={"ranges": list(request.writes)}
+            )
+        else:
+            await ss.agcm._call(
+                ss.ss.values_batch_update,
+                body={
+                    "valueInputOption": request.value_input_option,
+                    "data": [
+                        {"range": name, "values": values}
+                        for name, values in request.writes.items()
+                    ],
+                },
+            )
+        metrics.inc("mtgardener_write_buffer_requests_total", kind=request.kind)
+
+
+async def flush_all():
+    """Flush every buffer that still has writes queued, e.g. on shutdown."""
+    for buffer in list(_unflushed):
+        try:
+            await buffer.flush()
+        except Exception as e:
+            logging.error(f"Couldn't flush buffered writes: {e}")